@@ -0,0 +1,84 @@
+"""
+Compression benchmark for ingestion objects.
+
+Compresses every sample table in data/json_lines_s3_format with each codec
+supported by src.utils and reports the compression ratio and the encode /
+decode throughput (MB/s of uncompressed JSON).
+
+Usage (from the project root):
+    PYTHONPATH=$(pwd) python benchmarks/compression_benchmark.py [--repeat N]
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from src.utils import compress_bytes, decompress_bytes, zstandard
+
+SAMPLE_DIR = "data/json_lines_s3_format"
+CODECS = ["gzip", "zstd"]
+
+
+def time_call(func, repeat):
+    """Returns the result of func and the best wall time over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def benchmark_file(path, codec, repeat):
+    with open(path, "rb") as file:
+        raw = file.read()
+    compressed, encode_time = time_call(lambda: compress_bytes(raw, codec), repeat)
+    decompressed, decode_time = time_call(
+        lambda: decompress_bytes(compressed, codec), repeat
+    )
+    assert decompressed == raw
+    size_mb = len(raw) / 1024 / 1024
+    return {
+        "table": os.path.basename(path).split(".")[0],
+        "codec": codec,
+        "raw_bytes": len(raw),
+        "compressed_bytes": len(compressed),
+        "ratio": len(raw) / len(compressed),
+        "encode_mb_s": size_mb / encode_time if encode_time else float("inf"),
+        "decode_mb_s": size_mb / decode_time if decode_time else float("inf"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    codecs = [codec for codec in CODECS if codec != "zstd" or zstandard is not None]
+    paths = sorted(glob.glob(f"{SAMPLE_DIR}/*.jsonl"))
+    print(
+        f"{'table':<16}{'codec':<7}{'raw KB':>10}{'packed KB':>11}"
+        f"{'ratio':>8}{'enc MB/s':>10}{'dec MB/s':>10}"
+    )
+    totals = {codec: [0, 0] for codec in codecs}
+    for path in paths:
+        for codec in codecs:
+            result = benchmark_file(path, codec, args.repeat)
+            totals[codec][0] += result["raw_bytes"]
+            totals[codec][1] += result["compressed_bytes"]
+            print(
+                f"{result['table']:<16}{codec:<7}"
+                f"{result['raw_bytes'] / 1024:>10.1f}"
+                f"{result['compressed_bytes'] / 1024:>11.1f}"
+                f"{result['ratio']:>8.2f}"
+                f"{result['encode_mb_s']:>10.1f}"
+                f"{result['decode_mb_s']:>10.1f}"
+            )
+    for codec, (raw, packed) in totals.items():
+        print(f"all tables {codec}: ratio {raw / packed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
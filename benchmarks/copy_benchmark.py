@@ -0,0 +1,125 @@
+"""
+COPY TO STDOUT vs conn.run extraction benchmark.
+
+Loads the sales_order sample from data/json_lines_s3_format into a local
+PostgreSQL table, repeated --scale times, then times a full snapshot read
+through conn.run (row-at-a-time protocol decoding) against
+copy_rows_from_table (COPY CSV parsed back into typed rows in batches).
+
+Connection settings come from PGHOST / PGDATABASE / PGUSER / PGPASSWORD
+(defaulting to a local postgres database). The benchmark table is dropped
+afterwards.
+
+Usage (from the project root):
+    PYTHONPATH=$(pwd) python benchmarks/copy_benchmark.py [--scale N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import time
+
+from src.utils import (
+    copy_rows_from_table,
+    create_conn,
+    get_peak_memory_mb,
+    DEFAULT_BATCH_SIZE,
+)
+
+SAMPLE_FILE = "data/json_lines_s3_format/sales_order.jsonl"
+TABLE = "bench_sales_order"
+COLUMN_TYPES = [
+    ("sales_order_id", "integer"),
+    ("created_at", "timestamp without time zone"),
+    ("last_updated", "timestamp without time zone"),
+    ("design_id", "integer"),
+    ("staff_id", "integer"),
+    ("counterparty_id", "integer"),
+    ("units_sold", "integer"),
+    ("unit_price", "numeric"),
+    ("currency_id", "integer"),
+    ("agreed_delivery_date", "date"),
+    ("agreed_payment_date", "date"),
+    ("agreed_delivery_location_id", "integer"),
+]
+SQL_TYPES = {"numeric": "numeric(10, 2)"}
+
+
+def load_table(conn, scale):
+    """Creates the benchmark table and fills it with the sample scale times."""
+    columns = ", ".join(
+        f"{name} {SQL_TYPES.get(data_type, data_type)}"
+        for name, data_type in COLUMN_TYPES
+    )
+    conn.run(f"DROP TABLE IF EXISTS {TABLE}")
+    conn.run(f"CREATE TABLE {TABLE} ({columns})")
+    conn.run(f"CREATE TEMPORARY TABLE {TABLE}_sample (LIKE {TABLE})")
+    with open(SAMPLE_FILE) as file:
+        rows = [json.loads(line) for line in file if line.strip()]
+    placeholders = ", ".join(f":{name}" for name, _ in COLUMN_TYPES)
+    for row in rows:
+        conn.run(f"INSERT INTO {TABLE}_sample VALUES ({placeholders})", **row)
+    # Scale up server side so loading does not dominate the run
+    conn.run(
+        f"INSERT INTO {TABLE} SELECT s.* FROM {TABLE}_sample s, generate_series(1, :scale)",
+        scale=scale,
+    )
+    conn.run(f"DROP TABLE {TABLE}_sample")
+    return conn.run(f"SELECT COUNT(*) FROM {TABLE}")[0][0]
+
+
+def read_with_run(conn, batch_size):
+    return len(conn.run(f"SELECT * FROM {TABLE}"))
+
+
+def read_with_copy(conn, batch_size):
+    return sum(
+        len(batch)
+        for batch in copy_rows_from_table(conn, TABLE, COLUMN_TYPES, batch_size)
+    )
+
+
+def time_call(func, repeat):
+    """Returns the result of func and the best wall time over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    conn = create_conn(
+        {
+            "dbname": os.environ.get("PGDATABASE", "postgres"),
+            "username": os.environ.get("PGUSER", "postgres"),
+            "password": os.environ.get("PGPASSWORD", "password"),
+            "host": os.environ.get("PGHOST", "localhost"),
+        }
+    )
+    try:
+        total = load_table(conn, args.scale)
+        print(f"{TABLE}: {total} rows (scale {args.scale})")
+        print(f"{'method':<10}{'rows':>10}{'seconds':>10}{'rows/s':>12}")
+        for name, reader in [("conn.run", read_with_run), ("copy", read_with_copy)]:
+            count, elapsed = time_call(
+                lambda: reader(conn, args.batch_size), args.repeat
+            )
+            assert count == total
+            print(f"{name:<10}{count:>10}{elapsed:>10.3f}{count / elapsed:>12.0f}")
+        print(f"peak RSS {get_peak_memory_mb():.1f} MB")
+    finally:
+        conn.run(f"DROP TABLE IF EXISTS {TABLE}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
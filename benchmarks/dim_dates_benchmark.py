@@ -0,0 +1,105 @@
+"""
+Date dimension micro-benchmark.
+
+Builds a synthetic sales_order frame of --rows rows spread over three years,
+its date columns typed either as the JSON reader returns them (ISO strings)
+or as the Parquet reader does (timestamps and dates), and times
+_return_df_dim_dates against the previous row-by-row implementation, kept
+below for comparison. Both must produce the same dates; the quarter is
+compared separately as the old formula put March in Q2.
+
+Usage (from the project root):
+    PYTHONPATH=$(pwd) python benchmarks/dim_dates_benchmark.py [--rows N] [--repeat N]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.lambda_transform_utils import _return_df_dim_dates
+from src.utils import return_week
+
+DATE_COLUMNS = ["created_at", "last_updated", "agreed_delivery_date", "agreed_payment_date"]
+
+
+def legacy_dim_dates(df_totesys_sales_order):
+    """_return_df_dim_dates before vectorisation."""
+    df_reduced = df_totesys_sales_order.loc[:, DATE_COLUMNS]
+    for col in DATE_COLUMNS:
+        df_reduced[col] = df_reduced[col].astype(str).str[:10]
+    all_values = []
+    for x in list(df_reduced.values):
+        all_values += list(x)
+    unique_list_of_dates = sorted(set(all_values))
+    months_dict = {1: "january", 2: "february", 3: "march", 4: "april", 5: "may", 6: "june", 7: "july",
+                   8: "august", 9: "september", 10: "october", 11: "november", 12: "december"}
+    data = []
+    for d in unique_list_of_dates:
+        weekday_num, weekday_name = return_week(d)
+        data += [[f"{int(d[:4])}-{int(d[5:7]):02d}-{int(d[8:10]):02d}", int(d[:4]), int(d[5:7]), int(d[8:10]),
+                  weekday_num, weekday_name, months_dict[int(d[5:7])], (int(d[5:7]) // 3) + 1]]
+    columns = ["date_id", "year", "month", "day", "day_of_week", "day_name", "month_name", "quarter"]
+    return pd.DataFrame(data=data, columns=columns).set_index("date_id")
+
+
+def make_sales_order(rows, typed, seed=0):
+    """Returns a sales_order frame of its date columns only."""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2022-01-01T00:00:00.000")
+    created = start + rng.integers(0, 3 * 365 * 86_400_000, rows).astype("timedelta64[ms]")
+    updated = created + rng.integers(0, 30 * 86_400_000, rows).astype("timedelta64[ms]")
+    delivery = created.astype("datetime64[D]") + rng.integers(1, 60, rows).astype("timedelta64[D]")
+    payment = created.astype("datetime64[D]") + rng.integers(1, 60, rows).astype("timedelta64[D]")
+    if typed:
+        return pd.DataFrame({
+            "created_at": pd.Series(created),
+            "last_updated": pd.Series(updated),
+            "agreed_delivery_date": pd.Series(delivery).dt.date,
+            "agreed_payment_date": pd.Series(payment).dt.date,
+        })
+    return pd.DataFrame({
+        "created_at": np.datetime_as_string(created, unit="ms").astype(object),
+        "last_updated": np.datetime_as_string(updated, unit="ms").astype(object),
+        "agreed_delivery_date": np.datetime_as_string(delivery).astype(object),
+        "agreed_payment_date": np.datetime_as_string(payment).astype(object),
+    })
+
+
+def time_call(func, repeat):
+    """Returns the result of func and the best wall time over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"sales_order: {args.rows} rows")
+    print(f"{'input':<10}{'builder':<12}{'seconds':>10}{'rows/s':>14}{'speedup':>10}")
+    for name, typed in [("json", False), ("parquet", True)]:
+        df = make_sales_order(args.rows, typed)
+        legacy, legacy_s = time_call(lambda: legacy_dim_dates(df), args.repeat)
+        vectorised, vectorised_s = time_call(lambda: _return_df_dim_dates(df), args.repeat)
+        pd.testing.assert_frame_equal(
+            vectorised.drop(columns="quarter"), legacy.drop(columns="quarter"), check_index_type=False
+        )
+        assert (vectorised["quarter"] == (vectorised["month"] - 1) // 3 + 1).all()
+        for builder, elapsed in [("legacy", legacy_s), ("vectorised", vectorised_s)]:
+            print(
+                f"{name:<10}{builder:<12}{elapsed:>10.3f}{args.rows / elapsed:>14.0f}"
+                f"{legacy_s / elapsed:>9.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
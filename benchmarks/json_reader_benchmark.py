@@ -0,0 +1,126 @@
+"""
+Ingestion JSON reader benchmark.
+
+Uploads the sales_order and transaction samples (data/json_files as a JSON
+array, data/json_lines_s3_format as JSON Lines), each repeated --scale
+times, to a moto bucket and reads them back with:
+    baseline  read_s3_table_json as it was before the JSON Lines and
+              arrow readers: read the whole body, decode, double every
+              backslash, json.loads into dicts, then a DataFrame (JSON
+              Lines, which it predates, loaded line by line the same way)
+    arrow     read_s3_table_json: pyarrow's JSON reader on the object's
+              bytes with the table's ingestion schema
+Every read runs in a forked child so its peak RSS is measured from the
+same starting point.
+
+Usage (from the project root):
+    PYTHONPATH=$(pwd) python benchmarks/json_reader_benchmark.py [--scale N] [--repeat N]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import boto3
+import pandas as pd
+from moto import mock_aws
+
+from src.lambda_transform_utils import read_s3_table_json
+from src.s3_keys import build_table_key
+from src.utils import codec_from_key, decompress_bytes
+
+BUCKET = "benchmark-ingestion"
+DATETIME_STRING = "20250101_000000"
+SAMPLES = {
+    "json": "data/json_files/{table}.json",
+    "jsonl": "data/json_lines_s3_format/{table}.jsonl",
+}
+TABLES = ["sales_order", "transaction"]
+
+
+def baseline_read_s3_table_json(s3_client, s3_key, ingestion_bucket_name):
+    """read_s3_table_json before this series, taught JSON Lines and codecs."""
+    response = s3_client.get_object(Bucket=ingestion_bucket_name, Key=s3_key)
+    body = decompress_bytes(response["Body"].read(), codec_from_key(s3_key))
+    json_data = body.decode("utf-8").replace("\\", "\\\\")
+    if json_data.lstrip().startswith("["):
+        return pd.DataFrame(json.loads(json_data))
+    return pd.DataFrame([json.loads(line) for line in json_data.splitlines() if line.strip()])
+
+
+def scaled_body(path, scale):
+    """Returns the sample file's bytes with its records repeated scale times."""
+    with open(path, "rb") as file:
+        data = file.read().strip()
+    if data.startswith(b"["):
+        return b"[" + b",".join([data[1:-1]] * scale) + b"]"
+    return b"\n".join([data] * scale) + b"\n"
+
+
+def rss_mb(field):
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith(field):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure(reader, s3, key, repeat, results):
+    """Child process: best wall time over repeat reads and peak RSS growth."""
+    with open("/proc/self/clear_refs", "w") as file:
+        file.write("5")  # resets the peak RSS inherited from the parent
+    start_rss = rss_mb("VmRSS:")
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = reader(s3, key, BUCKET)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        rows = len(df)
+        del df
+    results.put((best, rss_mb("VmHWM:") - start_rss, rows))
+
+
+def run(reader, s3, key, repeat):
+    """Runs measure in a fork of this process, so each reader starts level."""
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    child = context.Process(target=measure, args=(reader, s3, key, repeat, results))
+    child.start()
+    result = results.get()
+    child.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="eu-west-2")
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        print(f"{'object':<24}{'MB':>7}{'reader':>10}{'rows':>10}{'seconds':>10}{'MB/s':>8}{'peak MB':>9}{'speedup':>9}")
+        for table in TABLES:
+            for file_format, path in SAMPLES.items():
+                body = scaled_body(path.format(table=table), args.scale)
+                key = build_table_key(table, DATETIME_STRING, f".{file_format}")
+                s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+                size_mb = len(body) / 1024 / 1024
+                baseline = None
+                for name, reader in [("baseline", baseline_read_s3_table_json), ("arrow", read_s3_table_json)]:
+                    elapsed, peak_mb, rows = run(reader, s3, key, args.repeat)
+                    baseline = baseline or elapsed
+                    print(
+                        f"{table + '.' + file_format:<24}{size_mb:>7.1f}{name:>10}{rows:>10}"
+                        f"{elapsed:>10.3f}{size_mb / elapsed:>8.1f}{peak_mb:>9.1f}{baseline / elapsed:>8.2f}x"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""
+End-to-end pipeline benchmark.
+
+For each scale factor, generates a synthetic ToteSys database with
+src.data_generator, then runs the extract, transform and load handlers
+in-process against moto S3 / Secrets Manager and a local PostgreSQL,
+recording per stage the wall time, rows/s, peak RSS and bytes written
+(objects put in S3 for extract and transform, warehouse table size for
+load) into a JSON results file.
+
+The source and warehouse databases are dedicated benchmark databases on
+the same server (created if missing); the warehouse one has its public
+schema rebuilt from db/build-data-wh.sql on every run. Connection settings
+come from PGHOST / PGUSER / PGPASSWORD. Peak RSS is the kernel high-water
+mark, reset before each stage where /proc/self/clear_refs allows it, and
+includes the objects moto keeps in memory.
+
+Usage (from the project root):
+    PYTHONPATH=$(pwd) python benchmarks/pipeline_benchmark.py [--scales 0.1,1,5]
+        [--seed N] [--extract-event '{"output_format": "parquet"}']
+        [--output benchmarks/results.json]
+    PYTHONPATH=$(pwd) python benchmarks/pipeline_benchmark.py
+        --compare baseline.json results.json [--threshold 0.1]
+
+--compare exits with status 1 if any stage's wall time or peak RSS grew by
+more than the threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import boto3
+from moto import mock_aws
+from pg8000.native import Connection
+
+from src.data_generator import generate_totesys, insert_into_postgres, load_samples
+from src.utils import drop_cached_conn, get_peak_memory_mb, read_batch_manifest, reset_peak_memory
+
+REGION = "eu-west-2"
+INGESTION_BUCKET = "benchmark-ingestion"
+PROCESSED_BUCKET = "totesys-processed-zone-fenor"
+EXTRACT_SECRET = "benchmark-totesys-credentials"
+LOAD_SECRET = "benchmark-warehouse-credentials"
+WAREHOUSE_DDL = "db/build-data-wh.sql"
+STAGES = ["generate", "extract", "transform", "load"]
+COMPARED_METRICS = ["wall_s", "peak_rss_mb"]
+
+
+def connect(database):
+    return Connection(
+        database=database,
+        user=os.environ.get("PGUSER", "postgres"),
+        password=os.environ.get("PGPASSWORD", "password"),
+        host=os.environ.get("PGHOST", "localhost"),
+    )
+
+
+def ensure_database(database):
+    """Creates the database if it does not exist yet."""
+    conn = connect(os.environ.get("PGDATABASE", "postgres"))
+    try:
+        if not conn.run("SELECT 1 FROM pg_database WHERE datname = :name", name=database):
+            conn.run(f"CREATE DATABASE {database}")
+    finally:
+        conn.close()
+
+
+def reset_warehouse(conn):
+    """Rebuilds the warehouse tables, skipping the psql-only database statements."""
+    conn.run("DROP SCHEMA public CASCADE")
+    conn.run("CREATE SCHEMA public")
+    with open(WAREHOUSE_DDL) as file:
+        lines = [
+            line
+            for line in file
+            if not line.startswith(("\\", "DROP DATABASE", "CREATE DATABASE"))
+        ]
+    for statement in "".join(lines).split(";"):
+        if statement.strip():
+            conn.run(statement)
+
+
+def warehouse_bytes(conn):
+    return conn.run(
+        "SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0) FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = 'public' AND c.relkind = 'r'"
+    )[0][0]
+
+
+def setup_aws(source_db, warehouse_db):
+    """Creates the buckets and the two database secrets in moto."""
+    s3 = boto3.client("s3", region_name=REGION)
+    for bucket in [INGESTION_BUCKET, PROCESSED_BUCKET]:
+        s3.create_bucket(
+            Bucket=bucket, CreateBucketConfiguration={"LocationConstraint": REGION}
+        )
+    secrets = boto3.client("secretsmanager", region_name=REGION)
+    host = os.environ.get("PGHOST", "localhost")
+    user = os.environ.get("PGUSER", "postgres")
+    password = os.environ.get("PGPASSWORD", "password")
+    secrets.create_secret(
+        Name=EXTRACT_SECRET,
+        SecretString=json.dumps(
+            {"dbname": source_db, "username": user, "password": password, "host": host}
+        ),
+    )
+    secrets.create_secret(
+        Name=LOAD_SECRET,
+        SecretString=json.dumps(
+            {"database": warehouse_db, "user": user, "password": password, "host": host}
+        ),
+    )
+    return s3
+
+
+def empty_buckets(s3):
+    """Drops the previous scale's objects so moto's memory does not accumulate."""
+    for bucket in [INGESTION_BUCKET, PROCESSED_BUCKET]:
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket):
+            for item in page.get("Contents", []):
+                s3.delete_object(Bucket=bucket, Key=item["Key"])
+
+
+def manifest_totals(s3, bucket, datetime_string):
+    manifest = read_batch_manifest(s3, bucket, datetime_string) or {"tables": {}}
+    entries = manifest["tables"].values()
+    return (
+        sum(entry.get("rows") or 0 for entry in entries),
+        sum(entry.get("bytes") or 0 for entry in entries),
+    )
+
+
+def run_stage(func):
+    """Runs func, returning its (rows, bytes, details) with the wall time and peak RSS."""
+    reset_peak_memory()
+    start = time.perf_counter()
+    rows, written, details = func()
+    wall = time.perf_counter() - start
+    return {
+        "wall_s": round(wall, 3),
+        "rows": rows,
+        "rows_per_s": round(rows / wall, 1) if wall else None,
+        "peak_rss_mb": get_peak_memory_mb(),
+        "bytes": written,
+        **details,
+    }
+
+
+def benchmark_scale(scale, args, s3, handlers, samples):
+    """Runs every stage at one scale factor and returns one result per stage."""
+    extract, transform, load = handlers
+    empty_buckets(s3)
+    drop_cached_conn()
+    state = {}
+
+    def generate():
+        conn = connect(args.source_db)
+        try:
+            counts = insert_into_postgres(conn, generate_totesys(scale, args.seed, samples))
+        finally:
+            conn.close()
+        return sum(counts.values()), None, {"tables": counts}
+
+    def run_extract():
+        event = {"full_snapshot": True, "schema_ttl": 0, **args.extract_event}
+        response = extract.lambda_handler(event, None)
+        if response.get("statusCode") != 200 or response.get("failed_tables"):
+            raise RuntimeError(f"extract failed: {response}")
+        state["extract"] = response
+        rows, written = manifest_totals(s3, INGESTION_BUCKET, response["datetime_string"])
+        return rows, written, {"manifest_key": response["manifest_key"]}
+
+    def run_transform():
+        event = {"datetime_string": state["extract"]["datetime_string"]}
+        response = transform.lambda_handler(event, None)
+        if not isinstance(response, dict) or response.get("statusCode") != 200:
+            raise RuntimeError(f"transform failed: {response}")
+        rows, written = manifest_totals(s3, PROCESSED_BUCKET, response["datetime_string"])
+        return rows, written, {"skipped_outputs": response["skipped_outputs"]}
+
+    def run_load():
+        event = {
+            "datetime_string": state["extract"]["datetime_string"],
+            "SECRET_NAME": LOAD_SECRET,
+        }
+        response = load.lambda_handler(event, None)
+        if response["message"].startswith("Error"):
+            raise RuntimeError(f"load failed: {response}")
+        rows, _ = manifest_totals(s3, PROCESSED_BUCKET, event["datetime_string"])
+        conn = connect(args.warehouse_db)
+        try:
+            written = warehouse_bytes(conn)
+        finally:
+            conn.close()
+        return rows, written, {}
+
+    conn = connect(args.warehouse_db)
+    try:
+        reset_warehouse(conn)
+    finally:
+        conn.close()
+
+    results = []
+    for stage, func in zip(STAGES, [generate, run_extract, run_transform, run_load]):
+        result = {"scale": scale, "stage": stage, **run_stage(func)}
+        print(
+            f"{scale:>8g} {stage:<10}{result['rows']:>10}{result['wall_s']:>10.2f}"
+            f"{result['rows_per_s'] or 0:>12.0f}{result['peak_rss_mb']:>10.1f}"
+            f"{(result['bytes'] or 0) / 1024 / 1024:>10.1f}"
+        )
+        results.append(result)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def run_benchmark(args):
+    for database in [args.source_db, args.warehouse_db]:
+        ensure_database(database)
+    os.environ.update(
+        {
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+            "AWS_DEFAULT_REGION": REGION,
+            "INGESTION_BUCKET": INGESTION_BUCKET,
+            "PROCESSED_BUCKET": PROCESSED_BUCKET,
+        }
+    )
+    samples = load_samples()
+    with mock_aws():
+        s3 = setup_aws(args.source_db, args.warehouse_db)
+        # The handlers create their clients at import time, so they are
+        # imported inside the mock
+        from src import lambda_extract, lambda_transform, lambda_load
+
+        lambda_extract.bucket_name = INGESTION_BUCKET
+        lambda_extract.secret_name = EXTRACT_SECRET
+        handlers = (lambda_extract, lambda_transform, lambda_load)
+        print(
+            f"{'scale':>8} {'stage':<10}{'rows':>10}{'seconds':>10}"
+            f"{'rows/s':>12}{'peak MB':>10}{'written MB':>10}"
+        )
+        results = []
+        for scale in args.scales:
+            results.extend(benchmark_scale(scale, args, s3, handlers, samples))
+        drop_cached_conn()
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "extract_event": args.extract_event,
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2, default=str)
+    print(f"results written to {args.output}")
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Compares the stages present in both reports, returning one row per
+    (scale, stage, metric) with the relative change and whether it grew by
+    more than threshold.
+    """
+    previous = {(r["scale"], r["stage"]): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        before = previous.get((result["scale"], result["stage"]))
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            rows.append(
+                {
+                    "scale": result["scale"],
+                    "stage": result["stage"],
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": change,
+                    "regression": change > threshold,
+                }
+            )
+    return rows
+
+
+def run_compare(args):
+    with open(args.compare[0]) as file:
+        baseline = json.load(file)
+    with open(args.compare[1]) as file:
+        current = json.load(file)
+    rows = compare_results(baseline, current, args.threshold)
+    print(
+        f"{'scale':>8} {'stage':<10}{'metric':<13}{'baseline':>10}{'current':>10}{'change':>9}"
+    )
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(
+            f"{row['scale']:>8g} {row['stage']:<10}{row['metric']:<13}"
+            f"{row['baseline']:>10.2f}{row['current']:>10.2f}{row['change']:>+9.1%}{flag}"
+        )
+    regressions = [row for row in rows if row["regression"]]
+    print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--scales", type=lambda value: [float(s) for s in value.split(",")], default=[0.1, 1]
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--extract-event", type=json.loads, default={})
+    parser.add_argument("--source-db", default="totesys_benchmark")
+    parser.add_argument("--warehouse-db", default="warehouse_benchmark")
+    parser.add_argument("--output", default="benchmarks/results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"))
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(run_compare(args))
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Row serialiser micro-benchmark.
+
+Rebuilds the sales_order sample in data/json_lines_s3_format as the typed
+rows pg8000 returns (datetime, date, Decimal and None values) and times
+encoding them to JSON Lines with:
+    pandas    pd.DataFrame(rows, columns).to_json(orient="records", lines=True)
+    json      json.dumps of each row's dict with json_default
+    typed     make_json_row_encoder (precomputed per-column encoders)
+and to Arrow with pa.Table.from_pandas against make_record_batch_encoder.
+
+Usage (from the project root):
+    PYTHONPATH=$(pwd) python benchmarks/serialiser_benchmark.py [--scale N] [--repeat N]
+"""
+
+import argparse
+import json
+import time
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+
+from src.utils import (
+    PG_TEXT_PARSERS,
+    arrow_schema_from_column_types,
+    json_default,
+    make_json_row_encoder,
+    make_record_batch_encoder,
+)
+
+SAMPLE_FILE = "data/json_lines_s3_format/sales_order.jsonl"
+COLUMN_TYPES = [
+    ("sales_order_id", "integer"),
+    ("created_at", "timestamp without time zone"),
+    ("last_updated", "timestamp without time zone"),
+    ("design_id", "integer"),
+    ("staff_id", "integer"),
+    ("counterparty_id", "integer"),
+    ("units_sold", "integer"),
+    ("unit_price", "numeric"),
+    ("currency_id", "integer"),
+    ("agreed_delivery_date", "date"),
+    ("agreed_payment_date", "date"),
+    ("agreed_delivery_location_id", "integer"),
+]
+COLUMNS = [name for name, _ in COLUMN_TYPES]
+
+
+def load_rows(scale):
+    """Returns the sample rows typed as pg8000 returns them, repeated scale times."""
+    parsers = [PG_TEXT_PARSERS.get(data_type, str) for _, data_type in COLUMN_TYPES]
+    rows = []
+    with open(SAMPLE_FILE) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            rows.append(
+                [
+                    None if record[name] is None else parse(str(record[name]))
+                    for name, parse in zip(COLUMNS, parsers)
+                ]
+            )
+    assert isinstance(rows[0][COLUMNS.index("unit_price")], Decimal)
+    return rows * scale
+
+
+def encode_pandas(rows):
+    return pd.DataFrame(rows, columns=COLUMNS).to_json(
+        orient="records", lines=True, date_format="iso"
+    )
+
+
+def encode_json(rows):
+    return "".join(
+        json.dumps(dict(zip(COLUMNS, row)), default=json_default) + "\n" for row in rows
+    )
+
+
+def encode_typed(rows):
+    return "\n".join(map(make_json_row_encoder(COLUMN_TYPES), rows)) + "\n"
+
+
+def arrow_pandas(rows):
+    return pa.Table.from_pandas(pd.DataFrame(rows, columns=COLUMNS), preserve_index=False)
+
+
+def arrow_typed(rows):
+    schema = arrow_schema_from_column_types(COLUMN_TYPES)
+    return pa.Table.from_batches([make_record_batch_encoder(schema)(rows)])
+
+
+def time_call(func, repeat):
+    """Returns the result of func and the best wall time over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = load_rows(args.scale)
+    print(f"sales_order: {len(rows)} rows")
+    print(f"{'encoder':<16}{'seconds':>10}{'rows/s':>12}{'speedup':>10}")
+    for group in [
+        [
+            ("jsonl pandas", encode_pandas),
+            ("jsonl json", encode_json),
+            ("jsonl typed", encode_typed),
+        ],
+        [("arrow pandas", arrow_pandas), ("arrow typed", arrow_typed)],
+    ]:
+        baseline = None
+        for name, encode in group:
+            _, elapsed = time_call(lambda: encode(rows), args.repeat)
+            baseline = baseline or elapsed
+            print(
+                f"{name:<16}{elapsed:>10.3f}{len(rows) / elapsed:>12.0f}"
+                f"{baseline / elapsed:>9.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Transform engine benchmark.
+
+Reads the JSON Lines samples in data/json_lines_s3_format, each repeated
+--scale times, and builds every processed table with both engines, from
+the ingestion bytes to the Parquet bytes populate_parquet_file would
+upload (S3 itself is left out):
+    pandas    read_s3_table_json's frame, the _return_df_* builder, then
+              pa.Table.from_pandas and pq.write_table
+    arrow     read_json_bytes' table, the _return_table_* builder, then
+              pq.write_table
+Reading is timed once per source table, as the transform DAG reads it;
+each output's time is its build and write. Both engines' Parquet must
+read back as equal tables, schema metadata included.
+
+Usage (from the project root):
+    PYTHONPATH=$(pwd) python benchmarks/transform_engine_benchmark.py [--scale N] [--repeat N]
+"""
+
+import argparse
+import io
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.lambda_transform_arrow import ARROW_BUILDERS
+from src.lambda_transform_utils import get_ingestion_schema, read_json_bytes
+from src.source_columns import TRANSFORM_BUILDERS
+
+SAMPLE = "data/json_lines_s3_format/{table}.jsonl"
+
+
+def to_parquet(table):
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    return buffer.getvalue()
+
+
+ENGINES = {
+    "pandas": (
+        TRANSFORM_BUILDERS,
+        lambda data, schema: read_json_bytes(data, schema).to_pandas(),
+        lambda df: to_parquet(pa.Table.from_pandas(df)),
+    ),
+    "arrow": (ARROW_BUILDERS, read_json_bytes, to_parquet),
+}
+
+
+def time_call(func, repeat):
+    """Returns the result of func and the best wall time over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def run_engine(name, bodies, repeat):
+    """Returns each output's Parquet bytes and the timings of an engine."""
+    builders, read, write = ENGINES[name]
+    sources, timings = {}, {}
+    for table, body in bodies.items():
+        sources[table], timings[f"read {table}"] = time_call(lambda: read(body, get_ingestion_schema(table)), repeat)
+    files = {}
+    for output_table, build in builders.items():
+        inputs = [sources[source] for source in build.source_columns]
+        files[output_table], timings[output_table] = time_call(lambda: write(build(*inputs)), repeat)
+    return files, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    bodies = {}
+    for table in ["sales_order", "design", "address", "counterparty", "staff", "department", "currency"]:
+        with open(SAMPLE.format(table=table), "rb") as file:
+            bodies[table] = file.read() * args.scale
+
+    results = {name: run_engine(name, bodies, args.repeat) for name in ENGINES}
+    for output_table, expected in results["pandas"][0].items():
+        actual = results["arrow"][0][output_table]
+        assert pq.read_table(io.BytesIO(actual)).equals(pq.read_table(io.BytesIO(expected)), check_metadata=True)
+
+    print(f"samples x{args.scale}, best of {args.repeat}")
+    print(f"{'step':<28}{'pandas s':>10}{'arrow s':>10}{'speedup':>9}")
+    totals = {name: 0.0 for name in ENGINES}
+    for step in results["pandas"][1]:
+        pandas_s, arrow_s = results["pandas"][1][step], results["arrow"][1][step]
+        totals["pandas"] += pandas_s
+        totals["arrow"] += arrow_s
+        print(f"{step:<28}{pandas_s:>10.4f}{arrow_s:>10.4f}{pandas_s / arrow_s:>8.2f}x")
+    print(f"{'total':<28}{totals['pandas']:>10.4f}{totals['arrow']:>10.4f}{totals['pandas'] / totals['arrow']:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
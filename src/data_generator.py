@@ -0,0 +1,413 @@
+"""
+Synthetic ToteSys data generator.
+
+Reproduces the ToteSys schema at an arbitrary scale factor using the value
+distributions of the sample snapshot in data/json_lines_s3_format. Reference
+tables (currency, department, payment_type) are copied as they are; every
+other table has round(sample rows * scale) rows, with foreign keys drawn
+from the generated parents. transaction holds one row per sales and purchase
+order and payment one row per transaction (there is no payment sample, so
+its values are derived from the orders).
+
+Every table is generated from its own numpy generator seeded with
+(seed, table), so the same seed and scale always produce the same data.
+
+Usage (from the project root):
+    PYTHONPATH=$(pwd) python src/data_generator.py --scale 10 --seed 1 --out data/synthetic
+    PYTHONPATH=$(pwd) python src/data_generator.py --scale 10 --seed 1 --postgres
+
+--postgres connects with PGHOST / PGDATABASE / PGUSER / PGPASSWORD and
+recreates the ToteSys tables before loading them with COPY.
+"""
+
+import argparse
+import io
+import os
+import string
+
+import numpy as np
+import pandas as pd
+
+from src.utils import create_conn
+from src.totesys_schema import TOTESYS_SCHEMA
+
+SAMPLE_DIR = "data/json_lines_s3_format"
+MS_PER_DAY = 86_400_000
+REFERENCE_TABLES = ["currency", "department", "payment_type"]
+SALES_RECEIPT = 1
+PURCHASE_PAYMENT = 3
+JSONL_CHUNK_ROWS = 100_000
+
+TOTESYS_TABLES = list(TOTESYS_SCHEMA)
+SQL_TYPES = {"numeric": "numeric(10, 2)"}
+
+
+def load_samples(sample_dir=SAMPLE_DIR):
+    """Reads every sample table in sample_dir into a dataframe of raw values."""
+    samples = {}
+    for table in TOTESYS_TABLES:
+        path = os.path.join(sample_dir, f"{table}.jsonl")
+        if os.path.exists(path):
+            samples[table] = pd.read_json(
+                path, lines=True, convert_dates=False, dtype=False
+            )
+    return samples
+
+
+def table_sizes(samples, scale):
+    """Returns the number of rows generated for each table at the given scale."""
+    sizes = {}
+    for table in TOTESYS_TABLES:
+        if table in REFERENCE_TABLES:
+            sizes[table] = len(samples[table])
+        elif table == "transaction":
+            sizes[table] = sizes["sales_order"] + sizes["purchase_order"]
+        elif table == "payment":
+            sizes[table] = sizes["transaction"]
+        else:
+            sizes[table] = max(1, round(len(samples[table]) * scale))
+    return sizes
+
+
+def _to_ms(values):
+    return pd.to_datetime(values).to_numpy("datetime64[ms]").astype(np.int64)
+
+
+def _to_datetimes(ms):
+    return pd.to_datetime(ms, unit="ms")
+
+
+def _to_date_strings(days):
+    return np.datetime_as_string(days.astype("datetime64[D]"), unit="D")
+
+
+def _choice(rng, values, n):
+    """Draws n values from the sample column, keeping its share of nulls."""
+    values = pd.Series(values).astype(object)
+    values = values.where(values.notna(), None).to_numpy()
+    return values[rng.integers(0, len(values), n)]
+
+
+def _keys(rng, parent_rows, n):
+    return rng.integers(1, parent_rows + 1, n)
+
+
+def _random_codes(rng, alphabet, length, n):
+    letters = np.array(list(alphabet))
+    codes = letters[rng.integers(0, len(letters), (n, length))]
+    return ["".join(code) for code in codes]
+
+
+def _timestamps(rng, sample, n):
+    """
+    Draws n created_at values from the sample's creation times (jittered by
+    up to a second and sorted, as ids follow insertion order) and a
+    last_updated for each from the sample's update delays.
+    """
+    created = _to_ms(sample["created_at"])
+    delays = _to_ms(sample["last_updated"]) - created
+    created_at = np.sort(created[rng.integers(0, len(created), n)] + rng.integers(0, 1000, n))
+    last_updated = created_at + delays[rng.integers(0, len(delays), n)]
+    return created_at, last_updated
+
+
+def _agreed_dates(rng, sample, created_at, column):
+    """Offsets each creation day by a day count drawn from the sample's lead times."""
+    created_days = _to_ms(sample["created_at"]) // MS_PER_DAY
+    leads = _to_ms(sample[column]) // MS_PER_DAY - created_days
+    return created_at // MS_PER_DAY + leads[rng.integers(0, len(leads), len(created_at))]
+
+
+def _generate_address(rng, sample, sizes, context):
+    n = sizes["address"]
+    created_at, last_updated = _timestamps(rng, sample, n)
+    streets = [line.split(" ", 1)[-1] for line in sample["address_line_1"]]
+    numbers = rng.integers(1, 10_000, n)
+    first, second = rng.integers(1000, 10_000, n), rng.integers(100_000, 1_000_000, n)
+    return {
+        "address_id": np.arange(1, n + 1),
+        "address_line_1": [f"{number} {street}" for number, street in zip(numbers, _choice(rng, streets, n))],
+        "address_line_2": _choice(rng, sample["address_line_2"], n),
+        "district": _choice(rng, sample["district"], n),
+        "city": _choice(rng, sample["city"], n),
+        "postal_code": _choice(rng, sample["postal_code"], n),
+        "country": _choice(rng, sample["country"], n),
+        "phone": [f"{a} {b}" for a, b in zip(first, second)],
+        "created_at": created_at,
+        "last_updated": last_updated,
+    }
+
+
+def _generate_design(rng, sample, sizes, context):
+    n = sizes["design"]
+    created_at, last_updated = _timestamps(rng, sample, n)
+    names = _choice(rng, sample["design_name"], n)
+    days = _to_date_strings(created_at // MS_PER_DAY)
+    suffixes = _random_codes(rng, string.ascii_lowercase + string.digits, 4, n)
+    return {
+        "design_id": np.arange(1, n + 1),
+        "created_at": created_at,
+        "design_name": names,
+        "file_location": _choice(rng, sample["file_location"], n),
+        "file_name": [
+            f"{name.lower()}-{day.replace('-', '')}-{suffix}.json"
+            for name, day, suffix in zip(names, days, suffixes)
+        ],
+        "last_updated": last_updated,
+    }
+
+
+def _generate_counterparty(rng, sample, sizes, context):
+    n = sizes["counterparty"]
+    created_at, last_updated = _timestamps(rng, sample, n)
+    return {
+        "counterparty_id": np.arange(1, n + 1),
+        "counterparty_legal_name": _choice(rng, sample["counterparty_legal_name"], n),
+        "legal_address_id": _keys(rng, sizes["address"], n),
+        "commercial_contact": _choice(rng, sample["commercial_contact"], n),
+        "delivery_contact": _choice(rng, sample["delivery_contact"], n),
+        "created_at": created_at,
+        "last_updated": last_updated,
+    }
+
+
+def _generate_staff(rng, sample, sizes, context):
+    n = sizes["staff"]
+    created_at, last_updated = _timestamps(rng, sample, n)
+    first_names = _choice(rng, sample["first_name"], n)
+    last_names = _choice(rng, sample["last_name"], n)
+    return {
+        "staff_id": np.arange(1, n + 1),
+        "first_name": first_names,
+        "last_name": last_names,
+        "department_id": _choice(rng, sample["department_id"], n).astype(np.int64),
+        "email_address": [
+            f"{first}.{last}@terrifictotes.com".lower().replace(" ", "")
+            for first, last in zip(first_names, last_names)
+        ],
+        "created_at": created_at,
+        "last_updated": last_updated,
+    }
+
+
+def _generate_order(rng, sample, sizes, table):
+    """Columns shared by sales and purchase orders."""
+    n = sizes[table]
+    created_at, last_updated = _timestamps(rng, sample, n)
+    return {
+        f"{table}_id": np.arange(1, n + 1),
+        "created_at": created_at,
+        "last_updated": last_updated,
+        "staff_id": _keys(rng, sizes["staff"], n),
+        "counterparty_id": _keys(rng, sizes["counterparty"], n),
+        "currency_id": _choice(rng, sample["currency_id"], n).astype(np.int64),
+        "agreed_delivery_date": _agreed_dates(rng, sample, created_at, "agreed_delivery_date"),
+        "agreed_payment_date": _agreed_dates(rng, sample, created_at, "agreed_payment_date"),
+        "agreed_delivery_location_id": _keys(rng, sizes["address"], n),
+    }
+
+
+def _generate_sales_order(rng, sample, sizes, context):
+    columns = _generate_order(rng, sample, sizes, "sales_order")
+    n = sizes["sales_order"]
+    columns["design_id"] = _keys(rng, sizes["design"], n)
+    columns["units_sold"] = _choice(rng, sample["units_sold"], n).astype(np.int64)
+    columns["unit_price"] = _choice(rng, sample["unit_price"], n).astype(float)
+    context["sales_order"] = {
+        "amount": np.round(columns["units_sold"] * columns["unit_price"], 2),
+        **{key: columns[key] for key in ["created_at", "counterparty_id", "currency_id", "agreed_payment_date"]},
+    }
+    return columns
+
+
+def _generate_purchase_order(rng, sample, sizes, context):
+    columns = _generate_order(rng, sample, sizes, "purchase_order")
+    n = sizes["purchase_order"]
+    columns["item_code"] = _random_codes(rng, string.ascii_uppercase + string.digits, 7, n)
+    columns["item_quantity"] = _choice(rng, sample["item_quantity"], n).astype(np.int64)
+    columns["item_unit_price"] = _choice(rng, sample["item_unit_price"], n).astype(float)
+    context["purchase_order"] = {
+        "amount": np.round(columns["item_quantity"] * columns["item_unit_price"], 2),
+        **{key: columns[key] for key in ["created_at", "counterparty_id", "currency_id", "agreed_payment_date"]},
+    }
+    return columns
+
+
+def _generate_transaction(rng, sample, sizes, context):
+    """One transaction per order, numbered in creation order."""
+    sales, purchases = context["sales_order"], context["purchase_order"]
+    n_sales, n_purchases = len(sales["created_at"]), len(purchases["created_at"])
+    is_sale = np.concatenate([np.ones(n_sales, bool), np.zeros(n_purchases, bool)])
+    order_ids = np.concatenate([np.arange(1, n_sales + 1), np.arange(1, n_purchases + 1)])
+    order = np.argsort(np.concatenate([sales["created_at"], purchases["created_at"]]), kind="stable")
+    is_sale, order_ids = is_sale[order], order_ids[order]
+    context["transaction"] = {"order": order, "is_sale": is_sale}
+    created_at = np.concatenate([sales["created_at"], purchases["created_at"]])[order]
+    return {
+        "transaction_id": np.arange(1, len(order) + 1),
+        "transaction_type": np.where(is_sale, "SALE", "PURCHASE"),
+        "sales_order_id": pd.Series(order_ids, dtype="Int64").where(is_sale),
+        "purchase_order_id": pd.Series(order_ids, dtype="Int64").where(~is_sale),
+        "created_at": created_at,
+        "last_updated": created_at,
+    }
+
+
+def _generate_payment(rng, sample, sizes, context):
+    """One payment per transaction for the order's amount, due on its agreed payment date."""
+    sales, purchases = context["sales_order"], context["purchase_order"]
+    order, is_sale = context["transaction"]["order"], context["transaction"]["is_sale"]
+
+    def merged(key):
+        return np.concatenate([sales[key], purchases[key]])[order]
+
+    n = len(order)
+    created_at = merged("created_at")
+    payment_days = merged("agreed_payment_date")
+    return {
+        "payment_id": np.arange(1, n + 1),
+        "created_at": created_at,
+        "last_updated": created_at,
+        "transaction_id": np.arange(1, n + 1),
+        "counterparty_id": merged("counterparty_id"),
+        "payment_amount": merged("amount"),
+        "currency_id": merged("currency_id"),
+        "payment_type_id": np.where(is_sale, SALES_RECEIPT, PURCHASE_PAYMENT),
+        "paid": payment_days <= created_at.max() // MS_PER_DAY,
+        "payment_date": payment_days,
+        "company_ac_number": rng.integers(10_000_000, 100_000_000, n),
+        "counterparty_ac_number": rng.integers(10_000_000, 100_000_000, n),
+    }
+
+
+GENERATORS = {
+    "address": _generate_address,
+    "design": _generate_design,
+    "counterparty": _generate_counterparty,
+    "staff": _generate_staff,
+    "sales_order": _generate_sales_order,
+    "purchase_order": _generate_purchase_order,
+    "transaction": _generate_transaction,
+    "payment": _generate_payment,
+}
+
+
+def _to_frame(table, columns):
+    """Orders the columns as in the schema and converts epoch ms / day counts."""
+    frame = {}
+    for name, data_type in TOTESYS_SCHEMA[table]:
+        values = columns[name]
+        if data_type.startswith("timestamp"):
+            values = _to_datetimes(values)
+        elif name.endswith("_date") and data_type == "character varying":
+            values = _to_date_strings(values)
+        frame[name] = values
+    return pd.DataFrame(frame)
+
+
+def generate_totesys(scale=1, seed=0, samples=None):
+    """
+    Generates the ToteSys tables at the given scale factor.
+
+    Yields (table_name, dataframe) in foreign-key order so each table can be
+    written out and released before the next is built; only the order
+    columns that transaction and payment need are kept between tables.
+    """
+    samples = samples if samples is not None else load_samples()
+    sizes = table_sizes(samples, scale)
+    context = {}
+    for position, table in enumerate(TOTESYS_TABLES):
+        if table in REFERENCE_TABLES:
+            df = samples[table][[name for name, _ in TOTESYS_SCHEMA[table]]].copy()
+            for name in ["created_at", "last_updated"]:
+                df[name] = pd.to_datetime(df[name])
+            yield table, df
+            continue
+        rng = np.random.default_rng([seed, position])
+        columns = GENERATORS[table](rng, samples.get(table), sizes, context)
+        yield table, _to_frame(table, columns)
+
+
+def write_jsonl(tables, out_dir):
+    """
+    Writes each (table_name, dataframe) to <out_dir>/<table>.jsonl in the
+    same layout as the samples and returns the row count per table.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {}
+    for table, df in tables:
+        with open(os.path.join(out_dir, f"{table}.jsonl"), "w") as file:
+            for start in range(0, len(df), JSONL_CHUNK_ROWS):
+                file.write(
+                    df.iloc[start : start + JSONL_CHUNK_ROWS].to_json(
+                        orient="records", lines=True, date_format="iso"
+                    )
+                )
+        counts[table] = len(df)
+    return counts
+
+
+def create_totesys_tables(conn, tables=TOTESYS_TABLES):
+    """(Re)creates empty ToteSys tables in the connected database."""
+    for table in tables:
+        columns = ", ".join(
+            f"{name} {SQL_TYPES.get(data_type, data_type)}"
+            for name, data_type in TOTESYS_SCHEMA[table]
+        )
+        conn.run(f"DROP TABLE IF EXISTS {table}")
+        conn.run(f"CREATE TABLE {table} ({columns})")
+
+
+def insert_into_postgres(conn, tables, create=True):
+    """
+    Loads each (table_name, dataframe) into PostgreSQL with COPY FROM STDIN
+    and returns the row count per table. With create the tables are dropped
+    and recreated first.
+    """
+    counts = {}
+    for table, df in tables:
+        if create:
+            create_totesys_tables(conn, [table])
+        buffer = io.StringIO()
+        df.to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        conn.run(
+            f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)",
+            stream=buffer,
+        )
+        counts[table] = len(df)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample-dir", default=SAMPLE_DIR)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--out", help="directory to write <table>.jsonl files to")
+    target.add_argument("--postgres", action="store_true")
+    args = parser.parse_args()
+
+    tables = generate_totesys(args.scale, args.seed, load_samples(args.sample_dir))
+    if args.out:
+        counts = write_jsonl(tables, args.out)
+    else:
+        conn = create_conn(
+            {
+                "dbname": os.environ.get("PGDATABASE", "postgres"),
+                "username": os.environ.get("PGUSER", "postgres"),
+                "password": os.environ.get("PGPASSWORD", "password"),
+                "host": os.environ.get("PGHOST", "localhost"),
+            }
+        )
+        try:
+            counts = insert_into_postgres(conn, tables)
+        finally:
+            conn.close()
+    for table, rows in counts.items():
+        print(f"{table:<16}{rows:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import boto3
+
+from src.utils import read_batch_manifest
+from src.s3_keys import list_batches
+from src.lambda_compact_utils import compact_table
+
+
+def lambda_handler(event, context):
+    """
+    Compaction Lambda handler function
+    Run on a schedule after the extract. Merges each table's incremental
+    ingestion batches into a deduplicated latest-state snapshot (last write
+    wins on the primary key and last_updated), stored as Parquet next to
+    the batches with a manifest recording the batches it merged. The
+    transform can then read snapshot + tail batches instead of every batch.
+    Parameters:
+        event: Dict containing the Lambda function event data
+            ("tables": the tables to compact, by default every table in
+            the latest batch manifest;
+            "through": the last batch to merge, by default the latest;
+            "min_batches": N only compacts tables with at least N batches
+            waiting, by default 1)
+        context: Lambda runtime context
+    Returns:
+        Dict containing status message, each compacted table's snapshot
+        manifest, the tables with nothing to merge and any that failed
+    """
+    try:
+        s3_client = boto3.client("s3", region_name="eu-west-2")
+        bucket_name = os.environ.get("INGESTION_BUCKET")
+        batches = list_batches(s3_client, bucket_name)
+        if not batches:
+            return {"message": "No batches to compact", "statusCode": 200,
+                    "compacted": {}, "unchanged": [], "failed_tables": {}}
+        through = event.get("through", batches[-1])
+        tables = event.get("tables") or list(read_batch_manifest(s3_client, bucket_name, batches[-1])["tables"])
+        min_batches = int(event.get("min_batches", os.environ.get("COMPACT_MIN_BATCHES", 1)))
+
+        # batch manifests are read once and shared between tables
+        manifests = {}
+        compacted, unchanged, failed_tables = {}, [], {}
+        for table in tables:
+            try:
+                snapshot = compact_table(s3_client, bucket_name, table, through, min_batches, manifests)
+            except Exception as e:
+                print(f"Error compacting {table}: {e}")
+                failed_tables[table] = str(e)
+                continue
+            if snapshot is None:
+                unchanged.append(table)
+            else:
+                compacted[table] = snapshot
+        return {"message": "Compaction completed",
+                "statusCode": 200,
+                "through": through,
+                "compacted": compacted,
+                "unchanged": unchanged,
+                "failed_tables": failed_tables}
+    except Exception as e:
+        print(f"Error: {e}")
+        return {"message": f"Error: {e}", "statusCode": 500}
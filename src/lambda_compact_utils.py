@@ -0,0 +1,158 @@
+import io
+import json
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+from src.utils import read_batch_manifest, WATERMARK_COLUMN
+from src.s3_keys import (
+    batch_timestamp,
+    build_snapshot_key,
+    build_snapshot_manifest_key,
+    list_batches,
+)
+from src.lambda_transform_utils import read_manifest_entry, read_s3_table_parquet
+
+# columns written as ISO strings by the JSON formats and as timestamps by
+# Parquet, normalised so batches of either format merge into one snapshot
+TIMESTAMP_COLUMNS = ["created_at", WATERMARK_COLUMN]
+
+
+def get_primary_key(table_name, columns):
+    """
+    ToteSys tables are keyed on <table>_id; anything else falls back to the
+    first column
+    """
+    key = f"{table_name}_id"
+    return key if key in columns else columns[0]
+
+
+def read_snapshot_manifest(s3_client, bucket_name, table_name):
+    """
+    returns the manifest of a table's latest snapshot, or None if the table
+    has never been compacted
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=build_snapshot_manifest_key(table_name))
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise e
+
+
+def list_table_deltas(s3_client, bucket_name, table_name, after=None, through=None, manifests=None):
+    """
+    lists the batches after `after` and up to `through` (batch timestamps)
+    holding rows of the table, oldest first, with their manifest entries
+
+    only the batch manifests after `after` are listed, so the cost of a run
+    follows the batches since the last snapshot, not the whole history.
+    entries marked skipped point at an older batch's object and entries with
+    no rows have nothing to merge, so both are left out. manifests caches
+    the batch manifests already read, for callers listing several tables
+
+    return [(datetime_string, entry)]
+    """
+    manifests = {} if manifests is None else manifests
+    deltas = []
+    for datetime_string in list_batches(s3_client, bucket_name, after):
+        if through is not None and batch_timestamp(datetime_string) > batch_timestamp(through):
+            continue
+        if datetime_string not in manifests:
+            manifests[datetime_string] = read_batch_manifest(s3_client, bucket_name, datetime_string)
+        entry = (manifests[datetime_string] or {"tables": {}})["tables"].get(table_name)
+        if entry and entry.get("key") and entry.get("rows") and not entry.get("skipped"):
+            deltas.append((datetime_string, entry))
+    return deltas
+
+
+def merge_latest(dfs, primary_key):
+    """
+    concatenates the frames oldest first and keeps the latest version of
+    each row: the highest last_updated wins, and on a tie the later frame
+
+    return df
+    """
+    df = pd.concat([df for df in dfs if df is not None and len(df)], ignore_index=True)
+    for column in TIMESTAMP_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], format="ISO8601")
+    if WATERMARK_COLUMN in df.columns:
+        # a stable sort keeps batch order among equal timestamps
+        df = df.sort_values(WATERMARK_COLUMN, kind="stable")
+    df = df.drop_duplicates(subset=[primary_key], keep="last")
+    return df.sort_values(primary_key).reset_index(drop=True)
+
+
+def read_table_state(s3_client, bucket_name, table_name, through=None, manifests=None):
+    """
+    reconstructs the latest state of a table from its snapshot and the tail
+    of batches written since, up to the batch `through`
+
+    return df, or None if the table has no rows in any batch
+    """
+    snapshot = read_snapshot_manifest(s3_client, bucket_name, table_name)
+    if snapshot is not None and through is not None and batch_timestamp(snapshot["through_batch"]) > batch_timestamp(through):
+        # the snapshot is newer than the batch asked for, so replay every batch
+        snapshot = None
+    after = snapshot["through_batch"] if snapshot else None
+    deltas = list_table_deltas(s3_client, bucket_name, table_name, after, through, manifests)
+    dfs = [read_s3_table_parquet(s3_client, snapshot["key"], bucket_name)] if snapshot else []
+    dfs += [read_manifest_entry(s3_client, entry, bucket_name) for _, entry in deltas]
+    if not dfs:
+        return None
+    if not deltas:
+        return dfs[0]
+    return merge_latest(dfs, get_primary_key(table_name, list(dfs[0].columns)))
+
+
+def compact_table(s3_client, bucket_name, table_name, through=None, min_batches=1, manifests=None):
+    """
+    merges a table's latest snapshot with the batches written since into a
+    new Parquet snapshot, then points the table's snapshot manifest at it
+
+    the manifest is written after the snapshot, so readers see either the
+    old snapshot or the complete new one. rows are never deleted: ToteSys
+    changes are captured by last_updated, which does not see deletes
+
+    return the new snapshot manifest, or None if fewer than min_batches
+    batches were waiting to be merged
+    """
+    previous = read_snapshot_manifest(s3_client, bucket_name, table_name)
+    after = previous["through_batch"] if previous else None
+    deltas = list_table_deltas(s3_client, bucket_name, table_name, after, through, manifests)
+    if not deltas or len(deltas) < min_batches:
+        return None
+    dfs = [read_s3_table_parquet(s3_client, previous["key"], bucket_name)] if previous else []
+    dfs += [read_manifest_entry(s3_client, entry, bucket_name) for _, entry in deltas]
+    primary_key = get_primary_key(table_name, list(dfs[0].columns))
+    df = merge_latest(dfs, primary_key)
+
+    through_batch = deltas[-1][0]
+    key = build_snapshot_key(table_name, through_batch)
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buffer)
+    s3_client.put_object(Bucket=bucket_name, Key=key, Body=buffer.getvalue())
+
+    manifest = {
+        "table": table_name,
+        "key": key,
+        "rows": len(df),
+        "bytes": buffer.tell(),
+        "primary_key": primary_key,
+        "through_batch": through_batch,
+        "merged_batches": [datetime_string for datetime_string, _ in deltas],
+        "previous_snapshot": previous["key"] if previous else None,
+        "created_at": datetime.now().isoformat(),
+    }
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=build_snapshot_manifest_key(table_name),
+        Body=json.dumps(manifest, indent=2).encode("utf-8"),
+        ContentType="application/json",
+    )
+    return manifest
@@ -1,5 +1,8 @@
 import os
 import json
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
@@ -8,11 +11,42 @@ from pg8000.exceptions import DatabaseError
 from src.utils import (
     get_secret,
     create_conn,
-    close_db,
+    get_cached_secret,
+    get_cached_conn,
+    drop_cached_conn,
     get_rows_and_columns_from_table,
     write_table_to_s3,
-    log_file,
+    write_batch_manifest,
+    describe_s3_objects,
+    get_table_watermark,
+    get_watermarks,
+    put_watermarks,
+    stream_rows_from_table,
+    copy_rows_from_table,
+    track_watermark,
+    count_rows,
+    write_batches_to_s3,
+    get_peak_memory_mb,
+    reset_peak_memory,
+    create_conn_pool,
+    get_schema_catalog,
+    get_cancellation_reason,
+    write_batches_to_s3_parquet,
+    write_batches_to_s3_jsonl,
+    get_partition_key,
+    get_key_ranges,
+    write_table_manifest,
+    get_table_fingerprints,
+    get_fingerprints,
+    put_fingerprints,
+    set_session_timeouts,
+    DEFAULT_BATCH_SIZE,
+    MAX_POOL_SIZE,
+    SCHEMA_CACHE_TTL,
+    SECRET_CACHE_TTL,
 )
+from src.source_columns import project_catalog
+from src.query_throttle import QueryThrottle
 
 secret_name = os.environ.get("SECRET_NAME")
 bucket_name = os.environ.get("BUCKET_NAME")
@@ -20,46 +54,571 @@ sm_client = boto3.client(service_name="secretsmanager", region_name="eu-west-2")
 s3_client = boto3.client("s3", region_name="eu-west-2")
 
 
+def get_extract_config(event):
+    """Merges the options passed in the event with the environment defaults."""
+    def option(name, env_name, default):
+        value = event.get(name, os.environ.get(env_name, default))
+        if isinstance(default, bool) and isinstance(value, str):
+            return value.lower() == "true"
+        return type(default)(value)
+
+    return {
+        # The load replaces every warehouse table, so it needs whole tables
+        "full_snapshot": option("full_snapshot", "FULL_SNAPSHOT", True),
+        "stream": option("stream", "STREAM_EXTRACT", False),
+        "copy": option("copy", "COPY_EXTRACT", False),
+        "batch_size": option("batch_size", "EXTRACT_BATCH_SIZE", DEFAULT_BATCH_SIZE),
+        "parallel": option("parallel", "PARALLEL_EXTRACT", False),
+        "skip_unchanged": option("skip_unchanged", "SKIP_UNCHANGED", True),
+        "project_columns": option("project_columns", "PROJECT_COLUMNS", False),
+        "output_format": option("output_format", "EXTRACT_FORMAT", "json"),
+        "codec": option("codec", "EXTRACT_CODEC", "").lower() or None,
+        "schema_ttl": option("schema_ttl", "SCHEMA_CACHE_TTL", SCHEMA_CACHE_TTL),
+        "secret_ttl": option("secret_ttl", "SECRET_CACHE_TTL", SECRET_CACHE_TTL),
+        # 0 extracts every table with a single query
+        "partition_rows": option("partition_rows", "EXTRACT_PARTITION_ROWS", 0),
+        # Capped so a misconfigured run cannot swamp the ToteSys source
+        "pool_size": max(1, min(option("pool_size", "EXTRACT_POOL_SIZE", 2), MAX_POOL_SIZE)),
+        # Queries running at once over all workers, whatever the pool size
+        "max_concurrency": max(
+            1, min(option("max_concurrency", "EXTRACT_MAX_CONCURRENCY", MAX_POOL_SIZE), MAX_POOL_SIZE)
+        ),
+        # 0 leaves the server's timeouts, and the throttle never backs off
+        "statement_timeout_ms": option("statement_timeout_ms", "STATEMENT_TIMEOUT_MS", 0),
+        "lock_timeout_ms": option("lock_timeout_ms", "LOCK_TIMEOUT_MS", 0),
+        "latency_threshold_s": option("latency_threshold_s", "EXTRACT_LATENCY_THRESHOLD_S", 0.0),
+    }
+
+
+def throttled(throttle, table, label="select"):
+    """Runs a query under the throttle, if there is one."""
+    return throttle.query(table, label) if throttle else nullcontext()
+
+
+def borrow_conn(pool, config):
+    """Takes a connection from the pool with this run's session timeouts."""
+    conn = pool.get()
+    try:
+        set_session_timeouts(conn, config["statement_timeout_ms"], config["lock_timeout_ms"])
+    except Exception:
+        pool.put(conn)
+        raise
+    return conn
+
+
+def extract_table(
+    conn,
+    table,
+    config,
+    since,
+    datetime_string,
+    column_types,
+    key_range=None,
+    part=None,
+    throttle=None,
+):
+    """
+    Extracts the rows of one table changed since the watermark and writes
+    them to the ingestion bucket.
+    Parameters:
+        column_types: (column_name, data_type) pairs from the schema catalog
+        key_range: (key, low, high) primary-key range of one chunk of a
+            partitioned table, written as part object number part
+        throttle: QueryThrottle shared by the run's queries
+    Returns:
+        Dict of the S3 key written (None if nothing was uploaded), the
+        latest last_updated value extracted, the row count and the duration
+    """
+    start = time.perf_counter()
+    columns = [name for name, _ in column_types]
+    # A projected catalog lists only some columns, so they are named
+    projection = {"select": ", ".join(columns)} if config["project_columns"] else {}
+    if config["output_format"] == "json" and not (
+        config["stream"] or config["copy"] or key_range
+    ):
+        # Query the table for rows changed since the last run
+        with throttled(throttle, table):
+            rows, columns = get_rows_and_columns_from_table(
+                conn, table, since=since, columns=columns, **projection
+            )
+        # Encode the rows by column type, format JSON file, and upload file to S3 bucket
+        key = write_table_to_s3(
+            s3_client,
+            bucket_name,
+            table,
+            rows,
+            columns,
+            datetime_string,
+            codec=config["codec"],
+            column_types=column_types,
+        )
+        return {
+            "key": key,
+            "watermark": get_table_watermark(rows, columns),
+            "rows": len(rows),
+            "duration_s": time.perf_counter() - start,
+        }
+
+    seen_watermarks = {}
+    row_counts = {}
+    if config["copy"]:
+        # Bulk COPY TO STDOUT, parsed back into typed rows in batches
+        batches = copy_rows_from_table(
+            conn,
+            table,
+            column_types,
+            config["batch_size"],
+            since=since,
+            key_range=key_range,
+            throttle=throttle,
+            **projection,
+        )
+    elif config["stream"]:
+        # Stream the changed rows in batches straight into the S3 writer
+        batches = stream_rows_from_table(
+            conn,
+            table,
+            columns,
+            config["batch_size"],
+            since=since,
+            key_range=key_range,
+            throttle=throttle,
+            **projection,
+        )
+    else:
+        with throttled(throttle, table):
+            rows, columns = get_rows_and_columns_from_table(
+                conn, table, since=since, columns=columns, key_range=key_range, **projection
+            )
+        batches = [rows]
+    batches = track_watermark(batches, columns, seen_watermarks, table)
+    batches = count_rows(batches, row_counts, table)
+    if config["output_format"] == "parquet":
+        # Typed Parquet straight from the cursor rows, no pandas intermediate
+        key = write_batches_to_s3_parquet(
+            s3_client,
+            bucket_name,
+            table,
+            batches,
+            column_types,
+            datetime_string,
+            codec=config["codec"],
+            part=part,
+        )
+    elif config["output_format"] == "jsonl":
+        # One JSON object per line, uploaded in multipart parts as they fill
+        key = write_batches_to_s3_jsonl(
+            s3_client,
+            bucket_name,
+            table,
+            batches,
+            columns,
+            datetime_string,
+            codec=config["codec"],
+            part=part,
+            column_types=column_types,
+        )
+    else:
+        key = write_batches_to_s3(
+            s3_client,
+            bucket_name,
+            table,
+            batches,
+            columns,
+            datetime_string,
+            codec=config["codec"],
+            part=part,
+            column_types=column_types,
+        )
+    return {
+        "key": key,
+        "watermark": seen_watermarks.get(table),
+        "rows": row_counts.get(table, 0),
+        "duration_s": time.perf_counter() - start,
+    }
+
+
+def plan_key_ranges(pool, catalog, config, watermarks, throttle=None):
+    """
+    Splits every table with more than partition_rows changed rows into
+    (key, low, high) primary-key ranges of partition_rows rows each, fewer
+    while the throttle has backed off.
+    Returns:
+        Dict of table name to its key ranges, or to the exception raised,
+        for the tables that need more than one chunk
+    """
+    plans = {}
+    conn = borrow_conn(pool, config)
+    try:
+        for table, column_types in catalog.items():
+            key = get_partition_key(table, column_types)
+            if not key:
+                continue
+            # Smaller chunks, so shorter queries, while the source is slow
+            rows_per_chunk = (
+                throttle.chunk_size(config["partition_rows"])
+                if throttle
+                else config["partition_rows"]
+            )
+            try:
+                with throttled(throttle, table, "key ranges"):
+                    ranges = get_key_ranges(
+                        conn,
+                        table,
+                        [name for name, _ in column_types],
+                        key,
+                        rows_per_chunk,
+                        since=watermarks.get(table),
+                    )
+            except Exception as e:
+                plans[table] = e
+                continue
+            if len(ranges) > 1:
+                plans[table] = [(key, low, high) for low, high in ranges]
+    finally:
+        pool.put(conn)
+    return plans
+
+
+def combine_parts(table, parts, datetime_string):
+    """
+    Writes the manifest of a partitioned table once all its parts are in S3.
+    Returns:
+        Dict as for extract_table, keyed on the table's manifest (None if no
+        part had rows), with the part keys, the rows over all parts and the
+        extraction time summed over the parts
+    """
+    for result in parts:
+        if isinstance(result, Exception):
+            raise result
+    # A part that saw rows but has no key failed to upload
+    if any(result["key"] is None and result["rows"] for result in parts):
+        raise ValueError(f"A part of {table} failed to upload")
+    part_keys = [result["key"] for result in parts if result["key"]]
+    watermarks = [result["watermark"] for result in parts if result["watermark"]]
+    combined = {
+        "key": None,
+        "watermark": None,
+        "rows": sum(result["rows"] for result in parts),
+        "duration_s": sum(result["duration_s"] for result in parts),
+    }
+    if part_keys:
+        combined.update(
+            key=write_table_manifest(s3_client, bucket_name, table, datetime_string, part_keys),
+            watermark=max(watermarks) if watermarks else None,
+            parts=part_keys,
+        )
+    return combined
+
+
+def extract_tables_in_parallel(
+    pool, catalog, config, watermarks, datetime_string, throttle=None
+):
+    """
+    Extracts tables concurrently, each worker borrowing a connection from the
+    pool for the duration of one table so DB reads overlap with S3 uploads.
+    With partition_rows set, large tables are split into primary-key ranges
+    extracted concurrently as separate part objects listed in a manifest.
+    Returns:
+        Dict of table name to its extract_table result, or to the exception
+        raised
+    """
+    def run(table, key_range=None, part=None):
+        conn = borrow_conn(pool, config)
+        try:
+            return extract_table(
+                conn,
+                table,
+                config,
+                watermarks.get(table),
+                datetime_string,
+                catalog[table],
+                key_range=key_range,
+                part=part,
+                throttle=throttle,
+            )
+        finally:
+            pool.put(conn)
+
+    plans = (
+        plan_key_ranges(pool, catalog, config, watermarks, throttle)
+        if config["partition_rows"]
+        else {}
+    )
+    results = {}
+    parts = {}
+    with ThreadPoolExecutor(max_workers=config["pool_size"]) as executor:
+        futures = {}
+        for table in catalog:
+            plan = plans.get(table)
+            if isinstance(plan, Exception):
+                results[table] = plan
+            elif plan:
+                parts[table] = [None] * len(plan)
+                for part, key_range in enumerate(plan):
+                    future = executor.submit(run, table, key_range, part)
+                    futures[future] = (table, part)
+            else:
+                futures[executor.submit(run, table)] = (table, None)
+        for future in as_completed(futures):
+            table, part = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            if part is None:
+                results[table] = result
+            else:
+                parts[table][part] = result
+    for table, table_parts in parts.items():
+        try:
+            results[table] = combine_parts(table, table_parts, datetime_string)
+        except Exception as e:
+            results[table] = e
+    return results
+
+
+def find_unchanged_tables(fingerprints, previous, config, projected=None):
+    """
+    Compares this run's table fingerprints with those recorded by the last
+    run. Objects written in another format or codec, or with other columns
+    than this run's projection, are never reused, and a full snapshot only
+    reuses objects that hold the whole table.
+    Parameters:
+        projected: Dict of table name to its projected column list
+    Returns:
+        Dict of unchanged table name to its previous batch manifest entry
+    """
+    projected = projected or {}
+    return {
+        table: {name: value for name, value in record.items() if name != "fingerprint"}
+        for table, record in previous.items()
+        if fingerprints.get(table) == record["fingerprint"]
+        and record["format"] == config["output_format"]
+        and record["codec"] == config["codec"]
+        and record.get("columns") == projected.get(table)
+        and (record.get("snapshot") or not config["full_snapshot"])
+    }
+
+
+def skipped_entry(entry, config):
+    """
+    The batch manifest entry of an unchanged table. On a full snapshot it
+    points at the earlier snapshot, which still holds the whole table;
+    otherwise the table has no new rows, the earlier delta having been
+    transformed by the run that wrote it.
+    """
+    if config["full_snapshot"]:
+        return {**entry, "skipped": True}
+    return {
+        "key": None,
+        "rows": 0,
+        "bytes": 0,
+        "checksum": None,
+        "format": entry["format"],
+        "codec": entry["codec"],
+        "duration_s": 0,
+        "skipped": True,
+    }
+
+
 def lambda_handler(event, context):
     """
     Ingestion Lambda handler function
-    Collects data from totesys database and stores each table in .jsonl format
-    in an s3 bucket.
-    Triggered by a timed Eventbridge and collects only new or updated data
-    from the database on each trigger.
+    Collects data from totesys database and stores each table in .json,
+    .jsonl or .parquet format in an s3 bucket.
+    Triggered by a timed Eventbridge and by default collects every row, as
+    the load replaces each warehouse table with the batch; incremental runs
+    collect only new or updated data, using the per-table last_updated
+    watermarks stored in the ingestion bucket. A JSON batch manifest
+    listing each table's key, row count, size, checksum, format, codec and
+    extraction time is written last, for the transform to read. The secret
+    and database connections are kept across warm invocations.
     Parameters:
         event: Dict containing the Lambda function event data
+            ("full_snapshot": False extracts only the rows changed since
+            each table's watermark, which the transform and load do not
+            yet apply as updates;
+            "stream": True reads each table through a server-side cursor
+            in batches of "batch_size" rows instead of all at once;
+            "parallel": True extracts tables concurrently over a pool of
+            "pool_size" connections, capped at MAX_POOL_SIZE;
+            "output_format": "jsonl" writes JSON Lines through a multipart
+            upload and "parquet" writes column-typed Parquet instead of a
+            JSON array;
+            "codec": "gzip" or "zstd" compresses the ingestion objects;
+            "partition_rows": N splits tables with more than N changed rows
+            into primary-key ranges extracted concurrently as part objects
+            listed in a manifest;
+            "skip_unchanged": False re-extracts tables whose row count and
+            latest last_updated match the last run, which are otherwise
+            skipped: listed with no new rows, or on a full snapshot
+            pointing at the previous snapshot of the table;
+            "project_columns": True selects only the columns the transform
+            builders declare they read, plus keys and watermarks, listing
+            them in the manifest entry of each projected table;
+            "statement_timeout_ms" / "lock_timeout_ms": N cancels queries
+            running, or waiting on locks, for longer than N ms;
+            "max_concurrency": N caps the queries running at once;
+            "latency_threshold_s": S halves the concurrency and fetch size
+            whenever a query takes longer than S seconds, recovering once
+            queries are fast again. Every query's time is logged)
         context: Lambda runtime context
     Returns:
-        Dict containing status message
+        Dict containing status message, the batch manifest key, the peak
+        memory of this invocation ("peak_memory_scope" is "process" where
+        it can only be measured over the container's lifetime), the skipped
+        tables and any tables that failed
     """
     try:
-        db_credentials = get_secret(sm_client, secret_name)
-        conn = create_conn(db_credentials)
-        keys = []
-        # Get every table name in the database
-        table_query = conn.run(
-            "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_name NOT LIKE '!_%' ESCAPE '!'"
+        # A warm container's high-water mark includes earlier invocations
+        peak_memory_scope = "invocation" if reset_peak_memory() else "process"
+        config = get_extract_config(event)
+        # Secret and connections are reused across warm invocations
+        db_credentials = get_cached_secret(
+            sm_client, secret_name, ttl=config["secret_ttl"], fetch=get_secret
         )
-        table_names = [table[0] for table in table_query]
+        conn = get_cached_conn(db_credentials, name="extract", connect=create_conn)
+        set_session_timeouts(conn, config["statement_timeout_ms"], config["lock_timeout_ms"])
+        # Shared by every query of the run, so the cap holds across workers
+        throttle = QueryThrottle(config["max_concurrency"], config["latency_threshold_s"])
+        manifest_tables = {}
+        partitioned_tables = []
+        failed_tables = {}
+        stored_watermarks = get_watermarks(s3_client, bucket_name)
+        watermarks = {} if config["full_snapshot"] else stored_watermarks
+        # Tables skipped or failed in this run keep their stored watermark
+        new_watermarks = dict(stored_watermarks)
+        # Every table with its columns, cached across warm invocations
+        with throttled(throttle, "public schema", "schema catalog"):
+            catalog = get_schema_catalog(conn, ttl=config["schema_ttl"])
+        # Only the columns the transform reads, plus keys and watermarks
+        projected = {}
+        if config["project_columns"]:
+            projected_catalog = project_catalog(catalog)
+            catalog = {**catalog, **projected_catalog}
+            projected = {
+                table: [name for name, _ in column_types]
+                for table, column_types in projected_catalog.items()
+            }
+        fingerprints, previous_fingerprints, skipped_tables = {}, {}, {}
+        if config["skip_unchanged"]:
+            with throttled(throttle, "all tables", "fingerprints"):
+                fingerprints = get_table_fingerprints(conn, catalog)
+            previous_fingerprints = get_fingerprints(s3_client, bucket_name)
+            skipped_tables = find_unchanged_tables(
+                fingerprints, previous_fingerprints, config, projected
+            )
+        new_fingerprints = dict(previous_fingerprints)
+        catalog = {
+            table: column_types
+            for table, column_types in catalog.items()
+            if table not in skipped_tables
+        }
+        table_names = list(catalog)
         datetime_string = datetime.today().strftime("%Y%m%d_%H%M%S")
-        for table in table_names:
-            # Query the table
-            rows, columns = get_rows_and_columns_from_table(conn, table)
-            # Convert to pandas df, format JSON file, and upload file to S3 bucket
-            key = write_table_to_s3(
-                s3_client, bucket_name, table, rows, columns, datetime_string
+        # Key range chunks are extracted concurrently, so they need the pool
+        use_pool = config["parallel"] or config["partition_rows"] > 0
+        if use_pool:
+            pool = create_conn_pool(
+                db_credentials,
+                config["pool_size"] - 1,
+                connect=create_conn,
+                cache_name="extract",
             )
-            keys.append(key)
-        # Write log file to S3 bucket
-        log_file(s3_client, bucket_name, keys)
-        close_db(conn)
+            pool.put(conn)
+            results = extract_tables_in_parallel(
+                pool, catalog, config, watermarks, datetime_string, throttle
+            )
+        else:
+            results = {}
+            for table in table_names:
+                try:
+                    results[table] = extract_table(
+                        conn,
+                        table,
+                        config,
+                        watermarks.get(table),
+                        datetime_string,
+                        catalog[table],
+                        throttle=throttle,
+                    )
+                except Exception as e:
+                    results[table] = e
+        for table in table_names:
+            if isinstance(results[table], Exception):
+                print(f"Error extracting {table}: {results[table]}")
+                reason = get_cancellation_reason(results[table])
+                failed_tables[table] = (
+                    f"Cancelled by the {reason}, retried on the next run: {results[table]}"
+                    if reason
+                    else str(results[table])
+                )
+                continue
+            result = results[table]
+            key = result["key"]
+            # Rows without a key were read but never reached S3
+            if key is None and result["rows"]:
+                print(f"Error extracting {table}: rows were not uploaded")
+                failed_tables[table] = f"{result['rows']} rows of {table} were not uploaded"
+                continue
+            entry = {
+                "key": key,
+                "rows": result["rows"],
+                "bytes": 0,
+                "checksum": None,
+                "format": config["output_format"],
+                "codec": config["codec"],
+                "duration_s": round(result["duration_s"], 3),
+            }
+            if key:
+                entry.update(
+                    describe_s3_objects(s3_client, bucket_name, result.get("parts", [key]))
+                )
+            if table in projected:
+                entry["columns"] = projected[table]
+            # Extracted without a watermark, the object holds the whole table
+            if watermarks.get(table) is None:
+                entry["snapshot"] = True
+            if "parts" in result:
+                entry["parts"] = result["parts"]
+                partitioned_tables.append(table)
+            manifest_tables[table] = entry
+            # A table with no new rows is still up to date as of its fingerprint
+            if table in fingerprints:
+                new_fingerprints[table] = {"fingerprint": fingerprints[table], **entry}
+            # Only move the watermark on once the rows are safely in S3
+            if key and result["watermark"]:
+                new_watermarks[table] = result["watermark"]
+        for table, entry in skipped_tables.items():
+            manifest_tables[table] = skipped_entry(entry, config)
+        # The manifest goes last so it only ever lists objects already in S3
+        manifest_key = write_batch_manifest(
+            s3_client,
+            bucket_name,
+            datetime_string,
+            manifest_tables,
+            failed_tables=failed_tables,
+        )
+        put_watermarks(s3_client, bucket_name, new_watermarks)
+        if config["skip_unchanged"]:
+            put_fingerprints(s3_client, bucket_name, new_fingerprints)
         print(
             f"Log: Batch extraction completed - {datetime.today().strftime('%Y-%m-%d_%H-%M-%S')}"
         )
         return {"message": "Batch extraction job completed",
                 "statusCode": 200,
-                "datetime_string" : datetime_string}
+                "datetime_string" : datetime_string,
+                "manifest_key": manifest_key,
+                "output_format": config["output_format"],
+                "codec": config["codec"],
+                "peak_memory_mb": get_peak_memory_mb(),
+                "peak_memory_scope": peak_memory_scope,
+                "partitioned_tables": partitioned_tables,
+                "skipped_tables": {
+                    table: manifest_tables[table]["key"] for table in skipped_tables
+                },
+                "failed_tables": failed_tables}
     except (
         ClientError,
         NoCredentialsError,
@@ -70,4 +629,6 @@ def lambda_handler(event, context):
         Exception,
     ) as e:
         print(f"Batch extraction job failed: {e}")
+        # Start the next run on fresh connections and credentials
+        drop_cached_conn("extract")
         return {"message": "Batch extraction job failed", "error": str(e)}
@@ -5,8 +5,14 @@ import psycopg2
 import pandas as pd
 import json
 import time 
-from src.utils import get_secret
-from src.lambda_transform_utils import (return_s3_key)
+from src.utils import (
+    get_secret,
+    read_batch_manifest,
+    get_cached_secret,
+    get_cached_conn,
+    drop_cached_conn,
+)
+from src.s3_keys import build_table_key
 
 def lambda_handler(event, context):
     """moves parquet files from the """
@@ -17,13 +23,14 @@ def lambda_handler(event, context):
             secret_name = os.environ.get("SECRET_NAME")
         else:
             secret_name = event["SECRET_NAME"]
-        db_credentials = get_secret(sm_client, secret_name)
-        dw_cleanup(db_credentials)
+        # Secret and connection are reused across warm invocations
+        db_credentials = get_cached_secret(sm_client, secret_name, fetch=get_secret)
+        conn = get_cached_conn(db_credentials, name="load", connect=load_connection_psycopg2, is_alive=is_psycopg2_conn_alive)
+        dw_cleanup(conn)
         
         # Connection
         print("Loading started...")
         start_time = time.time()
-        conn = load_connection_psycopg2(db_credentials)
         cursor = conn.cursor()
 
         bucket_name = 'totesys-processed-zone-fenor'
@@ -31,11 +38,22 @@ def lambda_handler(event, context):
         
         list_of_tables = ["dim_date", "dim_design", "dim_location", "dim_counterparty", "dim_staff", "dim_currency", "fact_sales_order"]
 
+        # The transform's batch manifest lists the files it wrote; batches
+        # without one fall back to the key layout
+        manifest = read_batch_manifest(s3_client, bucket_name, event["datetime_string"])
+        if manifest is not None:
+            s3_keys = {file: entry["key"] for file, entry in manifest["tables"].items()}
+        else:
+            s3_keys = {file: build_table_key(file, event["datetime_string"], extension=".parquet") for file in list_of_tables}
+
         # Insert statement
         for file in list_of_tables:
             
+            # Tables skipped by the transform have nothing to load
+            if file not in s3_keys:
+                continue
             # Read parquet file
-            s3_key = return_s3_key(file, event["datetime_string"], extension=".parquet")
+            s3_key = s3_keys[file]
             s3_response = s3_client.get_object(Bucket=bucket_name, Key=s3_key)
             parquet_data = s3_response["Body"].read()
             df = pd.read_parquet(io.BytesIO(parquet_data))
@@ -61,12 +79,13 @@ def lambda_handler(event, context):
             conn.commit()
 
         cursor.close()
-        conn.close()
         end_time = time.time()
         execution_time = end_time - start_time 
         print(execution_time / 60)
         return {"message": "Successfully uploaded to data warehouse"}
     except Exception as e:
+        # Start the next run on a fresh connection and credentials
+        drop_cached_conn("load")
         return {'message': f'Error: {e}'}
 
 def load_connection_psycopg2(db_credentials):
@@ -82,8 +101,20 @@ def load_connection_psycopg2(db_credentials):
     except Exception as e:
         return {"message": str(e) + ", this is likely a secret credentials issue, either they are wrong or the connection to the aws manager couldn't be made"}
     
-def dw_cleanup(db_credentials):
-    conn = load_connection_psycopg2(db_credentials)
+def is_psycopg2_conn_alive(conn):
+    """checks a cached psycopg2 connection with a round trip to the server"""
+    try:
+        if conn.closed:
+            return False
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+def dw_cleanup(conn):
+    """empties the warehouse tables on the load's own connection"""
     cursor = conn.cursor()
     cursor.execute("DELETE FROM fact_sales_order")
     cursor.execute("DELETE FROM dim_counterparty")
@@ -93,6 +124,7 @@ def dw_cleanup(db_credentials):
     cursor.execute("DELETE FROM dim_location")
     cursor.execute("DELETE FROM dim_staff")
     conn.commit()
+    cursor.close()
     return {"message": "Date Warehouse restored to default state."}
 
     
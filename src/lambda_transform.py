@@ -23,45 +23,146 @@ import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
 from pg8000.exceptions import DatabaseError
 import logging
+import time
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from random import random, randint
+from botocore.config import Config
 
 #from dotenv import load_dotenv
 #from src.utils import return_datetime_string
 #from src.lambda_transform_utils import read_s3_table_json, _return_df_dim_dates, _return_df_dim_design, _return_df_dim_location, populate_parquet_file, _return_df_dim_counterparty, _return_df_dim_staff, _return_df_dim_currency, _return_df_fact_sales_order, return_s3_key
 
 from src.utils import (
-    return_datetime_string
+    return_datetime_string,
+    read_batch_manifest,
+    write_batch_manifest,
+    describe_s3_objects,
+    CODEC_EXTENSIONS
 )
 
 from src.lambda_transform_utils import (
     read_s3_table_json,
-    _return_df_dim_dates,
-    _return_df_dim_design,
-    _return_df_dim_location,
+    read_s3_table_parquet,
+    read_s3_table_json_arrow,
+    read_s3_table_parquet_arrow,
+    read_s3_table_parts,
+    read_manifest_entry,
+    is_manifest_key,
     populate_parquet_file,
-    _return_df_dim_counterparty,
-    _return_df_dim_staff,
-    _return_df_dim_currency,
-    _return_df_fact_sales_order,
-    return_s3_key
 )
 
+from src.transform_dag import get_transform_dag, run_transform_dag, DEFAULT_BUILD_WORKERS
+
+from src.lambda_transform_arrow import ARROW_BUILDERS
+
+from src.transform_memo import get_memo, put_memo, input_hash, find_memoised_output
+
+from src.lambda_compact_utils import read_table_state
+
+from src.s3_keys import build_table_key, build_table_manifest_key
+
 
 logger = logging.getLogger(__name__) 
 logger.setLevel(logging.INFO)
 
+# One per ToteSys table the outputs are built from, so all are read at once
+DEFAULT_READ_CONCURRENCY = 7
+DEFAULT_WRITE_CONCURRENCY = 4
+# Capped so a misconfigured run cannot open hundreds of S3 connections
+MAX_IO_CONCURRENCY = 16
+# Marks a source loaded at its latest state rather than as the batch's rows
+LATEST_STATE = ":latest"
+
+
+def get_transform_config(event):
+    """Merges the options passed in the event with the environment defaults."""
+    def option(name, env_name, default):
+        value = event.get(name, os.environ.get(env_name, default))
+        if isinstance(default, bool) and isinstance(value, str):
+            return value.lower() == "true"
+        return type(default)(value)
+
+    return {
+        "read_mode": option("read_mode", "TRANSFORM_READ_MODE", "batch"),
+        # "pandas" builds the outputs as DataFrames, "arrow" as pyarrow tables end
+        # to end; both write the same Parquet schema and data
+        "engine": option("engine", "TRANSFORM_ENGINE", "pandas"),
+        # outputs whose source objects and builder are unchanged since they
+        # were last written are reused rather than rebuilt
+        "memoise": option("memoise", "TRANSFORM_MEMOISE", True),
+        # ingestion tables read at once and processed files written at once,
+        # 1 being one after another
+        "read_concurrency": max(
+            1, min(option("read_concurrency", "TRANSFORM_READ_CONCURRENCY", DEFAULT_READ_CONCURRENCY), MAX_IO_CONCURRENCY)
+        ),
+        "write_concurrency": max(
+            1, min(option("write_concurrency", "TRANSFORM_WRITE_CONCURRENCY", DEFAULT_WRITE_CONCURRENCY), MAX_IO_CONCURRENCY)
+        ),
+        # output tables built at once, each as soon as its own sources are read
+        "build_concurrency": max(
+            1, min(option("build_concurrency", "TRANSFORM_BUILD_CONCURRENCY", DEFAULT_BUILD_WORKERS), MAX_IO_CONCURRENCY)
+        ),
+    }
+
+
+def timed_io(timings, operation, table_name, func, *args):
+    """Runs one S3 read or write, logging and recording how long it took."""
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        duration = time.perf_counter() - start
+        timings.append({"table": table_name, "operation": operation, "duration_s": round(duration, 3)})
+        logger.info(f"{operation} of {table_name} took {duration:.3f}s")
 
 
 
+
+def join_lookups_at_latest_state(dag):
+    """
+    the transform DAG with each output's lookup sources (every source after
+    the first, whose rows drive the output) loaded at their latest state, so
+    a batch changing a counterparty but not its address still joins it to
+    the address
+    """
+    return [(table_name, sources[:1] + [source + LATEST_STATE for source in sources[1:]], build)
+            for table_name, sources, build in dag]
+
+
 def lambda_handler(event, context):
     """Main handler 
     
     inputs:
         event["timestamp"] <- timestamp used in previous operation
+        event["output_format"] <- "json" (default), "jsonl" or "parquet", as written by the extract lambda
+        event["codec"] <- compression codec of the json/jsonl ingestion objects, if any
+        event["partitioned_tables"] <- tables extracted as part objects listed in a manifest
+        event["skipped_tables"] <- unchanged tables, mapped to the previous snapshot's object (or manifest), or None with no new rows
+        (the last three are only used for batches without an extract batch manifest)
+        event["read_mode"] <- "batch" (default) transforms this batch's rows, joined to the latest state of
+                              the lookup tables (address, department), "snapshot" each
+                              table's latest state: its compacted snapshot plus the batches since,
+                              up to this one (TRANSFORM_READ_MODE env var otherwise)
+        event["read_concurrency"] <- ingestion tables read at once (TRANSFORM_READ_CONCURRENCY, default all 7)
+        event["write_concurrency"] <- processed files uploaded at once (TRANSFORM_WRITE_CONCURRENCY, default 4)
+        event["build_concurrency"] <- output tables built at once (TRANSFORM_BUILD_CONCURRENCY, default 4)
+        event["memoise"] <- reuse outputs whose inputs are unchanged (TRANSFORM_MEMOISE, default true)
+        event["engine"] <- "pandas" (default) or "arrow" transform engine (TRANSFORM_ENGINE env var otherwise)
         
     actions:
+        reads the extract batch manifest for the ingestion keys
+        runs the transform DAG: each output table registered with requires_columns is built as
+        soon as its own sources have been read (each source once, all concurrently), in parallel
+        with the other outputs, and uploaded while the rest are built; a source frame is freed
+        after its last output, and each read and write is logged with its latency
+        with memoise on (batch read mode, with an extract batch manifest), an output whose source
+        checksums and builder code match the last time it was written is not rebuilt: its manifest
+        entry points at that earlier object, and the response lists these as cache_hits
         triggers all util functions, which in turn achieve all required goals
+        skips outputs whose source tables had no rows in the batch
+        writes a batch manifest of the processed tables for the load lambda
         
     notes:
         if memory ever becomes an issue this can be refactored to load/delete dataframes as needed (i.e. >> del df_totesys_design)
@@ -75,7 +176,10 @@ def lambda_handler(event, context):
 
         # variables prep
         datetime_string = event["datetime_string"]
-        s3_client = boto3.client("s3", region_name="eu-west-2")
+        config = get_transform_config(event)
+        # enough pooled connections for every request in flight, part reads included
+        s3_client = boto3.client("s3", region_name="eu-west-2", config=Config(
+            max_pool_connections=config["read_concurrency"] + config["write_concurrency"] + 10))
         ingestion_bucket_name = os.environ.get("INGESTION_BUCKET")
         processed_bucket_name = os.environ.get("PROCESSED_BUCKET")
         responses = []
@@ -86,46 +190,123 @@ def lambda_handler(event, context):
         if "testing_client" in event.keys() != None:
             s3_client = event["testing_client"]
 
-        # read injestion files
-        df_totesys_sales_order  = read_s3_table_json(s3_client, return_s3_key("sales_order",    datetime_string), ingestion_bucket_name)
-        df_totesys_design       = read_s3_table_json(s3_client, return_s3_key("design",         datetime_string), ingestion_bucket_name)
-        df_totesys_address      = read_s3_table_json(s3_client, return_s3_key("address",        datetime_string), ingestion_bucket_name)
-        df_totesys_counterparty = read_s3_table_json(s3_client, return_s3_key("counterparty",   datetime_string), ingestion_bucket_name)
-        df_totesys_staff        = read_s3_table_json(s3_client, return_s3_key("staff",          datetime_string), ingestion_bucket_name)
-        df_totesys_department   = read_s3_table_json(s3_client, return_s3_key("department",     datetime_string), ingestion_bucket_name)
-        df_totesys_currency     = read_s3_table_json(s3_client, return_s3_key("currency",       datetime_string), ingestion_bucket_name)
-        
-
-
-        # produce and populate
-        df_dim_dates = _return_df_dim_dates(df_totesys_sales_order)
-        r = populate_parquet_file(s3_client, datetime_string, "dim_date", df_dim_dates, processed_bucket_name)
-        responses += [r]
-
-
-        df_dim_design = _return_df_dim_design(df_totesys_design)
-        r = populate_parquet_file(s3_client, datetime_string, "dim_design", df_dim_design, processed_bucket_name)
-        responses += [r]
-
-        df_dim_location = _return_df_dim_location(df_totesys_address)
-        r = populate_parquet_file(s3_client, datetime_string, "dim_location", df_dim_location, processed_bucket_name)
-        responses += [r]
-
-        df_dim_counterparty = _return_df_dim_counterparty(df_totesys_counterparty, df_totesys_address)
-        r = populate_parquet_file(s3_client, datetime_string, "dim_counterparty", df_dim_counterparty, processed_bucket_name)
-        responses += [r]
-
-        df_dim_staff = _return_df_dim_staff(df_totesys_staff, df_totesys_department)
-        r = populate_parquet_file(s3_client, datetime_string, "dim_staff", df_dim_staff, processed_bucket_name)
-        responses += [r]
-
-        df_dim_currency = _return_df_dim_currency(df_totesys_currency)
-        r = populate_parquet_file(s3_client, datetime_string, "dim_currency", df_dim_currency, processed_bucket_name)
-        responses += [r]
-
-        df_fact_sales_order = _return_df_fact_sales_order(df_totesys_sales_order)
-        r = populate_parquet_file(s3_client, datetime_string, "fact_sales_order", df_fact_sales_order, processed_bucket_name)
-        responses += [r]
+        # ingestion format is passed on from the extract response
+        if config["engine"] not in ("pandas", "arrow"):
+            raise ValueError(f"Unknown transform engine: {config['engine']}")
+        arrow = config["engine"] == "arrow"
+        output_format = event.get("output_format", "json")
+        if output_format == "parquet":
+            read_s3_table, extension = read_s3_table_parquet_arrow if arrow else read_s3_table_parquet, ".parquet"
+        else:
+            read_s3_table, extension = read_s3_table_json_arrow if arrow else read_s3_table_json, f".{output_format}"
+            extension += CODEC_EXTENSIONS.get(event.get("codec"), "")
+        engine = {"engine": "arrow"} if arrow else {}
+        partitioned_tables = event.get("partitioned_tables", [])
+        skipped_tables = event.get("skipped_tables", {})
+        manifest = read_batch_manifest(s3_client, ingestion_bucket_name, datetime_string)
+        read_mode = config["read_mode"]
+        batch_manifests = {datetime_string: manifest}
+        processed_tables = {}
+        skipped_outputs = []
+        io_timings = []
+
+        def read_latest_state(table_name):
+            df = read_table_state(s3_client, ingestion_bucket_name, table_name, through=datetime_string, manifests=batch_manifests)
+            # the merged state is a frame, handed to the arrow engine as a table
+            return pa.Table.from_pandas(df, preserve_index=False) if arrow and df is not None else df
+
+        def read_ingested_table(table_name):
+            if read_mode == "snapshot":
+                return read_latest_state(table_name)
+            if table_name.endswith(LATEST_STATE):
+                table_name = table_name[:-len(LATEST_STATE)]
+                entry = manifest["tables"].get(table_name)
+                # a full snapshot in this batch already is the latest state
+                if entry and entry.get("snapshot"):
+                    return read_manifest_entry(s3_client, entry, ingestion_bucket_name, **engine)
+                return read_latest_state(table_name)
+            if manifest is not None:
+                # tables with no rows in this batch have no object to read
+                return read_manifest_entry(s3_client, manifest["tables"].get(table_name), ingestion_bucket_name, **engine)
+            if table_name in skipped_tables:
+                # unchanged tables with no new rows have no object
+                s3_key = skipped_tables[table_name]
+                if not s3_key:
+                    return None
+            elif table_name in partitioned_tables:
+                s3_key = build_table_manifest_key(table_name, datetime_string)
+            else:
+                s3_key = build_table_key(table_name, datetime_string, extension)
+            # partitioned tables are read part by part in parallel
+            if is_manifest_key(s3_key):
+                return read_s3_table_parts(s3_client, read_s3_table, s3_key, ingestion_bucket_name)
+            return read_s3_table(s3_client, s3_key, ingestion_bucket_name)
+
+        def write_output(table_name, df, start):
+            r = timed_io(io_timings, "write", table_name, populate_parquet_file,
+                         s3_client, datetime_string, table_name, df, processed_bucket_name)
+            if r.get("ResponseMetadata", {}).get("HTTPStatusCode") != 200:
+                return r, None
+            s3_key = build_table_key(table_name, datetime_string, ".parquet")
+            return r, {"key": s3_key,
+                       "rows": len(df),
+                       **describe_s3_objects(s3_client, processed_bucket_name, [s3_key]),
+                       "format": "parquet",
+                       "codec": "snappy",
+                       "duration_s": round(time.perf_counter() - start, 3)}
+
+        def produce(table_name, build, *dfs):
+            # an output is only rebuilt when its rows changed and its lookups have any
+            if any(df is None for df in dfs):
+                return None
+            start = time.perf_counter()
+            df = build(*dfs)
+            return writers.submit(write_output, table_name, df, start)
+
+        dag = get_transform_dag(ARROW_BUILDERS if arrow else None)
+        memo, digests, memoised = {}, {}, {}
+        if config["memoise"] and read_mode == "batch" and manifest is not None:
+            memo = get_memo(s3_client, processed_bucket_name)
+            for table_name, sources, build in dag:
+                digests[table_name] = input_hash(build, [manifest["tables"].get(source) for source in sources])
+                entry = find_memoised_output(s3_client, processed_bucket_name, memo, table_name, digests[table_name])
+                if entry is not None:
+                    memoised[table_name] = entry
+
+        with ThreadPoolExecutor(max_workers=config["write_concurrency"]) as writers:
+            # read injestion files, produce and populate; sources only memoised outputs read are never read
+            nodes = [node for node in dag if node[0] not in memoised]
+            if read_mode == "batch" and manifest is not None:
+                nodes = join_lookups_at_latest_state(nodes)
+            writes = run_transform_dag(
+                nodes,
+                lambda table_name: timed_io(io_timings, "read", table_name, read_ingested_table, table_name),
+                produce,
+                load_workers=config["read_concurrency"],
+                build_workers=config["build_concurrency"],
+            )
+            cache_hits, cache_misses = [], []
+            for table_name, _, _ in dag:
+                if table_name in memoised:
+                    processed_tables[table_name] = {**memoised[table_name], "duration_s": 0.0, "cached": True}
+                    cache_hits.append(table_name)
+                    continue
+                write = writes[table_name]
+                if write is None:
+                    skipped_outputs.append(table_name)
+                    continue
+                r, entry = write.result()
+                responses.append(r)
+                if entry is not None:
+                    processed_tables[table_name] = entry
+                    if digests.get(table_name):
+                        memo[table_name] = {"input_hash": digests[table_name], "entry": entry}
+                        cache_misses.append(table_name)
+
+        # written last, so it only lists processed files already in S3
+        manifest_key = write_batch_manifest(s3_client, processed_bucket_name, datetime_string, processed_tables, skipped_outputs=skipped_outputs)
+        if cache_misses:
+            put_memo(s3_client, processed_bucket_name, memo)
 
         
         # response logic
@@ -135,6 +316,10 @@ def lambda_handler(event, context):
                     "statusCode": 200,
                     "message": "Receipt processed successfully",
                     "datetime_string" : datetime_string,
+                    "manifest_key" : manifest_key,
+                    "skipped_outputs" : skipped_outputs,
+                    "cache_hits" : cache_hits,
+                    "cache_misses" : cache_misses,
                     "responses_list" : responses
                 }
         else:
@@ -145,6 +330,10 @@ def lambda_handler(event, context):
                     "statusCode": statusCodes,
                     "message": "Receipt processed successfully",
                     "datetime_string" : datetime_string,
+                    "manifest_key" : manifest_key,
+                    "skipped_outputs" : skipped_outputs,
+                    "cache_hits" : cache_hits,
+                    "cache_misses" : cache_misses,
                     "responses_list" : responses
                 }
     except Exception as e:
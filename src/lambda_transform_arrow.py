@@ -0,0 +1,221 @@
+"""
+Arrow-native transform engine.
+
+The same outputs as the pandas builders in lambda_transform_utils, built
+from pyarrow tables with pyarrow.compute and handed to
+populate_parquet_file as tables, so no frame is copied on the way. Each
+output carries the schema, pandas metadata included, that
+pa.Table.from_pandas gives the pandas builder's frame: the index column
+last and listed as the index, so the load lambda reads either engine's
+files the same way.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.lambda_transform_utils import CURRENCY_NAMES, MONTH_NAMES, WEEKDAY_NAMES
+from src.source_columns import SOURCE_COLUMNS
+
+# Output table -> its arrow builder, in the pandas builders' order
+ARROW_BUILDERS = {}
+
+# How pandas describes the column types the builders produce; integers,
+# floats and timestamps are described by their width and unit instead
+PANDAS_TYPES = {
+    pa.bool_(): ("bool", "bool"),
+    pa.date32(): ("date", "object"),
+    pa.string(): ("unicode", "object"),
+    pa.null(): ("empty", "object"),  # an object column of nothing but None
+}
+
+
+def arrow_builder(output_table):
+    """
+    registers an arrow builder for an output table, reading the same
+    source columns as the pandas builder registered for it
+    """
+    def register(build):
+        build.source_columns = SOURCE_COLUMNS[output_table]
+        ARROW_BUILDERS[output_table] = build
+        return build
+
+    return register
+
+
+def _pandas_type(field):
+    """
+    the pandas_type, numpy_type and metadata pa.Table.from_pandas records
+    for a column of the field's type: Parquet-ingested sources keep
+    Postgres' int32, int16, float32 and timestamp columns as they are
+    """
+    if field.type in PANDAS_TYPES:
+        return (*PANDAS_TYPES[field.type], None)
+    if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+        numpy_type = str(np.dtype(field.type.to_pandas_dtype()))
+        return numpy_type, numpy_type, None
+    if pa.types.is_timestamp(field.type):
+        numpy_type = f"datetime64[{field.type.unit}]"
+        if field.type.tz is None:
+            return "datetime", numpy_type, None
+        return "datetimetz", numpy_type, {"timezone": field.type.tz}
+    raise ValueError(f"No pandas type for {field.name}: {field.type}")
+
+
+def _pandas_metadata(schema, index_column):
+    columns = []
+    for field in schema:
+        pandas_type, numpy_type, metadata = _pandas_type(field)
+        columns.append({"name": field.name, "field_name": field.name,
+                        "pandas_type": pandas_type, "numpy_type": numpy_type, "metadata": metadata})
+    return json.dumps({
+        "index_columns": [index_column],
+        "column_indexes": [{"name": None, "field_name": None, "pandas_type": "unicode",
+                            "numpy_type": "object", "metadata": {"encoding": "UTF-8"}}],
+        "columns": columns,
+        "creator": {"library": "pyarrow", "version": pa.__version__},
+        "pandas_version": pd.__version__,
+    })
+
+
+def _set_index(table, index_column):
+    """
+    moves the index column last and describes the table as pandas would
+    a frame indexed by it
+
+    return pa.Table
+    """
+    arrays, names = [], []
+    for name in [name for name in table.column_names if name != index_column] + [index_column]:
+        column = table.column(name)
+        if pa.types.is_string(column.type) and column.null_count == len(column):
+            column = pa.nulls(len(column))  # pandas cannot type a column with no values
+        arrays.append(column)
+        names.append(name)
+    table = pa.table(arrays, names=names)
+    return table.replace_schema_metadata({"pandas": _pandas_metadata(table.schema, index_column)})
+
+
+def _inner_join(left, right, left_on, right_on):
+    """
+    inner join in pandas.merge's row order: the left rows in order, each
+    followed by its matches in the order of the right; the right key is
+    dropped where the keys are named alike
+
+    return pa.Table
+    """
+    left = left.append_column("__left_row", pa.array(np.arange(len(left))))
+    right = right.append_column("__right_row", pa.array(np.arange(len(right))))
+    joined = left.join(right, keys=left_on, right_keys=right_on, join_type="inner")
+    joined = joined.sort_by([("__left_row", "ascending"), ("__right_row", "ascending")])
+    return joined.drop_columns(["__left_row", "__right_row"])
+
+
+def _to_timestamps(column):
+    """
+    a column of timestamps, dates or ISO strings as naive timestamps of at
+    least microsecond precision, tz-aware values in their local time
+    """
+    if pa.types.is_timestamp(column.type):
+        if column.type.tz is not None:
+            column = pc.local_timestamp(column)
+        if column.type.unit in ("s", "ms"):
+            column = column.cast(pa.timestamp("us"))
+        return column
+    return column.cast(pa.timestamp("us"))
+
+
+def _to_dates(column):
+    if pa.types.is_date(column.type):
+        return column.cast(pa.date32())
+    return _to_timestamps(column).cast(pa.date32())
+
+
+@arrow_builder("dim_date")
+def _return_table_dim_dates(totesys_sales_order):
+    # unique days over every date and datetime column
+    list_target_columns = ["created_at", "last_updated", "agreed_delivery_date", "agreed_payment_date"]
+    chunks = [chunk for col in list_target_columns for chunk in _to_dates(totesys_sales_order.column(col)).chunks]
+    dates = pc.unique(pa.chunked_array(chunks, type=pa.date32())).drop_null()
+    dates = dates.take(pc.sort_indices(dates))
+
+    month = pc.month(dates)
+    weekday = pc.day_of_week(dates, count_from_zero=False, week_start=1)  # iso weekday, monday = 1
+    table = pa.table({
+        "date_id": dates.cast(pa.string()),
+        "year": pc.year(dates),
+        "month": month,
+        "day": pc.day(dates),
+        "day_of_week": weekday,
+        "day_name": pa.array(WEEKDAY_NAMES.tolist()).take(pc.subtract(weekday, 1)),
+        "month_name": pa.array(MONTH_NAMES.tolist()).take(pc.subtract(month, 1)),
+        "quarter": pc.quarter(dates),
+    })
+    return _set_index(table, "date_id")
+
+
+@arrow_builder("dim_design")
+def _return_table_dim_design(totesys_design):
+    table = totesys_design.select(["design_id", "design_name", "file_location", "file_name"])
+    return _set_index(table, "design_id")
+
+
+@arrow_builder("dim_location")
+def _return_table_dim_location(totesys_address):
+    columns = ["address_id", "address_line_1", "address_line_2", "district", "city", "postal_code", "country", "phone"]
+    table = totesys_address.select(columns).rename_columns(["location_id"] + columns[1:])
+    return _set_index(table, "location_id")
+
+
+@arrow_builder("dim_counterparty")
+def _return_table_dim_counterparty(totesys_counterparty, totesys_address):
+    counterparty = totesys_counterparty.select(["counterparty_id", "counterparty_legal_name", "legal_address_id"])
+    address = totesys_address.select(["address_id", "address_line_1", "address_line_2", "district", "city", "postal_code", "country", "phone"])
+    merged = _inner_join(counterparty, address, "legal_address_id", "address_id")
+    table = merged.select(["counterparty_id", "counterparty_legal_name", "address_line_1", "address_line_2",
+                           "district", "city", "postal_code", "country", "phone"])
+    table = table.rename_columns(["counterparty_id", "counterparty_legal_name", "counterparty_legal_address_line_1",
+                                  "counterparty_legal_address_line_2", "counterparty_legal_district", "counterparty_legal_city",
+                                  "counterparty_legal_postal_code", "counterparty_legal_country", "counterparty_legal_phone_number"])
+    return _set_index(table, "counterparty_id")
+
+
+@arrow_builder("dim_staff")
+def _return_table_dim_staff(totesys_staff, totesys_department):
+    staff = totesys_staff.select(["staff_id", "first_name", "last_name", "department_id", "email_address"])
+    department = totesys_department.select(["department_id", "department_name", "location"])
+    merged = _inner_join(staff, department, "department_id", "department_id")
+    table = merged.select(["staff_id", "first_name", "last_name", "department_name", "location", "email_address"])
+    return _set_index(table, "staff_id")
+
+
+@arrow_builder("dim_currency")
+def _return_table_dim_currency(totesys_currency):
+    codes = totesys_currency.column("currency_code")
+    # codes without a name are left null, as Series.map leaves them NaN
+    names = pa.array(list(CURRENCY_NAMES.values())).take(pc.index_in(codes, value_set=pa.array(list(CURRENCY_NAMES))))
+    table = totesys_currency.select(["currency_id", "currency_code"]).append_column("currency_name", names)
+    return _set_index(table, "currency_id")
+
+
+@arrow_builder("fact_sales_order")
+def _return_table_fact_sales_order(totesys_sales_order):
+    created_at = _to_timestamps(totesys_sales_order.column("created_at"))
+    last_updated = _to_timestamps(totesys_sales_order.column("last_updated"))
+
+    table = pa.table({
+        "sales_order_id": totesys_sales_order.column("sales_order_id"),
+        "created_date": created_at.cast(pa.date32()).cast(pa.string()),
+        # %S carries the fraction of the second, cut to milliseconds
+        "created_time": pc.utf8_slice_codeunits(pc.strftime(created_at, format="%H:%M:%S"), 0, 12),
+        "last_updated_date": last_updated.cast(pa.date32()).cast(pa.string()),
+        "last_updated_time": pc.utf8_slice_codeunits(pc.strftime(last_updated, format="%H:%M:%S"), 0, 12),
+        "sales_staff_id": totesys_sales_order.column("staff_id"),
+        **{col: totesys_sales_order.column(col) for col in ["counterparty_id", "units_sold", "unit_price", "currency_id", "design_id",
+                                                            "agreed_payment_date", "agreed_delivery_date", "agreed_delivery_location_id"]},
+        "sales_record_id": pa.array(np.arange(1, totesys_sales_order.num_rows + 1)),
+    })
+    return _set_index(table, "sales_record_id")
@@ -1,36 +1,205 @@
 #import dask.dataframe as dd
 import io
+import numpy as np
 import pandas as pd
-import json
 import datetime
-from src.utils import return_week, return_s3_key
+from src.utils import codec_from_key, decompress_bytes, read_table_manifest, PG_TO_ARROW_TYPES
+from src.s3_keys import build_table_key, parse_key
+from src.totesys_schema import TOTESYS_SCHEMA
+from src.source_columns import requires_columns
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 import pyarrow as pa
+import pyarrow.json as pj
 import pyarrow.parquet as pq
 from botocore.exceptions import ClientError
 from io import BytesIO
 
+PART_READ_WORKERS = 8
+WEEKDAY_NAMES = np.array(["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"])
+MONTH_NAMES = np.array(["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"])
+CURRENCY_NAMES = {"GBP": "Great British Pounds", "USD": "United States Dollars", "EUR": "Euro"}
 
 
-def read_s3_table_json(s3_client, s3_key, ingestion_bucket_name):
+
+def is_manifest_key(s3_key):
+    return s3_key.endswith("/manifest.json")
+
+
+def get_ingestion_schema(table_name):
+    """
+    arrow schema the json readers type a ToteSys table with: integers as
+    int64 (as pandas would infer them), timestamps parsed, dates and
+    anything else kept as strings
+    
+    return pa.schema, or None for a table outside the ToteSys schema
+    """
+    if table_name not in TOTESYS_SCHEMA:
+        return None
+    fields = []
+    for name, data_type in TOTESYS_SCHEMA[table_name]:
+        arrow_type = PG_TO_ARROW_TYPES.get(data_type, pa.string())
+        if pa.types.is_integer(arrow_type):
+            arrow_type = pa.int64()
+        elif pa.types.is_date(arrow_type):
+            arrow_type = pa.string()  # arrow's json reader does not parse dates
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def read_json_bytes(data, schema=None):
+    """
+    parses a json array or json lines buffer into an arrow table without
+    going through python objects
+    
+    columns in the schema are typed by it, any others are inferred; data
+    that does not fit the schema is read with every column inferred
+    
+    return pa.Table
+    """
+    stripped = data.strip()
+    if not stripped or stripped.replace(b" ", b"") == b"[]":
+        return schema.empty_table() if schema else pa.table({})
+    is_array = stripped[:1] == b"["
+    # integers are parsed as doubles, as files written through pandas hold
+    # nullable ids as 1.0, and cast back below where that loses nothing
+    parse_schema = schema and pa.schema([
+        pa.field(field.name, pa.float64()) if pa.types.is_integer(field.type) else field for field in schema
+    ])
+    buffer, read_options, explicit_schema = data, None, parse_schema
+    if is_array:
+        # arrow only reads newline-delimited objects, so the array becomes
+        # the single field of one object, read in a single block
+        buffer = b'{"rows":' + data + b"}"
+        read_options = pj.ReadOptions(block_size=len(buffer) + 1)
+        if schema:
+            explicit_schema = pa.schema([pa.field("rows", pa.list_(pa.struct(list(parse_schema))))])
+    try:
+        table = pj.read_json(pa.BufferReader(buffer), read_options=read_options,
+                             parse_options=pj.ParseOptions(explicit_schema=explicit_schema))
+    except pa.ArrowInvalid as e:
+        if schema is None:
+            raise e
+        print(f"Data does not match the ingestion schema, inferring column types: {e}")
+        return read_json_bytes(data)
+    if is_array:
+        rows = table.column("rows")
+        table = pa.Table.from_struct_array(pa.concat_arrays([chunk.flatten() for chunk in rows.chunks]))
+    for field in schema or []:
+        if pa.types.is_integer(field.type) and table.column(field.name).null_count == 0:
+            index = table.schema.get_field_index(field.name)
+            try:
+                table = table.set_column(index, field, table.column(index).cast(field.type))
+            except pa.ArrowInvalid:
+                pass  # fractional values stay doubles
+    return table
+
+
+def read_s3_table_json_arrow(s3_client, s3_key, ingestion_bucket_name, schema=None):
+    """
+    targets give json table in the injestion table and returns it as an
+    arrow table
+    
+    accepts either a single json array or json lines (one record per line),
+    parsed by arrow straight from the object's bytes with the schema of the
+    table the key belongs to (or the schema given)
+    
+    gzip/zstd objects (recorded in the key suffix) are decompressed first
+    
+    return pa.Table
+    """
+    response = s3_client.get_object(Bucket=ingestion_bucket_name, Key=s3_key)
+    data = response['Body'].read()
+    codec = codec_from_key(s3_key)
+    if codec:
+        data = decompress_bytes(data, codec)
+    if schema is None:
+        try:
+            schema = get_ingestion_schema(parse_key(s3_key)["table"])
+        except ValueError:
+            pass  # keys outside the layout are read with inferred types
+    
+    return read_json_bytes(data, schema)
+
+
+def read_s3_table_json(s3_client, s3_key, ingestion_bucket_name, schema=None):
     """
-    targets give json table in the injestion table and returns a df
+    targets give json table in the injestion table and returns a df, read
+    as read_s3_table_json_arrow does
+    
+    return s3_df
+    """
+    return read_s3_table_json_arrow(s3_client, s3_key, ingestion_bucket_name, schema).to_pandas()
+
+
+def read_s3_table_parquet(s3_client, s3_key, ingestion_bucket_name):
+    """
+    targets given parquet table in the injestion bucket and returns a df
     
     return s3_df
     """
     response = s3_client.get_object(Bucket=ingestion_bucket_name, Key=s3_key)
-    json_data = response['Body'].read().decode('utf-8')
-    json_data = json_data.replace("\\", "\\\\")  # If needed
-    df = pd.DataFrame(json.loads(json_data))
+    df = pd.read_parquet(io.BytesIO(response['Body'].read()))
     
     return df
 
 
+def read_s3_table_parquet_arrow(s3_client, s3_key, ingestion_bucket_name):
+    """
+    targets given parquet table in the injestion bucket and returns it as
+    an arrow table
+    
+    return pa.Table
+    """
+    response = s3_client.get_object(Bucket=ingestion_bucket_name, Key=s3_key)
+    
+    return pq.read_table(io.BytesIO(response['Body'].read()))
+
+
+def read_s3_table_parts(s3_client, read_s3_table, manifest_key, ingestion_bucket_name, max_workers=PART_READ_WORKERS):
+    """
+    reads every part listed in a partitioned table's manifest concurrently
+    (with the reader matching the ingestion format) and concatenates them
+    in part order
+    
+    return s3_df, or pa.Table for the arrow readers
+    """
+    part_keys = read_table_manifest(s3_client, ingestion_bucket_name, manifest_key)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(part_keys)))) as executor:
+        dfs = list(executor.map(lambda key: read_s3_table(s3_client, key, ingestion_bucket_name), part_keys))
+    if isinstance(dfs[0], pa.Table):
+        return pa.concat_tables(dfs, promote_options="default")
+    
+    return pd.concat(dfs, ignore_index=True)
+
+
+def read_manifest_entry(s3_client, entry, ingestion_bucket_name, engine="pandas"):
+    """
+    reads the object (or the parts) a batch manifest entry points at, with
+    the reader matching its format and the transform engine; a skipped
+    table only has rows to read where its entry points at a full snapshot
+    
+    return s3_df (pa.Table for the arrow engine), or None for a table with no rows in the batch
+    """
+    if not entry or not entry["key"] or not entry["rows"]:
+        return None
+    if entry.get("skipped") and not entry.get("snapshot"):
+        return None
+    if engine == "arrow":
+        reader = read_s3_table_parquet_arrow if entry["format"] == "parquet" else read_s3_table_json_arrow
+    else:
+        reader = read_s3_table_parquet if entry["format"] == "parquet" else read_s3_table_json
+    if is_manifest_key(entry["key"]):
+        return read_s3_table_parts(s3_client, reader, entry["key"], ingestion_bucket_name)
+    return reader(s3_client, entry["key"], ingestion_bucket_name)
+
+
 def populate_parquet_file(s3_client, datetime_string, table_name, df_file, bucket_name):
     
     try:
-        key = return_s3_key(table_name, datetime_string, extension=".parquet")
-        table = pa.Table.from_pandas(df_file)
+        key = build_table_key(table_name, datetime_string, extension=".parquet")
+        # the arrow engine's tables are written as they are
+        table = df_file if isinstance(df_file, pa.Table) else pa.Table.from_pandas(df_file)
     
         buffer = io.BytesIO()
         pq.write_table(table, buffer)
@@ -42,44 +211,46 @@ def populate_parquet_file(s3_client, datetime_string, table_name, df_file, bucke
         return {"message": "Error", "details": str(e)}
 
 
+def _unique_days(column):
+    """
+    the distinct calendar days in a column of ISO strings, dates or
+    timestamps (json and parquet ingestion), nulls dropped
+    
+    return numpy datetime64[D] array
+    """
+    if isinstance(column.dtype, pd.DatetimeTZDtype):
+        column = column.dt.tz_localize(None)  # keep the local calendar day
+    if not pd.api.types.is_datetime64_any_dtype(column):
+        column = pd.to_datetime(column, format="ISO8601")
+    return pd.unique(column.dropna().to_numpy().astype("datetime64[D]"))
+
+
+@requires_columns("dim_date", sales_order=["created_at", "last_updated", "agreed_delivery_date", "agreed_payment_date"])
 def _return_df_dim_dates(df_totesys_sales_order):
-    #%% produce unique dates mentioned
-    
-    # reduce to just datetime and date columns
-    list_target_columns = ["created_at", "last_updated", "agreed_delivery_date", "agreed_payment_date"    ]
-    df_reduced = df_totesys_sales_order.loc[:, list_target_columns]
-    
-    # trim off datetimes
-    for col in list_target_columns:
-        df_reduced[col] = df_reduced[col].apply(lambda x: x[:10])
-        #df_reduced[col] = df_reduced[col].astype('date64') # slow, also date64 likely wrong spelling
-    
-    # finalise dates in table
-    all_values = []
-    for x in list(df_reduced.values):
-        all_values += list(x)
-    unique_list_of_dates = list(set(all_values))
-    unique_list_of_dates.sort()
-    
-    #%% produce entries for this date
-    
-    months_dict = {1:"january",2:"february",3:"march",4:"april",5:"may",6:"june",7:"july",8:"august",9:"september",10:"october",11:"november",12:"december"}
-    data = []
-    for i, d in enumerate(unique_list_of_dates):
-        weekday_num, weekday_name = return_week(d)
-        months_name = months_dict[int(d[5:7])]
-        quarter_int = (int(d[5:7]) // 3) + 1
-        date_id_val = f"{int(d[:4])}-{int(d[5:7]):02d}-{int(d[8:10]):02d}"
-        
-        data += [[date_id_val, int(d[:4]), int(d[5:7]), int(d[8:10]), weekday_num, weekday_name, months_name, quarter_int]]
-    index = range(len(data))
-    columns = ["date_id", "year", "month", "day", "day_of_week", "day_name", "month_name", "quarter"]
-    df_dim_dates = pd.DataFrame(data=data, columns=columns)
+    # unique days over every date and datetime column, parsed in bulk
+    list_target_columns = ["created_at", "last_updated", "agreed_delivery_date", "agreed_payment_date"]
+    days = [_unique_days(df_totesys_sales_order[col]) for col in list_target_columns]
+    dates = pd.DatetimeIndex(np.unique(np.concatenate(days)))
+    
+    # calendar fields for all dates at once, names looked up by position
+    month = dates.month.to_numpy().astype("int64")
+    weekday = dates.dayofweek.to_numpy()  # monday = 0
+    df_dim_dates = pd.DataFrame({
+        "date_id": dates.strftime("%Y-%m-%d").astype(object),
+        "year": dates.year.to_numpy().astype("int64"),
+        "month": month,
+        "day": dates.day.to_numpy().astype("int64"),
+        "day_of_week": weekday.astype("int64") + 1,  # iso weekday, monday = 1
+        "day_name": WEEKDAY_NAMES[weekday].astype(object),
+        "month_name": MONTH_NAMES[month - 1].astype(object),
+        "quarter": (month - 1) // 3 + 1,
+    })
     
     df_dim_dates.set_index("date_id", inplace=True)
     return df_dim_dates
     
     
+@requires_columns("dim_design", design=["design_id", "design_name", "file_location", "file_name"])
 def _return_df_dim_design(df_totesys_design):
     
     columns = ['design_id', 'design_name', "file_location", "file_name"]
@@ -90,6 +261,7 @@ def _return_df_dim_design(df_totesys_design):
     return df_reduced
 
 
+@requires_columns("dim_location", address=["address_id", "address_line_1", "address_line_2", "district", "city", "postal_code", "country", "phone"])
 def _return_df_dim_location(df_totesys_address):
 
     columns = ['address_id', 'address_line_1', "address_line_2", "district", "city", "postal_code", "country", "phone"]
@@ -101,6 +273,9 @@ def _return_df_dim_location(df_totesys_address):
     return df_reduced
 
     
+@requires_columns("dim_counterparty",
+                  counterparty=["counterparty_id", "counterparty_legal_name", "legal_address_id"],
+                  address=["address_id", "address_line_1", "address_line_2", "district", "city", "postal_code", "country", "phone"])
 def _return_df_dim_counterparty(df_totesys_counterparty, df_totesys_address):
         
     df_count    = copy(df_totesys_counterparty[["counterparty_id", "counterparty_legal_name", "legal_address_id"]])
@@ -116,6 +291,9 @@ def _return_df_dim_counterparty(df_totesys_counterparty, df_totesys_address):
     return df_merged
 
  
+@requires_columns("dim_staff",
+                  staff=["staff_id", "first_name", "last_name", "department_id", "email_address"],
+                  department=["department_id", "department_name", "location"])
 def _return_df_dim_staff(df_totesys_staff, df_totesys_department):
     # Ensure the required columns exist in both DataFrames
     staff_columns = ['staff_id', 'first_name', 'last_name', 'department_id', 'email_address']
@@ -140,17 +318,20 @@ def _return_df_dim_staff(df_totesys_staff, df_totesys_department):
     return df_final
 
 
+@requires_columns("dim_currency", currency=["currency_id", "currency_code"])
 def _return_df_dim_currency(df_totesys_currency):
     columns = ["currency_id", "currency_code", "currency_name"]
-    currency_name_values = {"GBP": "Great British Pounds","USD": "United States Dollars","EUR": "Euro"}
     df_currency_copy = copy(df_totesys_currency)
-    df_currency_copy["currency_name"] = df_currency_copy["currency_code"].map(currency_name_values)
+    df_currency_copy["currency_name"] = df_currency_copy["currency_code"].map(CURRENCY_NAMES)
     df_reduced = df_currency_copy.loc[:,columns]
     df_reduced.set_index("currency_id", inplace=True)
     
     return df_reduced
 
 
+@requires_columns("fact_sales_order",
+                  sales_order=["sales_order_id", "created_at", "last_updated", "staff_id", "counterparty_id", "units_sold", "unit_price",
+                               "currency_id", "design_id", "agreed_payment_date", "agreed_delivery_date", "agreed_delivery_location_id"])
 def _return_df_fact_sales_order(df_totesys_sales_order):
     columns = ["sales_record_id", "sales_order_id", "created_date", "created_time", "last_updated_date", "last_updated_time", "sales_staff_id", "counterparty_id", "units_sold", "unit_price", "currency_id", "design_id", "agreed_payment_date", "agreed_delivery_date", "agreed_delivery_location_id"]
     df_sales_order_copy = copy(df_totesys_sales_order) 
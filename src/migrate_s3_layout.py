@@ -0,0 +1,170 @@
+"""
+Migrates a bucket from the flat key layout to the Hive-style one.
+
+    data/<datetime_string>/<table><ext>                 -> table=<table>/date=<d>/batch=<datetime_string>/part-00000<ext>
+    data/<datetime_string>/<table>/part-<N><ext>        -> table=<table>/date=<d>/batch=<datetime_string>/part-<N><ext>
+    data/<datetime_string>/<table>/manifest.json        -> table=<table>/date=<d>/batch=<datetime_string>/manifest.json
+    data/<datetime_string>/manifest.json                -> manifests/date=<d>/batch=<datetime_string>/manifest.json
+
+Objects are copied (keeping their metadata) before the manifests that list
+them, and the keys inside table manifests, batch manifests and the stored
+fingerprints are rewritten to the new layout, so readers never follow a
+manifest to a missing object. The old objects are only deleted with
+--delete, once everything has been copied. Without --apply the planned moves
+are printed and nothing is changed.
+
+Usage (from the project root):
+    PYTHONPATH=$(pwd) python src/migrate_s3_layout.py --bucket NAME [--apply] [--delete]
+"""
+
+import argparse
+import json
+import re
+
+import boto3
+
+from src.s3_keys import (
+    build_batch_manifest_key,
+    build_table_key,
+    build_table_manifest_key,
+    list_keys,
+)
+from src.utils import get_fingerprints, put_fingerprints
+
+LEGACY_ROOT = "data/"
+LEGACY_PATTERN = re.compile(
+    r"^data/(?P<batch>[^/]+)/(?:"
+    r"(?P<batch_manifest>manifest\.json)"
+    r"|(?P<table>[^/.]+)/(?:(?P<table_manifest>manifest\.json)|part-(?P<part>\d+)(?P<part_extension>\..+))"
+    r"|(?P<single>[^/.]+)(?P<extension>\..+)"
+    r")$"
+)
+# data objects first, then the manifests that list them
+MOVE_ORDER = {"object": 0, "table_manifest": 1, "batch_manifest": 2}
+
+
+def legacy_key_to_hive(key):
+    """
+    Returns the new-layout key and kind ("object", "table_manifest" or
+    "batch_manifest") of a flat-layout key, or None if the key is not one or
+    its batch timestamp cannot be dated.
+    """
+    match = LEGACY_PATTERN.match(key)
+    if match is None:
+        return None
+    batch = match.group("batch")
+    try:
+        if match.group("batch_manifest"):
+            return build_batch_manifest_key(batch), "batch_manifest"
+        if match.group("table_manifest"):
+            return build_table_manifest_key(match.group("table"), batch), "table_manifest"
+        if match.group("part") is not None:
+            new_key = build_table_key(
+                match.group("table"), batch, match.group("part_extension"), int(match.group("part"))
+            )
+            return new_key, "object"
+        return build_table_key(match.group("single"), batch, match.group("extension")), "object"
+    except ValueError:
+        return None
+
+
+def remap_key(key):
+    """Maps a flat-layout key to the new layout, leaving any other key as it is."""
+    mapped = legacy_key_to_hive(key) if key else None
+    return mapped[0] if mapped else key
+
+
+def plan_migration(s3_client, bucket_name):
+    """
+    Lists the flat-layout objects of a bucket and returns the planned moves
+    as (old key, new key, kind) in copy order, and the keys that cannot be
+    migrated.
+    """
+    moves, skipped = [], []
+    for key in list_keys(s3_client, bucket_name, LEGACY_ROOT):
+        mapped = legacy_key_to_hive(key)
+        if mapped is None:
+            skipped.append(key)
+        else:
+            moves.append((key, *mapped))
+    moves.sort(key=lambda move: MOVE_ORDER[move[2]])
+    return moves, skipped
+
+
+def remap_entry(entry):
+    """
+    Maps every key a batch manifest entry or fingerprint record holds: its
+    key and, for a partitioned table, the keys of its parts.
+    """
+    entry["key"] = remap_key(entry.get("key"))
+    if entry.get("parts"):
+        entry["parts"] = [remap_key(part) for part in entry["parts"]]
+    return entry
+
+
+def _rewrite_manifest(s3_client, bucket_name, old_key, new_key, kind):
+    body = json.loads(s3_client.get_object(Bucket=bucket_name, Key=old_key)["Body"].read())
+    if kind == "table_manifest":
+        body["parts"] = [remap_key(part) for part in body["parts"]]
+    else:
+        for entry in body["tables"].values():
+            remap_entry(entry)
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=new_key,
+        Body=json.dumps(body, indent=2).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def migrate_bucket(s3_client, bucket_name, apply=False, delete=False):
+    """
+    Copies every flat-layout object of a bucket into the new layout,
+    rewriting the keys listed in manifests and fingerprints, and with delete
+    removes the old objects afterwards. Without apply nothing is changed.
+
+    Returns the planned moves, the keys that were skipped and how many
+    objects were deleted.
+    """
+    moves, skipped = plan_migration(s3_client, bucket_name)
+    deleted = 0
+    if apply:
+        for old_key, new_key, kind in moves:
+            if kind == "object":
+                s3_client.copy({"Bucket": bucket_name, "Key": old_key}, bucket_name, new_key)
+            else:
+                _rewrite_manifest(s3_client, bucket_name, old_key, new_key, kind)
+        fingerprints = get_fingerprints(s3_client, bucket_name)
+        if fingerprints:
+            for record in fingerprints.values():
+                remap_entry(record)
+            put_fingerprints(s3_client, bucket_name, fingerprints)
+        if delete:
+            for old_key, _, _ in moves:
+                s3_client.delete_object(Bucket=bucket_name, Key=old_key)
+                deleted += 1
+    return {"moves": moves, "skipped": skipped, "deleted": deleted}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--apply", action="store_true", help="copy the objects (default: dry run)")
+    parser.add_argument("--delete", action="store_true", help="delete the old objects after copying")
+    args = parser.parse_args()
+
+    s3_client = boto3.client("s3", region_name="eu-west-2")
+    result = migrate_bucket(s3_client, args.bucket, apply=args.apply, delete=args.delete)
+    for old_key, new_key, _ in result["moves"]:
+        print(f"{old_key} -> {new_key}")
+    for key in result["skipped"]:
+        print(f"skipped {key}")
+    action = "migrated" if args.apply else "would migrate"
+    print(
+        f"{action} {len(result['moves'])} objects, skipped {len(result['skipped'])}, "
+        f"deleted {result['deleted']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Stepped back up after this many queries in a row under half the threshold
+RECOVER_AFTER = 3
+# Fetch sizes are never scaled below this many rows or this fraction
+MIN_BATCH_SIZE = 100
+MIN_SCALE = 1 / 64
+
+
+class QueryThrottle:
+    """Guards the ToteSys source against the extraction's own load.
+
+    Every query runs inside query(), which waits while max_concurrency
+    queries (or fewer, after a back-off) are already running, then times
+    the query and logs it. With a latency_threshold_s, a query slower than
+    the threshold halves both the concurrency limit and the scale applied
+    to fetch and partition chunk sizes; RECOVER_AFTER fast queries in a row step them back up
+    towards max_concurrency and full-size fetches. One throttle is shared
+    by every worker thread of a run.
+    """
+
+    def __init__(self, max_concurrency, latency_threshold_s=0, log=print):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.latency_threshold_s = latency_threshold_s
+        self.limit = self.max_concurrency
+        self.scale = 1.0
+        self.running = 0
+        self.timings = []
+        self._fast_streak = 0
+        self._condition = threading.Condition()
+        self._log = log
+
+    @contextmanager
+    def query(self, table, label="select"):
+        """Holds one of the concurrency slots while the query runs."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.running < self.limit)
+            self.running += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._condition:
+                self.running -= 1
+                self.timings.append(
+                    {"table": table, "query": label, "duration_s": round(duration, 3)}
+                )
+                self._observe(duration)
+                self._condition.notify_all()
+            self._log(
+                f"Log: {label} on {table} took {duration:.3f}s "
+                f"(concurrency limit {self.limit}, fetch scale {self.scale:g})"
+            )
+
+    def _observe(self, duration):
+        if not self.latency_threshold_s:
+            return
+        if duration > self.latency_threshold_s:
+            self.limit = max(1, self.limit // 2)
+            self.scale = max(MIN_SCALE, self.scale / 2)
+            self._fast_streak = 0
+        elif duration < self.latency_threshold_s / 2:
+            self._fast_streak += 1
+            if self._fast_streak >= RECOVER_AFTER:
+                self.limit = min(self.max_concurrency, self.limit + 1)
+                self.scale = min(1.0, self.scale * 2)
+                self._fast_streak = 0
+        else:
+            self._fast_streak = 0
+
+    def batch_size(self, batch_size):
+        """Scales a fetch size down while the source is slow."""
+        return max(min(batch_size, MIN_BATCH_SIZE), int(batch_size * self.scale))
+
+    def chunk_size(self, rows_per_chunk):
+        """Scales the rows per primary-key range down while the source is slow."""
+        return self.batch_size(rows_per_chunk)
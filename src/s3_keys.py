@@ -0,0 +1,148 @@
+"""
+Builds and parses the Hive-style object keys used in both buckets.
+
+    table=<name>/date=<yyyy-mm-dd>/batch=<datetime_string>/part-<NNNNN><ext>
+    table=<name>/date=<yyyy-mm-dd>/batch=<datetime_string>/manifest.json
+    manifests/date=<yyyy-mm-dd>/batch=<datetime_string>/manifest.json
+
+A table extracted or processed as a single object is part 0; a table
+extracted in key ranges has several parts plus the table manifest listing
+them. The batch manifest lists every table of one run. All the history of
+a table, or of a table on one day, is therefore a single prefix listing.
+
+Compacted snapshots of a table live apart from the batches, with a
+manifest pointing at the latest one:
+
+    snapshots/table=<name>/batch=<datetime_string>/snapshot.parquet
+    snapshots/table=<name>/manifest.json
+"""
+
+import re
+from datetime import datetime
+
+# Batch timestamps written by the lambdas, then the older minute-level form
+# of return_datetime_string
+BATCH_FORMATS = ["%Y%m%d_%H%M%S", "%Y-%m-%d_%H-%M"]
+BATCH_MANIFEST_ROOT = "manifests"
+SNAPSHOT_ROOT = "snapshots"
+MANIFEST_NAME = "manifest.json"
+PART_DIGITS = 5
+
+KEY_PATTERN = re.compile(
+    r"^(?:table=(?P<table>[^/]+)|" + BATCH_MANIFEST_ROOT + r")"
+    r"/date=(?P<date>\d{4}-\d{2}-\d{2})"
+    r"/batch=(?P<batch>[^/]+)"
+    r"/(?:(?P<manifest>" + re.escape(MANIFEST_NAME) + r")|part-(?P<part>\d+)(?P<extension>\..+))$"
+)
+
+
+def batch_timestamp(datetime_string):
+    """Parses a batch timestamp into a datetime."""
+    for batch_format in BATCH_FORMATS:
+        try:
+            return datetime.strptime(datetime_string, batch_format)
+        except ValueError:
+            continue
+    raise ValueError(f"{datetime_string!r} is not a batch timestamp")
+
+
+def batch_date(datetime_string):
+    """Returns the yyyy-mm-dd day of a batch timestamp."""
+    return batch_timestamp(datetime_string).strftime("%Y-%m-%d")
+
+
+def table_prefix(table_name, date=None, datetime_string=None):
+    """
+    Prefix of a table's objects: all of its history, one day of it, or one
+    batch when datetime_string is given.
+    """
+    if datetime_string is not None:
+        date = batch_date(datetime_string)
+        return f"table={table_name}/date={date}/batch={datetime_string}/"
+    if date is not None:
+        return f"table={table_name}/date={date}/"
+    return f"table={table_name}/"
+
+
+def batch_manifest_prefix(date=None):
+    """Prefix of every batch manifest, or of one day's batch manifests."""
+    if date is not None:
+        return f"{BATCH_MANIFEST_ROOT}/date={date}/"
+    return f"{BATCH_MANIFEST_ROOT}/"
+
+
+def build_table_key(table_name, datetime_string, extension=".json", part=None):
+    """Key of one part of a table in a batch (part 0 for a single object)."""
+    part = part or 0
+    return f"{table_prefix(table_name, datetime_string=datetime_string)}part-{part:0{PART_DIGITS}d}{extension}"
+
+
+def build_table_manifest_key(table_name, datetime_string):
+    """Key of the manifest listing the parts of a partitioned table."""
+    return f"{table_prefix(table_name, datetime_string=datetime_string)}{MANIFEST_NAME}"
+
+
+def build_batch_manifest_key(datetime_string):
+    """Key of the manifest listing every table of a batch."""
+    return f"{batch_manifest_prefix(batch_date(datetime_string))}batch={datetime_string}/{MANIFEST_NAME}"
+
+
+def build_snapshot_key(table_name, datetime_string):
+    """Key of a table's snapshot compacted through the given batch."""
+    return f"{SNAPSHOT_ROOT}/table={table_name}/batch={datetime_string}/snapshot.parquet"
+
+
+def build_snapshot_manifest_key(table_name):
+    """Key of the manifest describing a table's latest snapshot."""
+    return f"{SNAPSHOT_ROOT}/table={table_name}/{MANIFEST_NAME}"
+
+
+def parse_key(key):
+    """
+    Splits a key of this layout into its table (None for a batch manifest),
+    date, batch, part and extension (None for manifests) and whether it is a
+    manifest. Raises ValueError for keys outside the layout.
+    """
+    match = KEY_PATTERN.match(key)
+    if match is None:
+        raise ValueError(f"{key!r} is not a partitioned table or manifest key")
+    part = match.group("part")
+    return {
+        "table": match.group("table"),
+        "date": match.group("date"),
+        "batch": match.group("batch"),
+        "part": int(part) if part is not None else None,
+        "extension": match.group("extension"),
+        "manifest": match.group("manifest") is not None,
+    }
+
+
+def list_keys(s3_client, bucket_name, prefix, start_after=None):
+    """
+    Lists every key under a prefix, following continuation tokens. S3 lists
+    keys in order, so start_after skips every key up to and including it.
+    """
+    keys = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    params = {"StartAfter": start_after} if start_after else {}
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, **params):
+        keys.extend(item["Key"] for item in page.get("Contents", []))
+    return keys
+
+
+def list_batches(s3_client, bucket_name, after=None):
+    """
+    Returns the timestamp of every batch with a batch manifest, oldest first,
+    or only of those after the batch `after`. That listing starts at the day
+    of `after`, as the older timestamps do not sort in time order within a
+    day, so earlier days are never listed.
+    """
+    start_after = batch_manifest_prefix(batch_date(after)) if after else None
+    batches = [
+        parse_key(key)["batch"]
+        for key in list_keys(s3_client, bucket_name, batch_manifest_prefix(), start_after)
+        if key.endswith(MANIFEST_NAME)
+    ]
+    if after:
+        batches = [batch for batch in batches if batch_timestamp(batch) > batch_timestamp(after)]
+    return sorted(batches, key=batch_timestamp)
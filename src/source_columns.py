@@ -0,0 +1,77 @@
+import importlib
+
+from src.utils import WATERMARK_COLUMN
+
+# Output table -> {source table: [columns its builder reads]}, filled in as
+# the transform builders are decorated with requires_columns
+SOURCE_COLUMNS = {}
+# Output table -> its builder, in registration order, which the transform
+# DAG runs; a new output only needs a decorated builder
+TRANSFORM_BUILDERS = {}
+
+# Importing the builders registers their columns
+BUILDERS_MODULE = "src.lambda_transform_utils"
+
+
+def requires_columns(output_table, **sources):
+    """Declares the source columns a transform builder reads.
+
+    Sources are given in the order of the builder's arguments, e.g.
+    @requires_columns("dim_staff", staff=[...], department=[...]), and are
+    also kept on the builder as build.source_columns. The builder is
+    registered as the one producing output_table.
+    """
+    def register(build):
+        SOURCE_COLUMNS[output_table] = {
+            table: list(columns) for table, columns in sources.items()
+        }
+        build.source_columns = SOURCE_COLUMNS[output_table]
+        TRANSFORM_BUILDERS[output_table] = build
+        return build
+
+    return register
+
+
+def get_required_columns(registry=None):
+    """Returns the union of the columns every builder reads, per source table.
+
+    Without a registry the transform builders are imported so that they
+    register themselves.
+    """
+    if registry is None:
+        importlib.import_module(BUILDERS_MODULE)
+        registry = SOURCE_COLUMNS
+    required = {}
+    for sources in registry.values():
+        for table, columns in sources.items():
+            required.setdefault(table, set()).update(columns)
+    return required
+
+
+def project_column_types(table, column_types, required):
+    """Keeps the columns of a table the transform reads, plus its <table>_id
+    key and the last_updated watermark, in ordinal order.
+
+    Tables no builder reads are kept whole, as the transform has not said
+    what it needs from them.
+    """
+    if table not in required:
+        return column_types
+    keep = required[table] | {f"{table}_id", WATERMARK_COLUMN}
+    return [(name, data_type) for name, data_type in column_types if name in keep]
+
+
+def project_catalog(catalog, required=None):
+    """Applies project_column_types to every table of a schema catalog.
+
+    Returns:
+        Dict of table name to its projected column list, for the tables
+        that lost columns
+    """
+    required = get_required_columns() if required is None else required
+    projected = {}
+    for table, column_types in catalog.items():
+        kept = project_column_types(table, column_types, required)
+        if len(kept) < len(column_types):
+            projected[table] = kept
+    return projected
@@ -0,0 +1,115 @@
+"""
+Column names and PostgreSQL data types of the ToteSys tables, in ordinal
+order, listed parents before the tables that reference them.
+"""
+
+TOTESYS_SCHEMA = {
+    "currency": [
+        ("currency_id", "integer"),
+        ("currency_code", "character varying"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+    ],
+    "department": [
+        ("department_id", "integer"),
+        ("department_name", "character varying"),
+        ("location", "character varying"),
+        ("manager", "character varying"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+    ],
+    "payment_type": [
+        ("payment_type_id", "integer"),
+        ("payment_type_name", "character varying"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+    ],
+    "address": [
+        ("address_id", "integer"),
+        ("address_line_1", "character varying"),
+        ("address_line_2", "character varying"),
+        ("district", "character varying"),
+        ("city", "character varying"),
+        ("postal_code", "character varying"),
+        ("country", "character varying"),
+        ("phone", "character varying"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+    ],
+    "design": [
+        ("design_id", "integer"),
+        ("created_at", "timestamp without time zone"),
+        ("design_name", "character varying"),
+        ("file_location", "character varying"),
+        ("file_name", "character varying"),
+        ("last_updated", "timestamp without time zone"),
+    ],
+    "counterparty": [
+        ("counterparty_id", "integer"),
+        ("counterparty_legal_name", "character varying"),
+        ("legal_address_id", "integer"),
+        ("commercial_contact", "character varying"),
+        ("delivery_contact", "character varying"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+    ],
+    "staff": [
+        ("staff_id", "integer"),
+        ("first_name", "character varying"),
+        ("last_name", "character varying"),
+        ("department_id", "integer"),
+        ("email_address", "character varying"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+    ],
+    "sales_order": [
+        ("sales_order_id", "integer"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+        ("design_id", "integer"),
+        ("staff_id", "integer"),
+        ("counterparty_id", "integer"),
+        ("units_sold", "integer"),
+        ("unit_price", "numeric"),
+        ("currency_id", "integer"),
+        ("agreed_delivery_date", "character varying"),
+        ("agreed_payment_date", "character varying"),
+        ("agreed_delivery_location_id", "integer"),
+    ],
+    "purchase_order": [
+        ("purchase_order_id", "integer"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+        ("staff_id", "integer"),
+        ("counterparty_id", "integer"),
+        ("item_code", "character varying"),
+        ("item_quantity", "integer"),
+        ("item_unit_price", "numeric"),
+        ("currency_id", "integer"),
+        ("agreed_delivery_date", "character varying"),
+        ("agreed_payment_date", "character varying"),
+        ("agreed_delivery_location_id", "integer"),
+    ],
+    "transaction": [
+        ("transaction_id", "integer"),
+        ("transaction_type", "character varying"),
+        ("sales_order_id", "integer"),
+        ("purchase_order_id", "integer"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+    ],
+    "payment": [
+        ("payment_id", "integer"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+        ("transaction_id", "integer"),
+        ("counterparty_id", "integer"),
+        ("payment_amount", "numeric"),
+        ("currency_id", "integer"),
+        ("payment_type_id", "integer"),
+        ("paid", "boolean"),
+        ("payment_date", "character varying"),
+        ("company_ac_number", "integer"),
+        ("counterparty_ac_number", "integer"),
+    ],
+}
@@ -0,0 +1,76 @@
+import importlib
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.source_columns import BUILDERS_MODULE, TRANSFORM_BUILDERS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUILD_WORKERS = 4
+
+
+def get_transform_dag(builders=None):
+    """Returns the transform as (output table, source tables, builder) nodes.
+
+    Sources are in the order of the builder's arguments and nodes in
+    registration order. Without builders the transform builders are
+    imported so that they register themselves.
+    """
+    if builders is None:
+        importlib.import_module(BUILDERS_MODULE)
+        builders = TRANSFORM_BUILDERS
+    return [(output_table, list(build.source_columns), build) for output_table, build in builders.items()]
+
+
+def run_transform_dag(dag, load_source, run_output, load_workers=None, build_workers=DEFAULT_BUILD_WORKERS):
+    """Runs every node of a transform DAG.
+
+    Each source table is loaded once with load_source(table), all of them
+    at once up to load_workers. A node starts as soon as its own sources
+    are loaded, calling run_output(output_table, build, *dfs) on one of
+    build_workers threads, and a source is dropped once the last node
+    reading it has finished, so its frame can be freed while the rest of
+    the DAG runs.
+
+    Returns:
+        Dict of output table to what run_output returned, in DAG order
+    """
+    consumers = Counter(source for _, sources, _ in dag for source in set(sources))
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=load_workers or max(1, len(consumers))) as loaders, \
+            ThreadPoolExecutor(max_workers=build_workers) as builders:
+        loads = {source: loaders.submit(load_source, source) for source in consumers}
+
+        def run(output_table, sources, build):
+            with lock:
+                pending = [loads[source] for source in sources]
+            try:
+                return run_output(output_table, build, *[load.result() for load in pending])
+            finally:
+                del pending
+                with lock:
+                    for source in set(sources):
+                        consumers[source] -= 1
+                        if not consumers[source]:
+                            del loads[source]
+                            logger.info(f"released {source} after its last consumer, {output_table}")
+
+        runs = {}
+        waiting = list(dag)
+        while waiting:
+            with lock:
+                ready = [node for node in waiting if all(loads[source].done() for source in node[1])]
+                if not ready:
+                    unfinished = [loads[source] for node in waiting for source in node[1]]
+            if not ready:
+                wait(unfinished, return_when=FIRST_COMPLETED)
+                del unfinished
+                continue
+            for node in ready:
+                waiting.remove(node)
+                runs[node[0]] = builders.submit(run, *node)
+
+        return {output_table: runs[output_table].result() for output_table, _, _ in dag}
@@ -0,0 +1,77 @@
+import hashlib
+import inspect
+import json
+import sys
+from functools import lru_cache
+
+from botocore.exceptions import ClientError
+
+from src.utils import describe_s3_objects
+
+# In the processed bucket, outside the table/date/batch key layout
+MEMO_KEY = "watermarks/transform_memo.json"
+
+
+@lru_cache(maxsize=None)
+def _module_digest(module_name):
+    return hashlib.sha256(inspect.getsource(sys.modules[module_name]).encode("utf-8")).hexdigest()
+
+
+def builder_version(build):
+    """Returns a version of a builder's code.
+
+    The digest covers the source of the whole module the builder is defined
+    in, so a change to any helper it calls also changes the version.
+    """
+    return f"{build.__qualname__}@{_module_digest(build.__module__)[:16]}"
+
+
+def input_hash(build, entries):
+    """Hashes what a builder's output depends on: the checksums of its source
+    objects, from their batch manifest entries, and the builder's version.
+
+    Returns:
+        Hex digest, or None when a source has no object with a checksum
+        (its output cannot be memoised)
+    """
+    if not all(entry and entry.get("key") and entry.get("rows") and entry.get("checksum") for entry in entries):
+        return None
+    inputs = [builder_version(build)] + [entry["checksum"] for entry in entries]
+    return hashlib.sha256(json.dumps(inputs).encode("utf-8")).hexdigest()
+
+
+def get_memo(s3_client, bucket_name):
+    """Reads the input hash and processed manifest entry recorded per output
+    table by the runs so far.
+
+    Returns an empty dict if no run has recorded one yet.
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=MEMO_KEY)
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return {}
+        raise e
+
+
+def put_memo(s3_client, bucket_name, memo):
+    """Writes the memoised outputs to S3."""
+    s3_client.put_object(Bucket=bucket_name, Key=MEMO_KEY, Body=json.dumps(memo, indent=2))
+    return MEMO_KEY
+
+
+def find_memoised_output(s3_client, bucket_name, memo, output_table, digest):
+    """Returns the processed manifest entry of an earlier output built from
+    the same inputs, if its object is still there unchanged, else None.
+    """
+    record = memo.get(output_table)
+    if digest is None or not record or record["input_hash"] != digest:
+        return None
+    entry = record["entry"]
+    try:
+        if describe_s3_objects(s3_client, bucket_name, [entry["key"]])["checksum"] != entry["checksum"]:
+            return None
+    except ClientError:
+        return None  # deleted since
+    return entry
@@ -1,10 +1,80 @@
+import base64
+import csv
+import gzip
+import hashlib
+import io
 import json
+import queue
+import resource
+import tempfile
+import time
+import zlib
+from contextlib import nullcontext
 from  datetime import datetime, date
+from decimal import Decimal
+from itertools import islice
+from json.encoder import encode_basestring_ascii
 from botocore.exceptions import ClientError, NoCredentialsError
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pg8000.native import Connection
 from pg8000.exceptions import DatabaseError
 
+from src.s3_keys import build_table_key, build_table_manifest_key, build_batch_manifest_key
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for the zstd codec
+    zstandard = None
+
+
+WATERMARK_COLUMN = "last_updated"
+WATERMARK_KEY = "watermarks/last_updated.json"
+FINGERPRINTS_KEY = "watermarks/fingerprints.json"
+DEFAULT_BATCH_SIZE = 5000
+MAX_POOL_SIZE = 4
+# information_schema.columns data_type -> Arrow type for Parquet extraction
+PG_TO_ARROW_TYPES = {
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "numeric": pa.float64(),
+    "real": pa.float32(),
+    "double precision": pa.float64(),
+    "boolean": pa.bool_(),
+    "date": pa.date32(),
+    "timestamp without time zone": pa.timestamp("us"),
+    "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+    "text": pa.string(),
+    "character varying": pa.string(),
+}
+# SQLSTATEs of the statements the session timeouts cancel
+CANCELLED_SQLSTATES = {"57014": "statement timeout", "55P03": "lock timeout"}
+# Parses COPY CSV text back into the values pg8000 returns for conn.run
+PG_TEXT_PARSERS = {
+    "smallint": int,
+    "integer": int,
+    "bigint": int,
+    "numeric": Decimal,
+    "real": float,
+    "double precision": float,
+    "boolean": lambda value: value == "t",
+    "date": date.fromisoformat,
+    "timestamp without time zone": datetime.fromisoformat,
+    "timestamp with time zone": datetime.fromisoformat,
+}
+# COPY quotes every value with FORCE_QUOTE *, so only a NULL is left
+# unquoted; a numeric marker is read back as a float, never as text
+COPY_NULL = "NaN"
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+# S3 requires every multipart part except the last to be at least 5 MiB
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+SCHEMA_CACHE_TTL = 300
+SECRET_CACHE_TTL = 300
+# Compression codecs for ingestion objects and the key suffix that records them
+CODEC_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
 
 def get_secret(sm_client, secret_name):
     """Retrieves database secrets from AWS Secrets Manager."""
@@ -51,56 +121,951 @@ def close_db(conn):
         raise e
 
 
-def get_rows_and_columns_from_table(conn, table):
-    """Fetches rows and column names from a database table."""
+def create_conn_pool(db_credentials, size, connect=None, cache_name=None):
+    """Opens size connections to the database and returns them in a queue.
+
+    With a cache_name the connections come from the warm-invocation cache
+    as <cache_name>-1 to <cache_name>-<size>, so they are reused rather than
+    reopened on every run.
+    """
+    connect = connect or create_conn
+    pool = queue.Queue()
+    for number in range(1, size + 1):
+        if cache_name:
+            pool.put(
+                get_cached_conn(
+                    db_credentials, name=f"{cache_name}-{number}", connect=connect
+                )
+            )
+        else:
+            pool.put(connect(db_credentials))
+    return pool
+
+
+def set_session_timeouts(conn, statement_timeout_ms=0, lock_timeout_ms=0):
+    """Limits how long the session's queries may run or wait on locks.
+
+    A query over either limit is cancelled by the server and raises a
+    DatabaseError. 0 leaves a limit as it is.
+    """
+    if statement_timeout_ms:
+        conn.run(f"SET statement_timeout = {int(statement_timeout_ms)}")
+    if lock_timeout_ms:
+        conn.run(f"SET lock_timeout = {int(lock_timeout_ms)}")
+
+
+def close_conn_pool(pool):
+    """Closes every connection in the pool."""
+    while not pool.empty():
+        close_db(pool.get_nowait())
+
+
+# Secrets and connections kept at module level so they survive warm Lambda
+# invocations instead of costing a Secrets Manager call and a TLS handshake
+# on every run
+_secret_cache = {}
+_conn_cache = {}
+
+
+def get_cached_secret(sm_client, secret_name, ttl=SECRET_CACHE_TTL, fetch=None):
+    """Returns the secret, fetched with get_secret at most once every ttl seconds.
+
+    The TTL bounds how long a rotated secret can go unnoticed; a connection
+    failure also drops the cached copy (see drop_cached_conn).
+    """
+    fetch = fetch or get_secret
+    now = time.monotonic()
+    cached = _secret_cache.get(secret_name)
+    if cached and now - cached[1] < ttl:
+        return cached[0]
+    secret = fetch(sm_client, secret_name)
+    _secret_cache[secret_name] = (secret, now)
+    return secret
+
+
+def is_conn_alive(conn):
+    """Checks a pg8000 connection with a round trip to the server."""
     try:
-        columns_query = conn.run(
-            f"SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = '{table}'"
+        conn.run("SELECT 1")
+        return True
+    except Exception:
+        return False
+
+
+def get_cached_conn(db_credentials, name="default", connect=None, is_alive=None):
+    """Returns a live connection for the credentials, reused across warm invocations.
+
+    A cached connection is only handed out if it was opened with the same
+    credentials and passes the is_alive check; otherwise it is closed and a
+    new one opened with connect.
+    """
+    connect = connect or create_conn
+    is_alive = is_alive or is_conn_alive
+    cached = _conn_cache.get(name)
+    if cached is not None:
+        conn, credentials = cached
+        if credentials == db_credentials and is_alive(conn):
+            return conn
+        print(f"Reconnecting {name}: cached connection is stale.")
+        drop_cached_conn(name)
+    conn = connect(db_credentials)
+    _conn_cache[name] = (conn, db_credentials)
+    return conn
+
+
+def drop_cached_conn(name=None):
+    """Closes and forgets the cached connection name (prefix), or all of them.
+
+    Cached secrets are dropped too, so credentials are re-read on the next
+    connect in case they were rotated.
+    """
+    for cached_name in list(_conn_cache):
+        if name is None or cached_name == name or cached_name.startswith(f"{name}-"):
+            conn, _ = _conn_cache.pop(cached_name)
+            try:
+                conn.close()
+            except Exception:
+                pass
+    _secret_cache.clear()
+
+
+# Schema catalog kept at module level so it survives warm Lambda invocations
+_schema_cache = {"catalog": None, "fingerprint": None, "fetched_at": 0.0}
+
+
+def fetch_schema_catalog(conn):
+    """Fetches every public table's columns and data types in one query.
+
+    Returns a dict of table name to (column_name, data_type) pairs in
+    ordinal_position order.
+    """
+    catalog = {}
+    for table, column, data_type in conn.run(
+        "SELECT table_name, column_name, data_type FROM information_schema.columns WHERE table_schema = 'public' AND table_name NOT LIKE '!_%' ESCAPE '!' ORDER BY table_name, ordinal_position"
+    ):
+        catalog.setdefault(table, []).append((column, data_type))
+    return catalog
+
+
+def get_schema_fingerprint(conn):
+    """Returns a cheap fingerprint of the public schema.
+
+    CREATE/DROP TABLE changes the tables' pg_class rows, and a column being
+    added, renamed, dropped or retyped only changes its pg_attribute row, so
+    the fingerprint covers both: the table count and latest xmins, and a
+    hash of every live column's name, number and type. A changed
+    fingerprint means the catalog must be fetched again.
+    """
+    return list(
+        conn.run(
+            "SELECT COUNT(DISTINCT c.oid), COALESCE(MAX(c.xmin::text::bigint), 0), COALESCE(MAX(a.xmin::text::bigint), 0), md5(COALESCE(string_agg(c.relname || '.' || a.attname || ':' || a.attnum || ':' || a.atttypid, ',' ORDER BY c.relname, a.attnum), '')) FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace LEFT JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped WHERE n.nspname = 'public' AND c.relkind IN ('r', 'v', 'p')"
+        )[0]
+    )
+
+
+def get_schema_catalog(conn, ttl=SCHEMA_CACHE_TTL):
+    """Returns the schema catalog, reusing the cached copy where possible.
+
+    Within ttl seconds of the last check the cache is used as is; after that
+    the fingerprint is compared and the catalog only re-fetched if it changed.
+    """
+    now = time.monotonic()
+    if _schema_cache["catalog"] is not None:
+        if now - _schema_cache["fetched_at"] < ttl:
+            return _schema_cache["catalog"]
+        fingerprint = get_schema_fingerprint(conn)
+        if fingerprint == _schema_cache["fingerprint"]:
+            _schema_cache["fetched_at"] = now
+            return _schema_cache["catalog"]
+    else:
+        fingerprint = get_schema_fingerprint(conn)
+    _schema_cache.update(
+        catalog=fetch_schema_catalog(conn), fingerprint=fingerprint, fetched_at=now
+    )
+    return _schema_cache["catalog"]
+
+
+def get_table_fingerprints(conn, catalog):
+    """Returns a cheap fingerprint of every table in the catalog.
+
+    The fingerprint is the row count and latest last_updated of the table,
+    fetched for all tables in a single UNION ALL round trip. Like the
+    watermarks, it relies on writers bumping last_updated.
+    """
+    selects = []
+    for table, column_types in catalog.items():
+        if WATERMARK_COLUMN in [name for name, _ in column_types]:
+            latest = f"MAX({WATERMARK_COLUMN})::text"
+        else:
+            latest = "NULL::text"
+        selects.append(f"SELECT '{table}', COUNT(*), {latest} FROM {table}")
+    if not selects:
+        return {}
+    return {
+        table: f"{count}|{latest}"
+        for table, count, latest in conn.run(" UNION ALL ".join(selects))
+    }
+
+
+def get_columns_from_table(conn, table):
+    """Fetches the column names of a database table in ordinal order."""
+    columns_query = conn.run(
+        f"SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = '{table}' ORDER BY ordinal_position"
+    )
+    return [column[0] for column in columns_query]
+
+
+def arrow_schema_from_column_types(column_types):
+    """Builds an Arrow schema from (column_name, data_type) pairs.
+
+    Types without an Arrow mapping are stored as strings.
+    """
+    return pa.schema(
+        [
+            pa.field(name, PG_TO_ARROW_TYPES.get(data_type, pa.string()))
+            for name, data_type in column_types
+        ]
+    )
+
+
+def _arrow_converter(arrow_type):
+    """Returns the function that prepares a column's values for pa.array, or None."""
+    if pa.types.is_floating(arrow_type):
+        # pyarrow will not cast Decimal to a float type itself
+        return lambda values: [None if value is None else float(value) for value in values]
+    if pa.types.is_string(arrow_type):
+        return lambda values: [None if value is None else str(value) for value in values]
+    return None
+
+
+def make_record_batch_encoder(schema):
+    """Returns a function converting a batch of pg8000 rows into a RecordBatch.
+
+    The conversion needed by each column is worked out once from the schema,
+    so encoding a batch is one transpose and one pa.array call per column.
+    """
+    columns = [(field.type, _arrow_converter(field.type)) for field in schema]
+
+    def encode_batch(rows):
+        if not rows:
+            return pa.RecordBatch.from_pylist([], schema=schema)
+        arrays = []
+        for (arrow_type, convert), values in zip(columns, zip(*rows)):
+            arrays.append(pa.array(convert(values) if convert else values, type=arrow_type))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    return encode_batch
+
+
+def _encode_json_float(value):
+    """Encodes a float as json.dumps does, including NaN and the infinities."""
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "Infinity" if value > 0 else "-Infinity"
+    return float.__repr__(value)
+
+
+# information_schema.columns data_type -> encoder of a non-null value to JSON,
+# matching json.dumps(value, default=json_default)
+JSON_VALUE_ENCODERS = {
+    "smallint": int.__repr__,
+    "integer": int.__repr__,
+    "bigint": int.__repr__,
+    "numeric": lambda value: _encode_json_float(float(value)),
+    "real": _encode_json_float,
+    "double precision": _encode_json_float,
+    "boolean": lambda value: "true" if value else "false",
+    "date": lambda value: f'"{value.isoformat()}"',
+    "timestamp without time zone": lambda value: f'"{value.isoformat(timespec="milliseconds")}"',
+    "timestamp with time zone": lambda value: f'"{value.isoformat(timespec="milliseconds")}"',
+    "text": encode_basestring_ascii,
+    "character varying": encode_basestring_ascii,
+}
+
+
+def _encode_json_default(value):
+    return json.dumps(value, default=json_default)
+
+
+def make_json_row_encoder(column_types):
+    """Returns a function encoding a pg8000 row as a JSON object string.
+
+    Each column's encoder is picked once from its data type, and the keys
+    are baked into a format template, so a row costs one encoder call per
+    non-null value. The output is the same as json.dumps of the row's dict
+    with json_default.
+    """
+    template = "{" + ", ".join(
+        json.dumps(name).replace("%", "%%") + ": %s" for name, _ in column_types
+    ) + "}"
+    encoders = [
+        JSON_VALUE_ENCODERS.get(data_type, _encode_json_default)
+        for _, data_type in column_types
+    ]
+
+    def encode_row(row):
+        return template % tuple(
+            ["null" if value is None else encode(value) for encode, value in zip(encoders, row)]
         )
-        columns = [column[0] for column in columns_query]
-        rows = conn.run(f"SELECT * FROM {table}")
+
+    return encode_row
+
+
+def get_json_row_encoder(columns, column_types=None):
+    """Returns the fast typed row encoder if the column types are known,
+    otherwise one that goes through json.dumps with json_default."""
+    if column_types:
+        return make_json_row_encoder(column_types)
+    return lambda row: json.dumps(dict(zip(columns, row)), default=json_default)
+
+
+def build_select_query(
+    table, columns, since=None, key_range=None, select="*", inline=False
+):
+    """Builds the SELECT for a table and its named parameters.
+
+    Rows are filtered on the since watermark (when the table has a
+    last_updated column) and on a (key, low, high) primary-key range, low
+    inclusive and high exclusive. With inline the values are validated and
+    written into the query instead, for statements such as COPY that take no
+    bind parameters.
+    """
+    conditions, params = [], {}
+    if since and WATERMARK_COLUMN in columns:
+        if inline:
+            conditions.append(
+                f"{WATERMARK_COLUMN} > '{datetime.fromisoformat(since).isoformat()}'::timestamp"
+            )
+        else:
+            conditions.append(f"{WATERMARK_COLUMN} > CAST(:since AS TIMESTAMP)")
+            params["since"] = since
+    if key_range:
+        key, low, high = key_range
+        if inline:
+            conditions.append(f"{key} >= {int(low)} AND {key} < {int(high)}")
+        else:
+            conditions.append(f"{key} >= :low AND {key} < :high")
+            params.update(low=low, high=high)
+    query = f"SELECT {select} FROM {table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return query, params
+
+
+def get_partition_key(table, column_types):
+    """Returns the integer primary key of a table, or None.
+
+    ToteSys tables lead with a serial <table>_id column, which is what the
+    key ranges of a partitioned extraction are cut on.
+    """
+    if not column_types:
+        return None
+    name, data_type = column_types[0]
+    if name == f"{table}_id" and data_type in ("smallint", "integer", "bigint"):
+        return name
+    return None
+
+
+def get_key_ranges(conn, table, columns, key, rows_per_chunk, since=None):
+    """Splits the rows of a table into key ranges of rows_per_chunk rows.
+
+    Only rows changed since the watermark are considered. The boundaries are
+    every rows_per_chunk-th key of those rows, so sparse or skewed ids give
+    evenly filled chunks and no empty ones. Returns a list of (low, high)
+    pairs, high exclusive, or an empty list if there are no rows.
+    """
+    query, params = build_select_query(
+        table,
+        columns,
+        since=since,
+        select=f"{key}, ROW_NUMBER() OVER (ORDER BY {key}) AS n, COUNT(*) OVER () AS total",
+    )
+    rows = conn.run(
+        f"SELECT {key}, n FROM ({query}) AS numbered WHERE (n - 1) % {int(rows_per_chunk)} = 0 OR n = total ORDER BY {key}",
+        **params,
+    )
+    if not rows:
+        return []
+    starts = [value for value, n in rows if (n - 1) % rows_per_chunk == 0]
+    return list(zip(starts, starts[1:] + [rows[-1][0] + 1]))
+
+
+def get_cancellation_reason(error):
+    """Returns the session timeout that cancelled a query, or None.
+
+    Statements cancelled by statement_timeout or lock_timeout are failures
+    worth retrying on the next run rather than errors in the query itself.
+    """
+    details = error.args[0] if isinstance(error, DatabaseError) and error.args else None
+    if isinstance(details, dict):
+        return CANCELLED_SQLSTATES.get(details.get("C"))
+    return None
+
+
+def get_rows_and_columns_from_table(
+    conn, table, since=None, columns=None, key_range=None, select="*"
+):
+    """Fetches rows and column names from a database table.
+
+    If since is given (an ISO timestamp string) and the table has a
+    last_updated column, only rows changed after that watermark are fetched.
+    A key_range limits the rows to one chunk of a partitioned extraction.
+    Columns already known from the schema catalog skip the column query.
+    select names the columns fetched, e.g. a projection of the table.
+    """
+    try:
+        if columns is None:
+            columns = get_columns_from_table(conn, table)
+        query, params = build_select_query(table, columns, since, key_range, select)
+        rows = conn.run(query, **params)
         return rows, columns
     except Exception as e:
+        # A failed or cancelled query is the table's failure, not an empty table
         print(f"Error querying table {table}: {e}")
-        return [], []
+        raise
+
 
+def stream_rows_from_table(
+    conn,
+    table,
+    columns,
+    batch_size=DEFAULT_BATCH_SIZE,
+    since=None,
+    key_range=None,
+    select="*",
+    throttle=None,
+):
+    """Yields the rows of a database table in batches of at most batch_size.
 
-def write_table_to_s3(s3_client, bucket_name, table, rows, columns, date_and_time):
-    """Converts table data to JSON and uploads it to S3."""
+    Rows are read through a server-side cursor so only one batch is held in
+    memory at a time. The since watermark, key_range and select behave as
+    in get_rows_and_columns_from_table. With a QueryThrottle each FETCH
+    waits for a slot and is timed, and its size shrinks while the source
+    is slow.
+    """
+    cursor_name = f"{table}_cursor"
+    query, params = build_select_query(table, columns, since, key_range, select)
+    conn.run("START TRANSACTION")
+    try:
+        conn.run(f"DECLARE {cursor_name} NO SCROLL CURSOR FOR {query}", **params)
+        while True:
+            if throttle:
+                size = throttle.batch_size(batch_size)
+                with throttle.query(table, "fetch"):
+                    batch = conn.run(f"FETCH FORWARD {int(size)} FROM {cursor_name}")
+            else:
+                size = batch_size
+                batch = conn.run(f"FETCH FORWARD {int(size)} FROM {cursor_name}")
+            if batch:
+                yield batch
+            if len(batch) < size:
+                break
+        conn.run(f"CLOSE {cursor_name}")
+        conn.run("COMMIT")
+    except BaseException:
+        conn.run("ROLLBACK")
+        raise
+
+
+def copy_rows_from_table(
+    conn,
+    table,
+    column_types,
+    batch_size=DEFAULT_BATCH_SIZE,
+    since=None,
+    key_range=None,
+    select="*",
+    throttle=None,
+):
+    """Yields the rows of a database table in batches using COPY TO STDOUT.
+
+    The CSV output of COPY is spooled (in memory, then on disk past
+    SPOOL_MAX_SIZE) and parsed back into typed rows batch_size at a time,
+    so batches match those of stream_rows_from_table. Values are all
+    quoted and NULLs are not, so no text value can be mistaken for a NULL.
+    Parameters:
+        column_types: (column_name, data_type) pairs in ordinal order
+        throttle: QueryThrottle the COPY waits on and is timed by
+    """
+    columns = [name for name, _ in column_types]
+    # COPY takes no bind parameters, so the filters are validated and inlined
+    query, _ = build_select_query(table, columns, since, key_range, select, inline=True)
+    parsers = [PG_TEXT_PARSERS.get(data_type, str) for _, data_type in column_types]
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as buffer:
+        with throttle.query(table, "copy") if throttle else nullcontext():
+            conn.run(
+                f"COPY ({query}) TO STDOUT WITH (FORMAT csv, NULL '{COPY_NULL}', FORCE_QUOTE *)",
+                stream=buffer,
+            )
+        buffer.seek(0)
+        reader = csv.reader(
+            io.TextIOWrapper(buffer, encoding="utf-8", newline=""),
+            quoting=csv.QUOTE_NONNUMERIC,
+        )
+        while True:
+            batch = [
+                [
+                    None if isinstance(value, float) else parse(value)
+                    for parse, value in zip(parsers, record)
+                ]
+                for record in islice(reader, batch_size)
+            ]
+            if not batch:
+                break
+            yield batch
+
+
+def count_rows(batches, counts, table):
+    """Passes batches through, counting the rows seen in counts[table]."""
+    counts.setdefault(table, 0)
+    for batch in batches:
+        counts[table] += len(batch)
+        yield batch
+
+
+def track_watermark(batches, columns, watermarks, table):
+    """Passes batches through, recording the latest last_updated seen in watermarks[table]."""
+    for batch in batches:
+        watermark = get_table_watermark(batch, columns)
+        if watermark and watermark > watermarks.get(table, ""):
+            watermarks[table] = watermark
+        yield batch
+
+
+def json_default(value):
+    """Serialises the pg8000 types that json cannot, matching pandas' iso output."""
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="milliseconds")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def write_batches_to_s3(
+    s3_client,
+    bucket_name,
+    table,
+    batches,
+    columns,
+    date_and_time,
+    codec=None,
+    part=None,
+    column_types=None,
+):
+    """Serialises batches of rows to a JSON array incrementally and uploads it to S3.
+
+    The JSON is spooled to a temporary file (kept in memory up to
+    SPOOL_MAX_SIZE, on /tmp after that) so the table never needs to exist as
+    a single string or DataFrame. An optional codec compresses it on the way.
+    A part number writes one chunk of a partitioned table instead. With the
+    column_types the rows go through the typed encoder of
+    make_json_row_encoder.
+    """
+    try:
+        if not columns:
+            print(f"Skipping {table}: No data to upload.")
+            return None
+        encode_row = get_json_row_encoder(columns, column_types)
+        compressor = get_compressor(codec)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+b") as spool:
+            row_count = 0
+            for batch in batches:
+                if not batch:
+                    continue
+                data = (b"," if row_count else b"[") + ",".join(
+                    map(encode_row, batch)
+                ).encode("utf-8")
+                spool.write(compressor.compress(data) if compressor else data)
+                row_count += len(batch)
+            if not row_count:
+                print(f"Skipping {table}: No data to upload.")
+                return None
+            if compressor:
+                spool.write(compressor.compress(b"]") + compressor.flush())
+            else:
+                spool.write(b"]")
+            spool.seek(0)
+            key = build_table_key(table, date_and_time, ".json", part)
+            if codec:
+                key += CODEC_EXTENSIONS[codec]
+                s3_client.upload_fileobj(
+                    spool, bucket_name, key, ExtraArgs={"Metadata": {"codec": codec}}
+                )
+                return key
+            s3_client.upload_fileobj(spool, bucket_name, key)
+            return key
+    except (ClientError, NoCredentialsError, ValueError, Exception) as e:
+        print(f"Error writing {table} to S3: {e}")
+        raise
+
+
+def write_batches_to_s3_jsonl(
+    s3_client,
+    bucket_name,
+    table,
+    batches,
+    columns,
+    date_and_time,
+    part_size=MULTIPART_PART_SIZE,
+    codec=None,
+    part=None,
+    column_types=None,
+):
+    """Serialises batches of rows to JSON Lines and uploads them to S3 in parts.
+
+    Rows are encoded one line at a time into a buffer that is sent as a
+    multipart upload part whenever it reaches part_size, so only one part is
+    held in memory. Tables smaller than one part are sent with put_object.
+    An optional codec compresses the stream as it is written. A part number
+    writes one chunk of a partitioned table instead. With the column_types
+    the rows go through the typed encoder of make_json_row_encoder.
+    """
+    if not columns:
+        print(f"Skipping {table}: No data to upload.")
+        return None
+    key = build_table_key(table, date_and_time, ".jsonl", part)
+    extra_args = {}
+    if codec:
+        key += CODEC_EXTENSIONS[codec]
+        extra_args = {"Metadata": {"codec": codec}}
+    upload_id = None
+    try:
+        encode_row = get_json_row_encoder(columns, column_types)
+        compressor = get_compressor(codec)
+        parts = []
+        buffer = io.BytesIO()
+        row_count = 0
+        for batch in batches:
+            if batch:
+                lines = ("\n".join(map(encode_row, batch)) + "\n").encode("utf-8")
+                buffer.write(compressor.compress(lines) if compressor else lines)
+                row_count += len(batch)
+            if buffer.tell() >= part_size:
+                if upload_id is None:
+                    upload_id = s3_client.create_multipart_upload(
+                        Bucket=bucket_name, Key=key, **extra_args
+                    )["UploadId"]
+                response = s3_client.upload_part(
+                    Bucket=bucket_name,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=len(parts) + 1,
+                    Body=buffer.getvalue(),
+                )
+                parts.append({"ETag": response["ETag"], "PartNumber": len(parts) + 1})
+                buffer = io.BytesIO()
+        if not row_count:
+            print(f"Skipping {table}: No data to upload.")
+            return None
+        if compressor:
+            buffer.write(compressor.flush())
+        if upload_id is None:
+            s3_client.put_object(
+                Bucket=bucket_name, Key=key, Body=buffer.getvalue(), **extra_args
+            )
+            return key
+        if buffer.tell():
+            response = s3_client.upload_part(
+                Bucket=bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=len(parts) + 1,
+                Body=buffer.getvalue(),
+            )
+            parts.append({"ETag": response["ETag"], "PartNumber": len(parts) + 1})
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+        return key
+    except (ClientError, NoCredentialsError, ValueError, Exception) as e:
+        print(f"Error writing {table} to S3: {e}")
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(
+                Bucket=bucket_name, Key=key, UploadId=upload_id
+            )
+        raise
+
+
+def write_batches_to_s3_parquet(
+    s3_client, bucket_name, table, batches, column_types, date_and_time, codec=None, part=None
+):
+    """Writes batches of rows to a column-typed Parquet file and uploads it to S3.
+
+    Each batch becomes an Arrow RecordBatch (no pandas intermediate) typed
+    from the information_schema data types of the table. A codec is applied
+    as Parquet's own column compression, so the key keeps its .parquet suffix.
+    A part number writes one chunk of a partitioned table instead.
+    """
+    try:
+        if not column_types:
+            print(f"Skipping {table}: No data to upload.")
+            return None
+        schema = arrow_schema_from_column_types(column_types)
+        encode_batch = make_record_batch_encoder(schema)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+b") as spool:
+            row_count = 0
+            with pq.ParquetWriter(spool, schema, compression=codec or "snappy") as writer:
+                for batch in batches:
+                    if batch:
+                        writer.write_batch(encode_batch(batch))
+                        row_count += len(batch)
+            if not row_count:
+                print(f"Skipping {table}: No data to upload.")
+                return None
+            spool.seek(0)
+            key = build_table_key(table, date_and_time, ".parquet", part)
+            s3_client.upload_fileobj(spool, bucket_name, key)
+            return key
+    except (ClientError, NoCredentialsError, ValueError, Exception) as e:
+        print(f"Error writing {table} to S3: {e}")
+        raise
+
+
+def get_compressor(codec):
+    """Returns an incremental compressor (compress/flush) for the codec, or None."""
+    if not codec:
+        return None
+    if codec == "gzip":
+        return zlib.compressobj(wbits=31)  # wbits=31 writes a gzip container
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("The zstd codec requires the zstandard package.")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def compress_bytes(data, codec):
+    """Compresses data with the codec (no-op when codec is None)."""
+    compressor = get_compressor(codec)
+    if compressor is None:
+        return data
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress_bytes(data, codec):
+    """Decompresses data written with compress_bytes."""
+    if not codec:
+        return data
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("The zstd codec requires the zstandard package.")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def codec_from_key(key):
+    """Returns the codec recorded in an S3 key's suffix, or None if uncompressed."""
+    for codec, extension in CODEC_EXTENSIONS.items():
+        if key.endswith(extension):
+            return codec
+    return None
+
+
+def reset_peak_memory():
+    """Resets the resident memory high-water mark of this process, so that
+    get_peak_memory_mb measures from here (Linux 4.0+, as on Lambda).
+
+    Returns False where the high-water mark cannot be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_memory_mb():
+    """Returns the peak resident memory of this process in MB since the last
+    reset_peak_memory (VmHWM).
+
+    Where /proc is not available this is the peak over the whole life of the
+    process (ru_maxrss), earlier warm invocations included.
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def write_table_to_s3(
+    s3_client, bucket_name, table, rows, columns, date_and_time, codec=None, column_types=None
+):
+    """Converts table data to JSON and uploads it to S3.
+
+    If a codec is given the JSON is compressed, the codec's suffix is added
+    to the key and the codec is recorded in the object metadata. With the
+    column_types the rows are encoded directly by make_json_row_encoder
+    instead of going through a pandas DataFrame.
+    """
     try:
         if not rows or not columns:
             print(f"Skipping {table}: No data to upload.")
             return None
-        df = pd.DataFrame(data=rows, columns=columns)
-        json_data = df.to_json(orient="records", lines=False, date_format="iso")
-        key = f"data/{date_and_time}/{table}.json"
+        if column_types:
+            json_data = "[" + ",".join(map(make_json_row_encoder(column_types), rows)) + "]"
+        else:
+            df = pd.DataFrame(data=rows, columns=columns)
+            json_data = df.to_json(orient="records", lines=False, date_format="iso")
+        key = build_table_key(table, date_and_time, ".json")
+        if codec:
+            key += CODEC_EXTENSIONS[codec]
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=key,
+                Body=compress_bytes(json_data.encode("utf-8"), codec),
+                Metadata={"codec": codec},
+            )
+            return key
         s3_client.put_object(Bucket=bucket_name, Key=key, Body=json_data)
         return key
     except (ClientError, NoCredentialsError, ValueError, Exception) as e:
         print(f"Error writing {table} to S3: {e}")
+        raise
+
+
+def get_table_watermark(rows, columns):
+    """Returns the latest last_updated value in the rows as an ISO string."""
+    if not rows or WATERMARK_COLUMN not in columns:
         return None
+    index = columns.index(WATERMARK_COLUMN)
+    values = [row[index] for row in rows if row[index] is not None]
+    if not values:
+        return None
+    latest = max(values)
+    return latest.isoformat() if isinstance(latest, (datetime, date)) else str(latest)
+
 
+def get_watermarks(s3_client, bucket_name, key=WATERMARK_KEY):
+    """Reads the per-table high-water marks from S3.
 
-def log_file(s3_client, bucket_name, keys):
-    """Logs file upload details and writes to S3."""
+    Returns an empty dict if no watermark file exists yet (first run).
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=key)
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            print("No watermarks found: running a full snapshot.")
+            return {}
+        print(f"Error reading watermarks from S3: {e}")
+        raise e
+
+
+def put_watermarks(s3_client, bucket_name, watermarks, key=WATERMARK_KEY):
+    """Writes the per-table high-water marks to S3."""
     try:
-        if not keys:
-            print("No files were uploaded to log.")
-            return None
-        log_contents = []
-        for key in keys:
-            log_contents.append(f"Uploaded: {key} at {datetime.now()}")
-        formatted_log = "\n".join(log_contents)
-        bytes_log = str.encode(formatted_log)
         s3_client.put_object(
-            Body=bytes_log,
-            Bucket=bucket_name,
-            Key=f"logs/{datetime.today().strftime('%Y-%m-%d_%H-%M-%S')}.log",
+            Bucket=bucket_name, Key=key, Body=json.dumps(watermarks, indent=2)
         )
-        return {"message": "Files Processed: Batch Lambda Transform complete"}
+        return key
     except (ClientError, NoCredentialsError, Exception) as e:
-        print(f"Error logging files to S3: {e}")
-        return None
+        print(f"Error writing watermarks to S3: {e}")
+        raise e
+
+
+def get_fingerprints(s3_client, bucket_name):
+    """Reads the table fingerprints and object keys recorded by the last run."""
+    return get_watermarks(s3_client, bucket_name, key=FINGERPRINTS_KEY)
+
+
+def put_fingerprints(s3_client, bucket_name, fingerprints):
+    """Writes the table fingerprints and object keys of this run to S3."""
+    return put_watermarks(s3_client, bucket_name, fingerprints, key=FINGERPRINTS_KEY)
+
+
+def describe_s3_objects(s3_client, bucket_name, keys):
+    """Returns the total byte size and a checksum of the objects at keys.
+
+    The checksum is the object's ETag, or for several objects (the parts of
+    a partitioned table) the MD5 of their ETags suffixed with the part count,
+    as S3 does for multipart uploads.
+    """
+    sizes, etags = [], []
+    for key in keys:
+        response = s3_client.head_object(Bucket=bucket_name, Key=key)
+        sizes.append(response["ContentLength"])
+        etags.append(response["ETag"].strip('"'))
+    if len(etags) == 1:
+        checksum = etags[0]
+    else:
+        checksum = f"{hashlib.md5(''.join(etags).encode()).hexdigest()}-{len(etags)}"
+    return {"bytes": sum(sizes), "checksum": checksum}
+
+
+def write_batch_manifest(s3_client, bucket_name, datetime_string, tables, **details):
+    """Writes the machine-readable manifest of a batch to S3.
+
+    tables maps each table name to its entry (key, rows, bytes, checksum,
+    format, codec, duration_s). The manifest is written last, after every
+    object it lists, in a single PUT with a Content-MD5, so a reader sees
+    either no manifest or the complete one.
+    """
+    key = build_batch_manifest_key(datetime_string)
+    body = json.dumps(
+        {
+            "datetime_string": datetime_string,
+            "created_at": datetime.now().isoformat(),
+            **details,
+            "tables": tables,
+        },
+        indent=2,
+        default=json_default,
+    ).encode("utf-8")
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=body,
+        ContentMD5=base64.b64encode(hashlib.md5(body).digest()).decode(),
+        ContentType="application/json",
+    )
+    return key
+
+
+def read_batch_manifest(s3_client, bucket_name, datetime_string):
+    """Reads the manifest of a batch from S3.
+
+    Returns None if the batch has no manifest (batches written before it
+    existed).
+    """
+    try:
+        response = s3_client.get_object(
+            Bucket=bucket_name, Key=build_batch_manifest_key(datetime_string)
+        )
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise e
+
+
+def write_table_manifest(s3_client, bucket_name, table, date_and_time, part_keys):
+    """Writes the manifest listing the part objects of a partitioned table."""
+    key = build_table_manifest_key(table, date_and_time)
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=json.dumps({"table": table, "parts": part_keys}, indent=2),
+    )
+    return key
+
+
+def read_table_manifest(s3_client, bucket_name, key):
+    """Returns the part keys listed in a partitioned table's manifest."""
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    return json.loads(response["Body"].read())["parts"]
 
 
 def json_to_pg8000_output(filepath, include_cols_in_output=True):
@@ -140,9 +1105,6 @@ def return_week(date_isoformat_str):
     return weekday_num, weekday_name    
 
 
-def return_s3_key(table_name, datetime_string, extension=".json"):
-    return f'data/{datetime_string}/{table_name}{extension}'
-
 def return_datetime_string():
     timestamp = datetime.now()
     year, month, day, hour, minute = timestamp.year, timestamp.month, timestamp.day, timestamp.hour, timestamp.minute
@@ -0,0 +1,94 @@
+# Lambda Function - Compact
+# Merges the incremental ingestion batches into each table's latest-state
+# snapshot, on its own schedule, so the transform reads snapshot + tail
+# batches. Shares the extract's role and layer: it only touches the
+# ingestion bucket.
+resource "aws_lambda_function" "lambda_compact_handler" {
+  filename         = data.archive_file.lambda_compact_package.output_path
+  function_name    = "${var.lambda_compact_handler}"
+  runtime          = "python3.13"
+  role             = aws_iam_role.lambda_extract_iam_role.arn
+  handler          = "src.lambda_compact.lambda_handler"
+  timeout          =  600
+  memory_size      =  1024
+  # One compaction at a time, so two runs never write the same snapshot
+  reserved_concurrent_executions = 1
+  layers            = [ aws_lambda_layer_version.lambda_extract_layer.arn, "arn:aws:lambda:eu-west-2:336392948345:layer:AWSSDKPandas-Python313:1" ]
+  source_code_hash = data.archive_file.lambda_compact_package.output_base64sha256
+  depends_on = [
+    aws_iam_policy.lambda_extract_cloudwatch_logs,
+    aws_iam_role_policy_attachment.lambda_extract_attach_logs
+  ]
+  tags = merge(
+    var.default_tags,
+    {
+      Name = "Lambda: Compact ingestion batches"
+    })
+  environment {
+    variables = {
+      INGESTION_BUCKET    = "totesys-ingestion-zone-fenor"
+      COMPACT_MIN_BATCHES = "30"
+    }
+  }
+}
+
+data "archive_file" "lambda_compact_package" {
+  type        = "zip"
+  output_path = "${path.module}/lambda_compact.zip"
+  source {
+    content = file("${path.module}/../../src/lambda_compact.py")
+    filename = "src/lambda_compact.py"
+  }
+  source {
+    content = file("${path.module}/../../src/lambda_compact_utils.py")
+    filename = "src/lambda_compact_utils.py"
+  }
+  source {
+    content = file("${path.module}/../../src/utils.py")
+    filename = "src/utils.py"
+  }
+  source {
+    content = file("${path.module}/../../src/s3_keys.py")
+    filename = "src/s3_keys.py"
+  }
+  source {
+    content = file("${path.module}/../../src/lambda_transform_utils.py")
+    filename = "src/lambda_transform_utils.py"
+  }
+  source {
+    content = file("${path.module}/../../src/source_columns.py")
+    filename = "src/source_columns.py"
+  }
+  source {
+    content = file("${path.module}/../../src/totesys_schema.py")
+    filename = "src/totesys_schema.py"
+  }
+}
+
+
+# Schedule - hourly, a table is compacted once 30 batches are waiting
+resource "aws_cloudwatch_event_rule" "lambda_compact_trigger" {
+  name                = "lambda-compact-trigger"
+  description         = "Triggers EventBridge event to compact ingestion batches"
+  schedule_expression = "cron(30 * * * ? *)"
+  state = var.enable-disable-eventbridge
+    tags = merge(
+    var.default_tags,
+    {
+      Name = "Lambda compact trigger with schedule expression"
+  })
+}
+
+resource "aws_cloudwatch_event_target" "lambda_compact_event_target" {
+  rule      = aws_cloudwatch_event_rule.lambda_compact_trigger.name
+  target_id = "lambda_compact"
+  arn       = aws_lambda_function.lambda_compact_handler.arn
+}
+
+resource "aws_lambda_permission" "eventbridge_allow_compact" {
+  statement_id  = "AllowCompactFromCloudWatch"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.lambda_compact_handler.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.lambda_compact_trigger.arn
+}
@@ -6,6 +6,8 @@ resource "aws_lambda_function" "lambda_extract_handler" {
   role             = aws_iam_role.lambda_extract_iam_role.arn
   handler          = "src.lambda_extract.lambda_handler"
   timeout          =  200
+  # One extract at a time, so overlapping schedules cannot double the load on ToteSys
+  reserved_concurrent_executions = 1
   layers            = [ aws_lambda_layer_version.lambda_extract_layer.arn, "arn:aws:lambda:eu-west-2:336392948345:layer:AWSSDKPandas-Python313:1" ]
   source_code_hash = data.archive_file.lambda_extract_package.output_base64sha256
   depends_on = [
@@ -19,8 +21,11 @@ resource "aws_lambda_function" "lambda_extract_handler" {
     })
   environment {
     variables = {
-      SECRET_NAME = "totesys-db-credentials"
-      BUCKET_NAME = "totesys-ingestion-zone-fenor"
+      SECRET_NAME    = "totesys-db-credentials"
+      BUCKET_NAME    = "totesys-ingestion-zone-fenor"
+      EXTRACT_FORMAT = "jsonl"
+      STATEMENT_TIMEOUT_MS = "120000"
+      LOCK_TIMEOUT_MS      = "5000"
     }
   } 
 }
@@ -46,6 +51,26 @@ data "archive_file" "lambda_extract_package" {
     content = file("${path.module}/../../src/utils.py")
     filename = "src/utils.py"
   }
+  source {
+    content = file("${path.module}/../../src/s3_keys.py")
+    filename = "src/s3_keys.py"
+  }
+  source {
+    content = file("${path.module}/../../src/source_columns.py")
+    filename = "src/source_columns.py"
+  }
+  source {
+    content = file("${path.module}/../../src/totesys_schema.py")
+    filename = "src/totesys_schema.py"
+  }
+  source {
+    content = file("${path.module}/../../src/query_throttle.py")
+    filename = "src/query_throttle.py"
+  }
+  source {
+    content = file("${path.module}/../../src/lambda_transform_utils.py")
+    filename = "src/lambda_transform_utils.py"
+  }
 }
 
 
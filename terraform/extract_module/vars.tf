@@ -31,6 +31,11 @@ variable "lambda_load_handler" {
   default = "lambda_load_handler"
 }
 
+variable "lambda_compact_handler" {
+  type = string 
+  default = "lambda_compact_handler"
+}
+
 
 variable "enable-disable-eventbridge" {
   type    = string
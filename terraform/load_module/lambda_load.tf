@@ -32,6 +32,10 @@ data "archive_file" "lambda_load_package" {
   source {
     content = file("${path.module}/../../src/utils.py")
     filename = "src/utils.py"
+  }
+  source {
+    content = file("${path.module}/../../src/s3_keys.py")
+    filename = "src/s3_keys.py"
   }
     source {
     content = file("${path.module}/../../src/lambda_transform_utils.py")
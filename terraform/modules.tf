@@ -4,6 +4,7 @@ module "extract_module" {
   aws_region     = local.aws_region
   default_tags   = var.default_tags
   enable-disable-eventbridge = var.enable-disable-eventbridge
+  lambda_compact_handler = var.lambda_compact_handler
 }
 
 module "transform_module" {
@@ -33,10 +33,38 @@ data "archive_file" "lambda_transform_package" {
     content = file("${path.module}/../../src/utils.py")
     filename = "src/utils.py"
   }
+  source {
+    content = file("${path.module}/../../src/s3_keys.py")
+    filename = "src/s3_keys.py"
+  }
   source {
     content = file("${path.module}/../../src/lambda_transform_utils.py")
     filename = "src/lambda_transform_utils.py"
   }
+  source {
+    content = file("${path.module}/../../src/lambda_compact_utils.py")
+    filename = "src/lambda_compact_utils.py"
+  }
+  source {
+    content = file("${path.module}/../../src/source_columns.py")
+    filename = "src/source_columns.py"
+  }
+  source {
+    content = file("${path.module}/../../src/totesys_schema.py")
+    filename = "src/totesys_schema.py"
+  }
+  source {
+    content = file("${path.module}/../../src/transform_dag.py")
+    filename = "src/transform_dag.py"
+  }
+  source {
+    content = file("${path.module}/../../src/transform_memo.py")
+    filename = "src/transform_memo.py"
+  }
+  source {
+    content = file("${path.module}/../../src/lambda_transform_arrow.py")
+    filename = "src/lambda_transform_arrow.py"
+  }
 }
 
 
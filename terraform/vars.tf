@@ -57,6 +57,11 @@ variable "lambda_load_handler" {
   default = "lambda_load_handler"
 }
 
+variable "lambda_compact_handler" {
+  type    = string
+  default = "lambda_compact_handler"
+}
+
 # Step Functions State Machine
 
 variable "totesys_etl_pipeline" {
@@ -0,0 +1,107 @@
+import json
+import pytest
+from unittest.mock import MagicMock
+from src.data_generator import (
+    TOTESYS_SCHEMA,
+    TOTESYS_TABLES,
+    generate_totesys,
+    insert_into_postgres,
+    load_samples,
+    table_sizes,
+    write_jsonl,
+)
+
+
+@pytest.fixture(scope="module")
+def samples():
+    return load_samples()
+
+
+@pytest.fixture(scope="module")
+def tables(samples):
+    return dict(generate_totesys(scale=0.2, seed=7, samples=samples))
+
+
+class TestGenerateTotesys:
+    def test_generates_every_table_with_the_totesys_columns(self, tables):
+        assert list(tables) == TOTESYS_TABLES
+        for table, df in tables.items():
+            assert list(df.columns) == [name for name, _ in TOTESYS_SCHEMA[table]]
+
+    def test_row_counts_follow_the_scale_factor(self, samples, tables):
+        sizes = table_sizes(samples, 0.2)
+        assert sizes["currency"] == len(samples["currency"])
+        assert sizes["sales_order"] == round(len(samples["sales_order"]) * 0.2)
+        assert sizes["transaction"] == sizes["sales_order"] + sizes["purchase_order"]
+        assert {table: len(df) for table, df in tables.items()} == sizes
+
+    def test_same_seed_gives_identical_data(self, samples, tables):
+        again = dict(generate_totesys(scale=0.2, seed=7, samples=samples))
+        for table, df in tables.items():
+            assert df.equals(again[table])
+
+    def test_different_seeds_give_different_data(self, samples, tables):
+        other = dict(generate_totesys(scale=0.2, seed=8, samples=samples))
+        assert not tables["sales_order"].equals(other["sales_order"])
+
+    def test_foreign_keys_reference_generated_rows(self, tables):
+        def ids(table):
+            return set(tables[table][f"{table}_id"])
+
+        sales, purchases = tables["sales_order"], tables["purchase_order"]
+        assert set(tables["counterparty"]["legal_address_id"]) <= ids("address")
+        assert set(tables["staff"]["department_id"]) <= ids("department")
+        for orders in [sales, purchases]:
+            assert set(orders["staff_id"]) <= ids("staff")
+            assert set(orders["counterparty_id"]) <= ids("counterparty")
+            assert set(orders["currency_id"]) <= ids("currency")
+            assert set(orders["agreed_delivery_location_id"]) <= ids("address")
+        assert set(sales["design_id"]) <= ids("design")
+        assert set(tables["payment"]["transaction_id"]) == ids("transaction")
+        assert set(tables["payment"]["payment_type_id"]) <= ids("payment_type")
+
+    def test_one_transaction_per_order_in_creation_order(self, tables):
+        transaction = tables["transaction"]
+        assert transaction["created_at"].is_monotonic_increasing
+        assert sorted(transaction["sales_order_id"].dropna()) == list(tables["sales_order"]["sales_order_id"])
+        assert sorted(transaction["purchase_order_id"].dropna()) == list(tables["purchase_order"]["purchase_order_id"])
+        assert (transaction["sales_order_id"].isna() == (transaction["transaction_type"] == "PURCHASE")).all()
+
+    def test_values_follow_the_sample_distributions(self, samples, tables):
+        sales = tables["sales_order"]
+        sample = samples["sales_order"]
+        assert sales["units_sold"].between(sample["units_sold"].min(), sample["units_sold"].max()).all()
+        assert set(sales["unit_price"]) <= set(sample["unit_price"])
+        assert (sales["last_updated"] >= sales["created_at"]).all()
+        assert sales["agreed_delivery_date"].str.match(r"^\d{4}-\d{2}-\d{2}$").all()
+
+
+class TestOutputs:
+    def test_write_jsonl_matches_the_sample_layout(self, tables, tmp_path):
+        counts = write_jsonl(tables.items(), tmp_path)
+
+        assert counts == {table: len(df) for table, df in tables.items()}
+        with open(tmp_path / "transaction.jsonl") as file:
+            lines = file.read().splitlines()
+        assert len(lines) == len(tables["transaction"])
+        record = json.loads(lines[0])
+        assert list(record) == [name for name, _ in TOTESYS_SCHEMA["transaction"]]
+        assert len(record["created_at"]) == len("2022-11-03T14:20:52.186")
+        assert isinstance(record["sales_order_id"] or record["purchase_order_id"], int)
+
+    def test_insert_into_postgres_recreates_and_copies_each_table(self, tables):
+        conn = MagicMock()
+        copied = {}
+        conn.run.side_effect = lambda sql, stream=None: copied.update(
+            {sql: stream.read()} if stream else {}
+        )
+
+        counts = insert_into_postgres(conn, [("currency", tables["currency"])])
+
+        assert counts == {"currency": 3}
+        statements = [call.args[0] for call in conn.run.call_args_list]
+        assert statements[0] == "DROP TABLE IF EXISTS currency"
+        assert statements[1].startswith("CREATE TABLE currency (currency_id integer")
+        copy_sql = "COPY currency (currency_id, currency_code, created_at, last_updated) FROM STDIN WITH (FORMAT csv)"
+        assert statements[2] == copy_sql
+        assert copied[copy_sql].splitlines()[0] == "1,GBP,2022-11-03 14:20:49.962,2022-11-03 14:20:49.962"
@@ -3,15 +3,18 @@ import boto3
 from moto import mock_aws
 from unittest.mock import Mock, patch
 from datetime import datetime
-from src.lambda_transform import lambda_handler
+from src.lambda_transform import lambda_handler, get_transform_config, MAX_IO_CONCURRENCY
 from datetime import datetime
-from src.utils import json_to_pg8000_output, return_s3_key
+from src.utils import json_to_pg8000_output
+from src.s3_keys import build_table_key, build_batch_manifest_key
 from unittest import mock
-from src.lambda_transform_utils import read_s3_table_json, _return_df_dim_dates, _return_df_dim_design,  populate_parquet_file, _return_df_dim_location, _return_df_dim_staff, _return_df_dim_currency, _return_df_fact_sales_order, _return_df_dim_counterparty
-from src.utils import json_to_pg8000_output, return_datetime_string, write_table_to_s3, return_week
+from src.lambda_transform_utils import read_manifest_entry, read_s3_table_json, read_json_bytes, get_ingestion_schema, read_s3_table_parquet, read_s3_table_parts, _return_df_dim_dates, _return_df_dim_design,  populate_parquet_file, _return_df_dim_location, _return_df_dim_staff, _return_df_dim_currency, _return_df_fact_sales_order, _return_df_dim_counterparty
+from src.utils import json_to_pg8000_output, return_datetime_string, write_table_to_s3, return_week, compress_bytes, write_table_manifest, write_batch_manifest, read_batch_manifest
 import pandas as pd
+import pyarrow.parquet as pq
 import io
-from _pytest.monkeypatch import MonkeyPatch
+import logging
+import time
 
 """
 test_lambda_2_TDD.py
@@ -108,7 +111,7 @@ def s3_client(hardcoded_variables):
 def s3_client_ingestion_populated_with_totesys_sales_order_jsonl_inc_datetime_str(s3_client, hardcoded_variables):
     # just populates a single jsonl file into a mock bucket for unit testing
     datetime_str = return_datetime_string()
-    key = return_s3_key("sales_order", datetime_str)
+    key = build_table_key("sales_order", datetime_str)
     
     # act
     with open("data/json_lines_s3_format/sales_order.jsonl", "rb") as file:
@@ -122,7 +125,7 @@ def s3_client_ingestion_populated_with_totesys_jsonl(s3_client, hardcoded_variab
     datetime_str = return_datetime_string()
     jsonl_list = ["address","counterparty","currency","department","design","sales_order","staff"]
     for jsonl_file in jsonl_list:
-        key = return_s3_key(jsonl_file, datetime_str)
+        key = build_table_key(jsonl_file, datetime_str)
         with open(f"data/json_lines_s3_format/{jsonl_file}.jsonl", "rb") as file:
             s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=file.read())
     
@@ -136,9 +139,8 @@ def example_sales_order_table(hardcoded_variables):
 
 @pytest.fixture
 def mock_s3_env_vars(monkeypatch, hardcoded_variables):
-    monkeypatch = MonkeyPatch()
-    monkeypatch.setenv("INJESTION_BUCKET_NAME", hardcoded_variables["ingestion_bucket_name"])
-    monkeypatch.setenv("PROCESSED_BUCKET_NAME", hardcoded_variables["processing_bucket_name"])
+    monkeypatch.setenv("INGESTION_BUCKET", hardcoded_variables["ingestion_bucket_name"])
+    monkeypatch.setenv("PROCESSED_BUCKET", hardcoded_variables["processing_bucket_name"])
     
         
 
@@ -210,9 +212,9 @@ class TestReads3TableJson:
         list_table_names = list(hardcoded_variables["dict_table_snapshot_filepaths"].keys())
         target_table_name = list_table_names[0] # this is likely the "address" table name
         now = datetime.now()
-        original_invocation_time_string = now.strftime("%m/%d/%Y, %H:%M:%S")
+        original_invocation_time_string = now.strftime("%Y%m%d_%H%M%S")
         expected_cities = return_list_of_cities_in_address_df
-        inj_file_key = return_s3_key(target_table_name, original_invocation_time_string)
+        inj_file_key = build_table_key(target_table_name, original_invocation_time_string)
         with open("data/json_lines_s3_format/address.jsonl", "rb") as file:
             s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=inj_file_key, Body=file.read())
         
@@ -227,6 +229,172 @@ class TestReads3TableJson:
         assert isinstance(actual_df_addresses_table, pd.DataFrame)
 
 
+class TestReads3TableJsonLines:
+    def test_1c_json_array_and_json_lines_give_the_same_df(self, s3_client, hardcoded_variables):
+        """
+        the extract lambda can write either a json array or json lines, both must be readable
+        """
+        # assemble
+        datetime_string = return_datetime_string()
+        array_key = build_table_key("currency", datetime_string)
+        lines_key = build_table_key("currency", datetime_string, extension=".jsonl")
+        with open("data/json_files/currency.json", "rb") as file:
+            s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=array_key, Body=file.read())
+        with open("data/json_lines_s3_format/currency.jsonl", "rb") as file:
+            s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=lines_key, Body=file.read())
+        
+        # act
+        df_from_array = read_s3_table_json(s3_client, array_key, hardcoded_variables["ingestion_bucket_name"])
+        df_from_lines = read_s3_table_json(s3_client, lines_key, hardcoded_variables["ingestion_bucket_name"])
+        
+        # assert
+        pd.testing.assert_frame_equal(df_from_array, df_from_lines)
+        assert list(df_from_lines["currency_code"]) == ["GBP", "USD", "EUR"]
+
+
+class TestReads3TableJsonTyped:
+    def test_1f_json_is_typed_by_the_ingestion_schema(self, s3_client, hardcoded_variables):
+        """
+        the reader types columns from the table's schema rather than guessing them from the values
+        """
+        # assemble
+        key = build_table_key("sales_order", return_datetime_string(), extension=".jsonl")
+        with open("data/json_lines_s3_format/sales_order.jsonl", "rb") as file:
+            s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=file.read())
+        
+        # act
+        df = read_s3_table_json(s3_client, key, hardcoded_variables["ingestion_bucket_name"])
+        
+        # assert
+        assert df["sales_order_id"].dtype == "int64"
+        assert df["unit_price"].dtype == "float64"
+        assert pd.api.types.is_datetime64_any_dtype(df["created_at"])
+        assert df["agreed_delivery_date"].iloc[0] == "2022-11-07"
+
+    def test_1g_escaped_characters_are_decoded(self):
+        """
+        json escapes decode to the characters they stand for, backslashes included
+        """
+        # assemble
+        data = b'{"design_id": 1, "file_location": "\\/usr", "file_name": "a\\\\b.json"}\n'
+        
+        # act
+        df = read_json_bytes(data, get_ingestion_schema("design")).to_pandas()
+        
+        # assert
+        assert df["file_location"].iloc[0] == "/usr"
+        assert df["file_name"].iloc[0] == "a\\b.json"
+
+    def test_1h_empty_objects_give_an_empty_table_with_the_schema_columns(self):
+        # act
+        table = read_json_bytes(b"[]", get_ingestion_schema("currency"))
+        
+        # assert
+        assert table.num_rows == 0
+        assert table.column_names == ["currency_id", "currency_code", "created_at", "last_updated"]
+
+    def test_1i_data_not_matching_the_schema_is_read_with_inferred_types(self):
+        # assemble
+        data = b'[{"currency_id": "not a number", "currency_code": "GBP"}]'
+        
+        # act
+        df = read_json_bytes(data, get_ingestion_schema("currency")).to_pandas()
+        
+        # assert
+        assert list(df["currency_id"]) == ["not a number"]
+
+    def test_1j_keys_outside_the_layout_are_read_with_inferred_types(self, s3_client, hardcoded_variables):
+        # assemble
+        s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key="adhoc/export.json",
+                             Body=b'[{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]')
+        
+        # act
+        df = read_s3_table_json(s3_client, "adhoc/export.json", hardcoded_variables["ingestion_bucket_name"])
+        
+        # assert
+        assert list(df["id"]) == [1, 2]
+        assert get_ingestion_schema("not_a_totesys_table") is None
+
+
+class TestReads3TableCompressed:
+    def test_1d_compressed_json_lines_are_decoded_transparently(self, s3_client, hardcoded_variables):
+        """
+        gzip/zstd ingestion objects are recognised by their key suffix and decompressed on read
+        """
+        # assemble
+        with open("data/json_lines_s3_format/address.jsonl", "rb") as file:
+            raw = file.read()
+        datetime_string = return_datetime_string()
+        keys = {"gzip": build_table_key("address", datetime_string, extension=".jsonl.gz"),
+                "zstd": build_table_key("address", datetime_string, extension=".jsonl.zst")}
+        for codec, key in keys.items():
+            s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=compress_bytes(raw, codec))
+        
+        # act
+        dfs = [read_s3_table_json(s3_client, key, hardcoded_variables["ingestion_bucket_name"]) for key in keys.values()]
+        
+        # assert
+        for df in dfs:
+            assert len(df) == 30
+            assert list(df["city"].values[:3]) == ["New Patienceburgh", "Aliso Viejo", "Lake Charles"]
+
+
+class TestReads3TablePartitioned:
+    def test_1e_partitioned_table_parts_are_concatenated_in_order(self, s3_client, hardcoded_variables):
+        """
+        large tables may be extracted as key range parts listed in a manifest, read back as one df
+        """
+        # assemble
+        with open("data/json_lines_s3_format/sales_order.jsonl", "rb") as file:
+            lines = file.read().splitlines(keepends=True)
+        datetime_string = return_datetime_string()
+        part_keys = []
+        for part, start in enumerate(range(0, len(lines), 1000)):
+            key = build_table_key("sales_order", datetime_string, extension=".jsonl", part=part)
+            s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=b"".join(lines[start:start + 1000]))
+            part_keys.append(key)
+        # the whole table goes in another batch, as it would be part 0 of this one
+        whole_key = build_table_key("sales_order", "20250101_000000", extension=".jsonl")
+        s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=whole_key, Body=b"".join(lines))
+        
+        # act
+        manifest_key = write_table_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], "sales_order", datetime_string, part_keys)
+        df_parts = read_s3_table_parts(s3_client, read_s3_table_json, manifest_key, hardcoded_variables["ingestion_bucket_name"])
+        df_whole = read_s3_table_json(s3_client, whole_key, hardcoded_variables["ingestion_bucket_name"])
+        
+        # assert
+        assert len(part_keys) > 1
+        pd.testing.assert_frame_equal(df_parts, df_whole)
+
+
+class TestReads3TableParquet:
+    def test_1b_can_read_s3_parquet(self, s3_client, hardcoded_variables):
+        """
+        ingestion objects may also be column-typed parquet written by the extract lambda
+
+        Expected behavior:
+        - read_s3_table_parquet(s3_client, s3_key)
+            should:
+            return the same table as a df, with timestamps kept as datetimes
+        """
+        # assemble
+        df_expected = pd.DataFrame({"sales_order_id": [2, 3],
+                                    "created_at": pd.to_datetime(["2022-11-03T14:20:52.186", "2022-11-04T11:37:10.341"]),
+                                    "last_updated": pd.to_datetime(["2022-11-03T14:20:52.186", "2022-11-04T11:37:10.341"]),
+                                    "agreed_delivery_date": ["2022-11-07", "2022-11-06"],
+                                    "agreed_payment_date": ["2022-11-08", "2022-11-07"]})
+        inj_file_key = build_table_key("sales_order", return_datetime_string(), extension=".parquet")
+        s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=inj_file_key, Body=df_expected.to_parquet())
+        
+        # act
+        df_actual = read_s3_table_parquet(s3_client, inj_file_key, hardcoded_variables["ingestion_bucket_name"])
+        df_dim_dates = _return_df_dim_dates(df_actual)
+        
+        # assert
+        pd.testing.assert_frame_equal(df_actual, df_expected)
+        assert list(df_dim_dates.index.values) == ["2022-11-03", "2022-11-04", "2022-11-06", "2022-11-07", "2022-11-08"]
+
+
 class TestCreateDateTable:
     """
     This is a test to see if we can create (and test) the creation of the dim_designs table with the "Sales" schema
@@ -261,7 +429,7 @@ class TestCreateDateTable:
         """
         # assemble
         s3_client, datetime_string = s3_client_ingestion_populated_with_totesys_sales_order_jsonl_inc_datetime_str
-        inj_file_key = return_s3_key("sales_order", datetime_string)
+        inj_file_key = build_table_key("sales_order", datetime_string)
         df_totesys_sales_order = read_s3_table_json(s3_client, inj_file_key, hardcoded_variables["ingestion_bucket_name"])
         df_dim_dates_name = "dim_dates"
         hardcode_limit = 10 # this limits the size of the imported sales table so that a human can hardcode the expected values
@@ -307,19 +475,39 @@ class TestCreateDateTable:
         assert all(expected_month_name == df_dim_dates["month_name"])
         assert all(expected_quater == df_dim_dates["quarter"].values)
 
+    def test_2b_dim_dates_quarters_and_mixed_inputs(self):
+        """
+        quarters run january-march, april-june, july-september and october-december,
+        and days are taken from iso strings, dates and timestamps alike, ignoring nulls
+        """
+        # assemble
+        df_totesys_sales_order = pd.DataFrame({"created_at": pd.to_datetime(["2023-03-31T23:59:59.999", "2023-04-01T00:00:00.000"]),
+                                               "last_updated": ["2023-06-30T12:00:00.000", "2023-07-01T12:00:00.000"],
+                                               "agreed_delivery_date": [datetime(2023, 9, 30).date(), None],
+                                               "agreed_payment_date": ["2023-10-01", "2023-12-31"]})
+        
+        # act
+        df_dim_dates = _return_df_dim_dates(df_totesys_sales_order)
+        
+        # assert
+        assert list(df_dim_dates.index) == ["2023-03-31", "2023-04-01", "2023-06-30", "2023-07-01", "2023-09-30", "2023-10-01", "2023-12-31"]
+        assert list(df_dim_dates["quarter"]) == [1, 2, 2, 3, 3, 4, 4]
+        assert list(df_dim_dates.loc["2023-12-31"]) == [2023, 12, 31, 7, "sunday", "december", 4]
+
         
 class TestCreateDesignTables:
     
     def test_3a_dim_design_table_is_created_in_correct_position(self, s3_client_ingestion_populated_with_totesys_jsonl, hardcoded_variables):
         s3_client, datetime_string = s3_client_ingestion_populated_with_totesys_jsonl
-        inj_file_key = return_s3_key("design", datetime_string)
+        inj_file_key = build_table_key("design", datetime_string)
         df_totesys_design = read_s3_table_json(s3_client, inj_file_key, hardcoded_variables["ingestion_bucket_name"])
         df_dim_design_name = "dim_design"
         hardcode_limit = 10 # this limits the size of the imported sales table so that a human can hardcode the expected values
         
         expected_design_id_values = [8, 51, 69, 16, 54, 10, 57, 41, 45, 2]
         expected_design_name_values = ["Wooden", "Bronze", "Bronze", "Soft", "Plastic", "Soft", "Cotton", "Granite", "Frozen", "Steel"]
-        expected_file_location_values = ["\/usr", "\/private", "\/lost+found", "\/System", "\/usr\/ports", "\/usr\/share", "\/etc\/periodic", "\/usr\/X11R6", "\/Users", "\/etc\/periodic"]
+        # json may escape "/" as "\/", which the reader decodes
+        expected_file_location_values = ["/usr", "/private", "/lost+found", "/System", "/usr/ports", "/usr/share", "/etc/periodic", "/usr/X11R6", "/Users", "/etc/periodic"]
         expected_file_name_values = ["wooden-20220717-npgz.json", "bronze-20221024-4dds.json", "bronze-20230102-r904.json", "soft-20211001-cjaz.json", "plastic-20221206-bw3l.json", "soft-20220201-hzz1.json", "cotton-20220527-vn4b.json", "granite-20220125-ifwa.json", "frozen-20221021-bjqs.json", "steel-20210725-fcxq.json"]
         
         # act
@@ -344,10 +532,10 @@ class TestCreateDesignTables:
         # assert - design parquet file exists
         response_list_of_s3_filepaths = s3_client.list_objects_v2(Bucket=hardcoded_variables["processing_bucket_name"])
         actual_s3_file_key_list = [i['Key'] for i in response_list_of_s3_filepaths['Contents']]
-        assert set(actual_s3_file_key_list) == set(return_s3_key(table_name, datetime_string, extension=".parquet") for table_name in [df_dim_design_name])
+        assert set(actual_s3_file_key_list) == set(build_table_key(table_name, datetime_string, extension=".parquet") for table_name in [df_dim_design_name])
         
         # assert - can be read as dataframe (and is saved as parquet)
-        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=return_s3_key(df_dim_design_name, datetime_string, extension=".parquet"))
+        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=build_table_key(df_dim_design_name, datetime_string, extension=".parquet"))
         s3_file = pd.read_parquet(io.BytesIO(obj['Body'].read()))
         
         # assert - df_dim_design type
@@ -367,7 +555,7 @@ class TestCreateLocationTables:
     def test_4a_dim_location_table_is_created_in_correct_position(self, s3_client_ingestion_populated_with_totesys_jsonl, hardcoded_variables):
 
         s3_client, datetime_string = s3_client_ingestion_populated_with_totesys_jsonl
-        inj_file_key = return_s3_key("address", datetime_string)
+        inj_file_key = build_table_key("address", datetime_string)
         df_totesys_address = read_s3_table_json(s3_client, inj_file_key, hardcoded_variables["ingestion_bucket_name"])
         df_dim_location_name = "dim_location"
         hardcode_limit = 10 # this limits the size of the imported sales table so that a human can hardcode the expected values
@@ -408,8 +596,8 @@ class TestCreateCounterpartyTables:
         
         s3_client, datetime_string = s3_client_ingestion_populated_with_totesys_jsonl
         
-        inj_file_key_counterparty   = return_s3_key("counterparty", datetime_string)
-        inj_file_key_address       = return_s3_key("address", datetime_string)
+        inj_file_key_counterparty   = build_table_key("counterparty", datetime_string)
+        inj_file_key_address       = build_table_key("address", datetime_string)
         
         df_totesys_counterparty = read_s3_table_json(s3_client, inj_file_key_counterparty,  hardcoded_variables["ingestion_bucket_name"])
         df_dim_address          = read_s3_table_json(s3_client, inj_file_key_address,       hardcoded_variables["ingestion_bucket_name"])
@@ -458,10 +646,10 @@ class TestCreateCounterpartyTables:
         # assert - design parquet file exists
         response_list_of_s3_filepaths = s3_client.list_objects_v2(Bucket=hardcoded_variables["processing_bucket_name"])
         actual_s3_file_key_list = [i['Key'] for i in response_list_of_s3_filepaths['Contents']]
-        assert set(actual_s3_file_key_list) == set(return_s3_key(table_name, datetime_string, extension=".parquet") for table_name in [df_dim_counterparty_name])
+        assert set(actual_s3_file_key_list) == set(build_table_key(table_name, datetime_string, extension=".parquet") for table_name in [df_dim_counterparty_name])
         
         # assert - can be read as dataframe (and is saved as parquet)
-        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=return_s3_key(df_dim_counterparty_name, datetime_string, extension=".parquet"))
+        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=build_table_key(df_dim_counterparty_name, datetime_string, extension=".parquet"))
         s3_file = pd.read_parquet(io.BytesIO(obj['Body'].read()))
         
         # assert - df_dim_design type
@@ -491,9 +679,9 @@ class TestCreatestaffTables:
     def test_6a_dim_staff_table_is_created_in_correct_position(self, s3_client_ingestion_populated_with_totesys_jsonl, hardcoded_variables):
 
         s3_client, datetime_string = s3_client_ingestion_populated_with_totesys_jsonl
-        inj_file_key_staff = return_s3_key("staff", datetime_string)
+        inj_file_key_staff = build_table_key("staff", datetime_string)
         df_totesys_staff = read_s3_table_json(s3_client, inj_file_key_staff, hardcoded_variables["ingestion_bucket_name"])
-        inj_file_key_department = return_s3_key("department", datetime_string)
+        inj_file_key_department = build_table_key("department", datetime_string)
         df_totesys_department = read_s3_table_json(s3_client, inj_file_key_department, hardcoded_variables["ingestion_bucket_name"])
         df_dim_staff_name = "dim_staff"
         hardcode_limit = 5 # this limits the size of the imported sales table so that a human can hardcode the expected values
@@ -529,10 +717,10 @@ class TestCreatestaffTables:
         # assert - design parquet file exists
         response_list_of_s3_filepaths = s3_client.list_objects_v2(Bucket=hardcoded_variables["processing_bucket_name"])
         actual_s3_file_key_list = [i['Key'] for i in response_list_of_s3_filepaths['Contents']]
-        assert set(actual_s3_file_key_list) == set(return_s3_key(table_name, datetime_string, extension=".parquet") for table_name in [df_dim_staff_name])
+        assert set(actual_s3_file_key_list) == set(build_table_key(table_name, datetime_string, extension=".parquet") for table_name in [df_dim_staff_name])
         
         # assert - can be read as dataframe (and is saved as parquet)
-        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=return_s3_key(df_dim_staff_name, datetime_string, extension=".parquet"))
+        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=build_table_key(df_dim_staff_name, datetime_string, extension=".parquet"))
         s3_file = pd.read_parquet(io.BytesIO(obj['Body'].read()))
         
         # assert - df_dim_design type
@@ -553,7 +741,7 @@ class TestCreatescurrencyTables:
     def test_7a_dim_currency_table_is_created_in_correct_position(self, s3_client_ingestion_populated_with_totesys_jsonl, hardcoded_variables):
 
         s3_client, datetime_string = s3_client_ingestion_populated_with_totesys_jsonl
-        inj_file_key_staff = return_s3_key("currency", datetime_string)
+        inj_file_key_staff = build_table_key("currency", datetime_string)
         df_totesys_currency = read_s3_table_json(s3_client, inj_file_key_staff, hardcoded_variables["ingestion_bucket_name"])
         df_dim_currency_name = "dim_currency"
         
@@ -584,9 +772,9 @@ class TestCreatescurrencyTables:
         response_list_of_s3_filepaths = s3_client.list_objects_v2(Bucket=hardcoded_variables["processing_bucket_name"])
         actual_s3_file_key_list = [i['Key'] for i in response_list_of_s3_filepaths['Contents']]
         
-        assert set(actual_s3_file_key_list) == set(return_s3_key(table_name, datetime_string, extension=".parquet") for table_name in [df_dim_currency_name])
+        assert set(actual_s3_file_key_list) == set(build_table_key(table_name, datetime_string, extension=".parquet") for table_name in [df_dim_currency_name])
         # assert - can be read as dataframe (and is saved as parquet)
-        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=return_s3_key(df_dim_currency_name, datetime_string, extension=".parquet"))
+        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=build_table_key(df_dim_currency_name, datetime_string, extension=".parquet"))
 
         s3_file = pd.read_parquet(io.BytesIO(obj['Body'].read()))
         
@@ -606,7 +794,7 @@ class TestCreatessalesOrderTables:
     def test_8a_fact_sales_order_table_is_created_in_correct_position(self, s3_client_ingestion_populated_with_totesys_jsonl, hardcoded_variables):
 
         s3_client, datetime_string = s3_client_ingestion_populated_with_totesys_jsonl
-        inj_file_key_staff = return_s3_key("sales_order", datetime_string)
+        inj_file_key_staff = build_table_key("sales_order", datetime_string)
         df_totesys_sales_order = read_s3_table_json(s3_client, inj_file_key_staff, hardcoded_variables["ingestion_bucket_name"])
         df_fact_sales_order_name = "fact_sales_order"
         hardcode_limit = 10 # this limits the size of the imported sales table so that a human can hardcode the expected values
@@ -661,12 +849,12 @@ class TestCreatessalesOrderTables:
         # assert - design parquet file exists
         response_list_of_s3_filepaths = s3_client.list_objects_v2(Bucket=hardcoded_variables["processing_bucket_name"])
         actual_s3_file_key_list = [i['Key'] for i in response_list_of_s3_filepaths['Contents']]
-        assert set(actual_s3_file_key_list) == set(return_s3_key(table_name, datetime_string, extension=".parquet") for table_name in [df_fact_sales_order_name])
+        assert set(actual_s3_file_key_list) == set(build_table_key(table_name, datetime_string, extension=".parquet") for table_name in [df_fact_sales_order_name])
         
         # assert - can be read as dataframe (and is saved as parquet)
         import io
 
-        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=return_s3_key(df_fact_sales_order_name, datetime_string, extension=".parquet"))
+        obj = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=build_table_key(df_fact_sales_order_name, datetime_string, extension=".parquet"))
         s3_file = pd.read_parquet(io.BytesIO(obj['Body'].read()))
         
         # assert - df_fact_design type
@@ -699,7 +887,8 @@ class TestLambdaHandler_2:
         
         # assemble
         expected_tables_list = ["fact_sales_order", "dim_date", "dim_staff", "dim_location", "dim_currency", "dim_design", "dim_counterparty"] #taken from sales schema code #https://dbdiagram.io/d/Copy-of-SampleDW-Sales-67cb1e50263d6cf9a09da951
-        expected_file_keys = [return_s3_key(table_name, datetime_string, extension=".parquet") for table_name in expected_tables_list]
+        expected_file_keys = [build_table_key(table_name, datetime_string, extension=".parquet") for table_name in expected_tables_list]
+        expected_file_keys += [build_batch_manifest_key(datetime_string)]  # the processed batch manifest
         event = {"datetime_string":datetime_string, "testing_client":s3_client}
         
         # act
@@ -714,3 +903,278 @@ class TestLambdaHandler_2:
 
 
 
+
+
+class TestLambdaHandlerBatchManifest:
+    def test_9b_reads_keys_from_the_batch_manifest_and_skips_empty_sources(self, s3_client, hardcoded_variables, monkeypatch):
+        """
+        the transform reads each table from the key in the extract batch manifest, skips outputs
+        whose sources had no rows, and writes a manifest of its own processed files for the load
+        """
+        # assemble
+        monkeypatch.setenv("INGESTION_BUCKET", hardcoded_variables["ingestion_bucket_name"])
+        monkeypatch.setenv("PROCESSED_BUCKET", hardcoded_variables["processing_bucket_name"])
+        datetime_string = return_datetime_string()
+        tables = {}
+        for table_name in ["address", "counterparty", "currency", "design", "sales_order", "staff"]:
+            # keys that the default layout would never guess
+            key = f"elsewhere/{table_name}.jsonl"
+            with open(f"data/json_lines_s3_format/{table_name}.jsonl", "rb") as file:
+                s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=file.read())
+            tables[table_name] = {"key": key, "rows": 1, "format": "jsonl", "codec": None}
+        tables["department"] = {"key": None, "rows": 0, "format": "jsonl", "codec": None}
+        write_batch_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], datetime_string, tables)
+        event = {"datetime_string": datetime_string, "testing_client": s3_client}
+        
+        # act
+        response = lambda_handler(event, DummyContext)
+        processed_manifest = read_batch_manifest(s3_client, hardcoded_variables["processing_bucket_name"], datetime_string)
+        
+        # assert
+        assert response["statusCode"] == 200
+        assert response["skipped_outputs"] == ["dim_staff"]
+        assert set(processed_manifest["tables"]) == {"dim_date", "dim_design", "dim_location", "dim_counterparty", "dim_currency", "fact_sales_order"}
+        assert processed_manifest["tables"]["dim_currency"]["rows"] == 3
+        assert processed_manifest["tables"]["dim_currency"]["key"] == build_table_key("dim_currency", datetime_string, extension=".parquet")
+
+    def test_9h_skipped_tables_only_read_the_full_snapshots_they_point_at(self, s3_client, hardcoded_variables, monkeypatch):
+        """
+        a skipped table whose entry points at an earlier delta has no new rows, so the delta is not
+        transformed again; one pointing at an earlier full snapshot is read as the whole table
+        """
+        # assemble
+        monkeypatch.setenv("INGESTION_BUCKET", hardcoded_variables["ingestion_bucket_name"])
+        monkeypatch.setenv("PROCESSED_BUCKET", hardcoded_variables["processing_bucket_name"])
+        datetime_string = return_datetime_string()
+        tables = {}
+        for table_name in ["design", "currency"]:
+            key = f"earlier/{table_name}.jsonl"
+            with open(f"data/json_lines_s3_format/{table_name}.jsonl", "rb") as file:
+                s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=file.read())
+            tables[table_name] = {"key": key, "rows": 1, "format": "jsonl", "codec": None, "skipped": True}
+        tables["currency"]["snapshot"] = True
+        write_batch_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], datetime_string, tables)
+        event = {"datetime_string": datetime_string, "testing_client": s3_client}
+        
+        # act
+        response = lambda_handler(event, DummyContext)
+        processed_manifest = read_batch_manifest(s3_client, hardcoded_variables["processing_bucket_name"], datetime_string)
+        
+        # assert
+        assert response["statusCode"] == 200
+        assert "dim_design" in response["skipped_outputs"]
+        assert set(processed_manifest["tables"]) == {"dim_currency"}
+
+    def test_9i_changed_rows_are_joined_to_the_latest_state_of_their_lookups(self, s3_client, hardcoded_variables, monkeypatch):
+        """
+        a batch changing staff but not departments still builds dim_staff, joining the staff to the
+        departments ingested by an earlier batch
+        """
+        # assemble
+        monkeypatch.setenv("INGESTION_BUCKET", hardcoded_variables["ingestion_bucket_name"])
+        monkeypatch.setenv("PROCESSED_BUCKET", hardcoded_variables["processing_bucket_name"])
+        batches = {"20250101_000000": ["staff", "department"], "20250102_000000": ["staff"]}
+        for datetime_string, table_names in batches.items():
+            tables = {"department": {"key": None, "rows": 0, "format": "jsonl", "codec": None}}
+            for table_name in table_names:
+                key = build_table_key(table_name, datetime_string, extension=".jsonl")
+                with open(f"data/json_lines_s3_format/{table_name}.jsonl", "rb") as file:
+                    s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=file.read())
+                tables[table_name] = {"key": key, "rows": 1, "format": "jsonl", "codec": None}
+            write_batch_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], datetime_string, tables)
+        event = {"datetime_string": "20250102_000000", "testing_client": s3_client}
+        
+        # act
+        response = lambda_handler(event, DummyContext)
+        processed_manifest = read_batch_manifest(s3_client, hardcoded_variables["processing_bucket_name"], "20250102_000000")
+        dim_staff = pd.read_parquet(io.BytesIO(s3_client.get_object(
+            Bucket=hardcoded_variables["processing_bucket_name"], Key=processed_manifest["tables"]["dim_staff"]["key"])["Body"].read()))
+        
+        # assert
+        assert response["statusCode"] == 200
+        assert "dim_staff" not in response["skipped_outputs"]
+        assert len(dim_staff) == processed_manifest["tables"]["dim_staff"]["rows"] > 0
+        assert dim_staff["department_name"].notna().all()
+
+
+class TestLambdaHandlerConcurrentIO:
+    def test_9c_config_reads_event_then_env_and_caps_concurrency(self, monkeypatch):
+        # assemble
+        monkeypatch.setenv("TRANSFORM_READ_CONCURRENCY", "2")
+        monkeypatch.setenv("TRANSFORM_WRITE_CONCURRENCY", "500")
+        
+        # act
+        config = get_transform_config({"read_concurrency": 3})
+        
+        # assert
+        assert config["read_concurrency"] == 3
+        assert config["write_concurrency"] == MAX_IO_CONCURRENCY
+        assert config["read_mode"] == "batch"
+
+    def test_9d_sources_are_read_concurrently_within_the_limit(self, s3_client, hardcoded_variables, monkeypatch, caplog):
+        """
+        every ingestion table is fetched at once (up to read_concurrency), the output is the
+        same as reading them one at a time, and each read and write is logged with its latency
+        """
+        # assemble
+        monkeypatch.setenv("INGESTION_BUCKET", hardcoded_variables["ingestion_bucket_name"])
+        monkeypatch.setenv("PROCESSED_BUCKET", hardcoded_variables["processing_bucket_name"])
+        datetime_string = return_datetime_string()
+        tables = {}
+        for table_name in ["address", "counterparty", "currency", "department", "design", "sales_order", "staff"]:
+            key = build_table_key(table_name, datetime_string, extension=".jsonl")
+            with open(f"data/json_lines_s3_format/{table_name}.jsonl", "rb") as file:
+                s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=file.read())
+            tables[table_name] = {"key": key, "rows": 1, "format": "jsonl", "codec": None}
+        write_batch_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], datetime_string, tables)
+        active, peaks = [], []
+        
+        def slow_read(*args):
+            active.append(1)
+            peaks.append(len(active))
+            time.sleep(0.1)
+            active.pop()
+            return read_manifest_entry(*args)
+        
+        monkeypatch.setattr("src.lambda_transform.read_manifest_entry", slow_read)
+        event = {"datetime_string": datetime_string, "testing_client": s3_client}
+        
+        # act
+        with caplog.at_level(logging.INFO, logger="src.lambda_transform"):
+            response = lambda_handler({**event, "read_concurrency": 3}, DummyContext)
+        concurrent_manifest = read_batch_manifest(s3_client, hardcoded_variables["processing_bucket_name"], datetime_string)
+        concurrent_dim_staff = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"],
+                                                    Key=build_table_key("dim_staff", datetime_string, extension=".parquet"))["Body"].read()
+        peak_concurrent = max(peaks)
+        peaks.clear()
+        lambda_handler({**event, "read_concurrency": 1, "write_concurrency": 1}, DummyContext)
+        serial_manifest = read_batch_manifest(s3_client, hardcoded_variables["processing_bucket_name"], datetime_string)
+        serial_dim_staff = s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"],
+                                                Key=build_table_key("dim_staff", datetime_string, extension=".parquet"))["Body"].read()
+        
+        # assert
+        assert response["statusCode"] == 200
+        assert 1 < peak_concurrent <= 3
+        assert max(peaks) == 1
+        assert list(concurrent_manifest["tables"]) == list(serial_manifest["tables"])
+        assert len(concurrent_manifest["tables"]) == 7
+        assert concurrent_dim_staff == serial_dim_staff
+        messages = [record.getMessage() for record in caplog.records]
+        assert any(message.startswith("read of sales_order took ") for message in messages)
+        assert any(message.startswith("write of fact_sales_order took ") for message in messages)
+
+
+class TestLambdaHandlerMemoisation:
+    def test_9e_unchanged_inputs_reuse_the_processed_objects(self, s3_client, hardcoded_variables, monkeypatch):
+        """
+        a batch whose source objects have the same checksums as the last run reuses that run's
+        processed objects instead of reading and rebuilding, and only outputs of changed sources rebuild
+        """
+        # assemble
+        monkeypatch.setenv("INGESTION_BUCKET", hardcoded_variables["ingestion_bucket_name"])
+        monkeypatch.setenv("PROCESSED_BUCKET", hardcoded_variables["processing_bucket_name"])
+        tables = {}
+        for table_name in ["address", "counterparty", "currency", "department", "design", "sales_order", "staff"]:
+            key = build_table_key(table_name, "20250101_000000", extension=".jsonl")
+            with open(f"data/json_lines_s3_format/{table_name}.jsonl", "rb") as file:
+                response = s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=file.read())
+            tables[table_name] = {"key": key, "rows": 1, "format": "jsonl", "codec": None, "checksum": response["ETag"].strip('"')}
+        batches = ["20250101_000000", "20250101_000200", "20250101_000400"]
+        write_batch_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], batches[0], tables)
+        write_batch_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], batches[1], tables)
+        # the design table changes in the third batch
+        design_key = build_table_key("design", batches[2], extension=".jsonl")
+        response = s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=design_key, Body=b'{"design_id": 1, "design_name": "Steel", "file_location": "/usr", "file_name": "steel.json"}\n')
+        changed = {**tables, "design": {**tables["design"], "key": design_key, "checksum": response["ETag"].strip('"')}}
+        write_batch_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], batches[2], changed)
+        reads = []
+        
+        def counted_read(s3_client, entry, bucket_name):
+            reads.append(entry["key"])
+            return read_manifest_entry(s3_client, entry, bucket_name)
+        
+        monkeypatch.setattr("src.lambda_transform.read_manifest_entry", counted_read)
+        
+        # act
+        responses = []
+        for batch in batches:
+            reads.clear()
+            responses.append((lambda_handler({"datetime_string": batch, "testing_client": s3_client}, DummyContext), list(reads)))
+        manifests = [read_batch_manifest(s3_client, hardcoded_variables["processing_bucket_name"], batch) for batch in batches]
+        
+        # assert - first run builds everything
+        assert responses[0][0]["cache_hits"] == []
+        assert len(responses[0][0]["cache_misses"]) == 7
+        # assert - second run reads and builds nothing, pointing at the first run's objects
+        assert responses[1][0]["statusCode"] == 200
+        assert len(responses[1][0]["cache_hits"]) == 7
+        assert responses[1][0]["cache_misses"] == []
+        assert responses[1][1] == []
+        assert manifests[1]["tables"]["dim_design"]["key"] == manifests[0]["tables"]["dim_design"]["key"]
+        assert manifests[1]["tables"]["dim_design"]["cached"] is True
+        # assert - third run only rebuilds the design dimension
+        assert responses[2][0]["cache_misses"] == ["dim_design"]
+        assert responses[2][1] == [design_key]
+        assert manifests[2]["tables"]["dim_design"]["key"] == build_table_key("dim_design", batches[2], extension=".parquet")
+        assert manifests[2]["tables"]["dim_design"]["rows"] == 1
+
+    def test_9f_memoisation_can_be_switched_off(self, s3_client, hardcoded_variables, monkeypatch):
+        # assemble
+        monkeypatch.setenv("INGESTION_BUCKET", hardcoded_variables["ingestion_bucket_name"])
+        monkeypatch.setenv("PROCESSED_BUCKET", hardcoded_variables["processing_bucket_name"])
+        monkeypatch.setenv("TRANSFORM_MEMOISE", "false")
+        key = build_table_key("currency", "20250101_000000", extension=".jsonl")
+        with open("data/json_lines_s3_format/currency.jsonl", "rb") as file:
+            response = s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=file.read())
+        tables = {"currency": {"key": key, "rows": 3, "format": "jsonl", "codec": None, "checksum": response["ETag"].strip('"')}}
+        for batch in ["20250101_000000", "20250101_000200"]:
+            write_batch_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], batch, tables)
+        
+        # act
+        first = lambda_handler({"datetime_string": "20250101_000000", "testing_client": s3_client}, DummyContext)
+        second = lambda_handler({"datetime_string": "20250101_000200", "testing_client": s3_client}, DummyContext)
+        
+        # assert
+        assert first["cache_misses"] == second["cache_misses"] == []
+        assert second["cache_hits"] == []
+        assert len(second["responses_list"]) == 1
+
+
+class TestLambdaHandlerArrowEngine:
+    def test_9g_arrow_engine_writes_the_same_processed_files(self, s3_client, hardcoded_variables, monkeypatch):
+        """
+        the arrow engine, selected by configuration, writes every processed table with the pandas
+        engine's parquet schema and data
+        """
+        # assemble
+        monkeypatch.setenv("INGESTION_BUCKET", hardcoded_variables["ingestion_bucket_name"])
+        monkeypatch.setenv("PROCESSED_BUCKET", hardcoded_variables["processing_bucket_name"])
+        batches = {"pandas": "20250101_000000", "arrow": "20250101_000200"}
+        for batch in batches.values():
+            tables = {}
+            for table_name in ["address", "counterparty", "currency", "department", "design", "sales_order", "staff"]:
+                key = build_table_key(table_name, batch, extension=".jsonl")
+                with open(f"data/json_lines_s3_format/{table_name}.jsonl", "rb") as file:
+                    s3_client.put_object(Bucket=hardcoded_variables["ingestion_bucket_name"], Key=key, Body=file.read())
+                tables[table_name] = {"key": key, "rows": 1, "format": "jsonl", "codec": None}
+            write_batch_manifest(s3_client, hardcoded_variables["ingestion_bucket_name"], batch, tables)
+        monkeypatch.setenv("TRANSFORM_ENGINE", "arrow")
+        
+        # act
+        responses = {engine: lambda_handler({"datetime_string": batch, "testing_client": s3_client, "engine": engine}, DummyContext)
+                     for engine, batch in batches.items()}
+        arrow_by_env = lambda_handler({"datetime_string": batches["arrow"], "testing_client": s3_client}, DummyContext)
+        unknown = lambda_handler({"datetime_string": batches["arrow"], "testing_client": s3_client, "engine": "spark"}, DummyContext)
+        manifests = {engine: read_batch_manifest(s3_client, hardcoded_variables["processing_bucket_name"], batch)
+                     for engine, batch in batches.items()}
+        
+        # assert
+        assert responses["pandas"]["statusCode"] == responses["arrow"]["statusCode"] == arrow_by_env["statusCode"] == 200
+        assert list(manifests["arrow"]["tables"]) == list(manifests["pandas"]["tables"])
+        for table_name, entry in manifests["pandas"]["tables"].items():
+            files = [s3_client.get_object(Bucket=hardcoded_variables["processing_bucket_name"], Key=manifest["tables"][table_name]["key"])["Body"].read()
+                     for manifest in [manifests["pandas"], manifests["arrow"]]]
+            pandas_table, arrow_table = [pq.read_table(io.BytesIO(file)) for file in files]
+            assert arrow_table.equals(pandas_table, check_metadata=True)
+            assert manifests["arrow"]["tables"][table_name]["rows"] == entry["rows"]
+        assert unknown == "Unknown transform engine: spark"
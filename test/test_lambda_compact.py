@@ -0,0 +1,170 @@
+import io
+import json
+import boto3
+import pytest
+import pandas as pd
+from unittest.mock import patch
+from moto import mock_aws
+from src.utils import write_batch_manifest
+from src.s3_keys import build_table_key, build_snapshot_manifest_key, list_batches
+from src.lambda_compact import lambda_handler
+from src.lambda_compact_utils import (
+    compact_table,
+    merge_latest,
+    read_table_state,
+    read_snapshot_manifest,
+)
+
+BUCKET_NAME = "test-ingestion-bucket"
+
+
+@pytest.fixture(scope="function", autouse=True)
+def aws_credentials(monkeypatch):
+    """Mocked AWS Credentials for moto."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    monkeypatch.setenv("INGESTION_BUCKET", BUCKET_NAME)
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="eu-west-2")
+        s3.create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        yield s3
+
+
+def staff_row(staff_id, name, last_updated):
+    return {"staff_id": staff_id, "first_name": name, "last_updated": last_updated}
+
+
+def put_batch(s3, datetime_string, tables):
+    """Writes each table's rows as a JSON Lines object and lists them in the batch manifest."""
+    entries = {}
+    for table_name, rows in tables.items():
+        if rows == "skipped":
+            entries[table_name] = {"key": "table=x/old.jsonl", "rows": 9, "format": "jsonl", "skipped": True}
+            continue
+        key = build_table_key(table_name, datetime_string, ".jsonl") if rows else None
+        if rows:
+            body = "\n".join(json.dumps(row) for row in rows)
+            s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=body.encode())
+        entries[table_name] = {"key": key, "rows": len(rows), "format": "jsonl", "codec": None}
+    write_batch_manifest(s3, BUCKET_NAME, datetime_string, entries)
+
+
+@pytest.fixture
+def three_batches(s3):
+    put_batch(s3, "20250101_000000", {"staff": [staff_row(1, "Ann", "2025-01-01T00:00:00.000"),
+                                                staff_row(2, "Bob", "2025-01-01T00:00:00.000")]})
+    put_batch(s3, "20250102_000000", {"staff": [staff_row(2, "Bobby", "2025-01-02T00:00:00.000")]})
+    put_batch(s3, "20250103_000000", {"staff": [staff_row(3, "Cat", "2025-01-03T00:00:00.000")]})
+    return s3
+
+
+class TestMergeLatest:
+    @pytest.mark.it("Keeps the row with the latest last_updated for each key")
+    def test_last_write_wins(self):
+        older = pd.DataFrame([staff_row(1, "new", "2025-01-05T00:00:00.000"), staff_row(2, "Bob", "2025-01-01T00:00:00.000")])
+        newer = pd.DataFrame([staff_row(1, "stale", "2025-01-02T00:00:00.000")])
+
+        df = merge_latest([older, newer], "staff_id")
+
+        assert df["first_name"].tolist() == ["new", "Bob"]
+
+    @pytest.mark.it("Prefers the later batch when last_updated ties, across JSON and Parquet types")
+    def test_tie_and_mixed_types(self):
+        snapshot = pd.DataFrame([staff_row(1, "first", pd.Timestamp("2025-01-01"))])
+        delta = pd.DataFrame([staff_row(1, "second", "2025-01-01T00:00:00.000")])
+
+        df = merge_latest([snapshot, delta], "staff_id")
+
+        assert df["first_name"].tolist() == ["second"]
+        assert df["last_updated"].tolist() == [pd.Timestamp("2025-01-01")]
+
+
+class TestCompactTable:
+    @pytest.mark.it("Merges every batch into a deduplicated Parquet snapshot and records them")
+    def test_first_compaction(self, three_batches):
+        manifest = compact_table(three_batches, BUCKET_NAME, "staff")
+
+        assert manifest["merged_batches"] == ["20250101_000000", "20250102_000000", "20250103_000000"]
+        assert manifest["through_batch"] == "20250103_000000"
+        assert manifest["primary_key"] == "staff_id"
+        assert manifest["rows"] == 3
+        assert manifest["previous_snapshot"] is None
+        assert read_snapshot_manifest(three_batches, BUCKET_NAME, "staff") == manifest
+        body = three_batches.get_object(Bucket=BUCKET_NAME, Key=manifest["key"])["Body"].read()
+        df = pd.read_parquet(io.BytesIO(body))
+        assert df["first_name"].tolist() == ["Ann", "Bobby", "Cat"]
+
+    @pytest.mark.it("Only merges the batches written since the last snapshot")
+    def test_incremental_compaction(self, three_batches):
+        first = compact_table(three_batches, BUCKET_NAME, "staff", through="20250102_000000")
+
+        second = compact_table(three_batches, BUCKET_NAME, "staff")
+
+        assert first["merged_batches"] == ["20250101_000000", "20250102_000000"]
+        assert second["merged_batches"] == ["20250103_000000"]
+        assert second["previous_snapshot"] == first["key"]
+        assert second["rows"] == 3
+        assert compact_table(three_batches, BUCKET_NAME, "staff") is None
+
+    @pytest.mark.it("Lists only the batch manifests after the last snapshot")
+    def test_lists_after_snapshot(self, three_batches):
+        compact_table(three_batches, BUCKET_NAME, "staff", through="20250102_000000")
+
+        with patch("src.lambda_compact_utils.list_batches", wraps=list_batches) as mock_list_batches:
+            manifest = compact_table(three_batches, BUCKET_NAME, "staff")
+
+        mock_list_batches.assert_called_once_with(three_batches, BUCKET_NAME, "20250102_000000")
+        assert manifest["merged_batches"] == ["20250103_000000"]
+
+    @pytest.mark.it("Ignores skipped and empty entries and waits for min_batches")
+    def test_skipped_entries(self, three_batches):
+        put_batch(three_batches, "20250104_000000", {"staff": "skipped"})
+        put_batch(three_batches, "20250105_000000", {"staff": []})
+
+        assert compact_table(three_batches, BUCKET_NAME, "staff", min_batches=4) is None
+        manifest = compact_table(three_batches, BUCKET_NAME, "staff")
+
+        assert manifest["merged_batches"] == ["20250101_000000", "20250102_000000", "20250103_000000"]
+
+
+class TestReadTableState:
+    @pytest.mark.it("Reads the snapshot plus the tail batches up to the requested batch")
+    def test_snapshot_and_tail(self, three_batches):
+        compact_table(three_batches, BUCKET_NAME, "staff", through="20250102_000000")
+        put_batch(three_batches, "20250104_000000", {"staff": [staff_row(1, "Annie", "2025-01-04T00:00:00.000")]})
+
+        latest = read_table_state(three_batches, BUCKET_NAME, "staff")
+        as_of_third = read_table_state(three_batches, BUCKET_NAME, "staff", through="20250103_000000")
+        as_of_first = read_table_state(three_batches, BUCKET_NAME, "staff", through="20250101_000000")
+
+        assert latest["first_name"].tolist() == ["Annie", "Bobby", "Cat"]
+        assert as_of_third["first_name"].tolist() == ["Ann", "Bobby", "Cat"]
+        assert as_of_first["first_name"].tolist() == ["Ann", "Bob"]
+
+    @pytest.mark.it("Returns None for a table with no rows anywhere")
+    def test_no_rows(self, three_batches):
+        assert read_table_state(three_batches, BUCKET_NAME, "currency") is None
+
+
+class TestLambdaHandler:
+    @pytest.mark.it("Compacts every table of the latest batch and reports the rest as unchanged")
+    def test_handler(self, three_batches):
+        put_batch(three_batches, "20250104_000000", {"staff": [], "currency": [{"currency_id": 1, "last_updated": "2025-01-04T00:00:00.000"}]})
+
+        response = lambda_handler({}, None)
+
+        assert response["statusCode"] == 200
+        assert response["through"] == "20250104_000000"
+        assert set(response["compacted"]) == {"staff", "currency"}
+        assert response["compacted"]["staff"]["rows"] == 3
+        assert response["unchanged"] == []
+        three_batches.head_object(Bucket=BUCKET_NAME, Key=build_snapshot_manifest_key("currency"))
+
+        again = lambda_handler({}, None)
+        assert again["compacted"] == {}
+        assert again["unchanged"] == ["staff", "currency"]
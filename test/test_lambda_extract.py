@@ -1,18 +1,26 @@
 import os
 import json
+import queue
+import time
 import botocore.exceptions
 import pytest
 import boto3
 from moto import mock_aws
 from dotenv import load_dotenv
 import pg8000.native
+from pg8000.exceptions import DatabaseError
 import botocore
 from botocore.exceptions import ClientError
 from datetime import datetime, date
-from unittest.mock import MagicMock, Mock, patch
+from unittest.mock import ANY, MagicMock, Mock, patch
 from src.lambda_extract import (
+    find_unchanged_tables,
+    get_extract_config,
     lambda_handler,
+    plan_key_ranges,
 )
+from src.query_throttle import QueryThrottle
+from src.utils import drop_cached_conn
 
 
 @pytest.fixture(scope="function", autouse=True)
@@ -34,6 +42,46 @@ def mock_conn():
     return mock_conn
 
 
+CATALOG = {
+    "address": [("id", "integer"), ("last_updated", "timestamp without time zone")],
+    "staff": [("id", "integer"), ("last_updated", "timestamp without time zone")],
+}
+
+
+@pytest.fixture(autouse=True)
+def mock_schema_catalog():
+    """the schema catalog is cached at module level, so it is mocked for every handler test"""
+    with patch("src.lambda_extract.get_schema_catalog") as mock_get_schema_catalog:
+        mock_get_schema_catalog.return_value = CATALOG
+        yield mock_get_schema_catalog
+
+
+@pytest.fixture(autouse=True)
+def clear_connection_cache():
+    """secrets and connections are cached at module level across invocations"""
+    drop_cached_conn()
+    yield
+    drop_cached_conn()
+
+
+@pytest.fixture(autouse=True)
+def mock_describe_s3_objects():
+    """the manifest's byte sizes and checksums come from S3 head requests"""
+    with patch(
+        "src.lambda_extract.describe_s3_objects", return_value={"bytes": 10, "checksum": "abc"}
+    ) as mock_describe:
+        yield mock_describe
+
+
+@pytest.fixture(autouse=True)
+def mock_fingerprints():
+    """table fingerprints are read from the database and S3, so they are mocked for every handler test"""
+    with patch("src.lambda_extract.get_table_fingerprints", return_value={}) as mock_get_table_fingerprints, patch(
+        "src.lambda_extract.get_fingerprints", return_value={}
+    ) as mock_get_fingerprints, patch("src.lambda_extract.put_fingerprints") as mock_put_fingerprints:
+        yield mock_get_table_fingerprints, mock_get_fingerprints, mock_put_fingerprints
+
+
 @pytest.fixture
 def rows_columns():
     """fixture to mock the output of get_rows_and_columns_from_tables in the handler for loop.
@@ -68,11 +116,19 @@ def s3_keys():
 @patch("src.lambda_extract.create_conn")
 @patch("src.lambda_extract.get_rows_and_columns_from_table")
 @patch("src.lambda_extract.write_table_to_s3")
-@patch("src.lambda_extract.log_file")
-@patch("src.lambda_extract.close_db")
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.drop_cached_conn")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+@patch("src.lambda_extract.get_peak_memory_mb", return_value=123.4)
+@patch("src.lambda_extract.reset_peak_memory", return_value=True)
 def test_lambda_handler(
-    mock_close_db,
-    mock_log_file,
+    mock_reset_peak_memory,
+    mock_get_peak_memory_mb,
+    mock_put_watermarks,
+    mock_get_watermarks,
+    mock_drop_cached_conn,
+    mock_write_batch_manifest,
     mock_write_table_to_s3,
     mock_get_rows_columns,
     mock_create_conn,
@@ -102,10 +158,26 @@ def test_lambda_handler(
 
         result = lambda_handler(event, context)
     # ASSERT:
-    assert result == {"message": "Batch extraction job completed"}
+    assert result == {
+        "message": "Batch extraction job completed",
+        "statusCode": 200,
+        "datetime_string": "20250723_000000",
+        "manifest_key": mock_write_batch_manifest.return_value,
+        "output_format": "json",
+        "codec": None,
+        "peak_memory_mb": 123.4,
+        "peak_memory_scope": "invocation",
+        "partitioned_tables": [],
+        "skipped_tables": {},
+        "failed_tables": {},
+    }
     mock_create_conn.assert_called_once_with({"dbname": "test_db", "user": "test_user"})
-    mock_get_rows_columns.assert_any_call(mock_conn, "address")
-    mock_get_rows_columns.assert_any_call(mock_conn, "staff")
+    mock_get_rows_columns.assert_any_call(
+        mock_conn, "address", since=None, columns=["id", "last_updated"]
+    )
+    mock_get_rows_columns.assert_any_call(
+        mock_conn, "staff", since=None, columns=["id", "last_updated"]
+    )
     mock_write_table_to_s3.assert_any_call(
         mock_s3_client,
         mock_bucket_name,
@@ -113,6 +185,8 @@ def test_lambda_handler(
         [[1, "123 Northcode Road", "Leeds"], [2, "66 Fenor Drive", "Manchester"]],
         ["address_ID", "address", "city"],
         "20250723_000000",
+        codec=None,
+        column_types=CATALOG["address"],
     )
     mock_write_table_to_s3.assert_any_call(
         mock_s3_client,
@@ -124,21 +198,30 @@ def test_lambda_handler(
         ],
         ["staff_ID", "first_name", "last_name", "email"],
         "20250723_000000",
+        codec=None,
+        column_types=CATALOG["staff"],
     )
-    mock_log_file.assert_called_once_with(
-        mock_s3_client,
-        mock_bucket_name,
-        [
-            "data/2025/03/28_11-15-28/address.json",
-            "data/2025/03/28_11-15-31/staff.json",
-        ],
-    )
-    mock_close_db.assert_called_once_with(mock_conn)
-    captured = capsys.readouterr()
-    assert (
-        captured.out
-        == f"Log: Batch extraction completed - {test_date.strftime('%Y-%m-%d_%H-%M-%S')}\n"
-    )
+    _, _, manifest_datetime_string, manifest_tables = mock_write_batch_manifest.call_args.args
+    assert manifest_datetime_string == "20250723_000000"
+    assert {table: entry["key"] for table, entry in manifest_tables.items()} == {
+        "address": "data/2025/03/28_11-15-28/address.json",
+        "staff": "data/2025/03/28_11-15-31/staff.json",
+    }
+    assert manifest_tables["address"]["rows"] == 2
+    assert manifest_tables["address"]["format"] == "json"
+    assert mock_write_batch_manifest.call_args.kwargs == {"failed_tables": {}}
+    # the connection is kept open for the next warm invocation
+    mock_drop_cached_conn.assert_not_called()
+    mock_conn.close.assert_not_called()
+    # every query is timed, then the batch completion is logged
+    log_lines = capsys.readouterr().out.splitlines()
+    assert [line.split(" took ")[0] for line in log_lines[:-1]] == [
+        "Log: schema catalog on public schema",
+        "Log: fingerprints on all tables",
+        "Log: select on address",
+        "Log: select on staff",
+    ]
+    assert log_lines[-1] == f"Log: Batch extraction completed - {test_date.strftime('%Y-%m-%d_%H-%M-%S')}"
 
 
 @patch("src.lambda_extract.get_rows_and_columns_from_table")
@@ -155,3 +238,932 @@ def test_for_put_s3_error(
     result = lambda_handler(event, context)
     # ASSERT
     assert "Batch extraction job failed" in result["message"]
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.get_rows_and_columns_from_table")
+@patch("src.lambda_extract.write_table_to_s3")
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.drop_cached_conn")
+@patch("src.lambda_extract.get_watermarks")
+@patch("src.lambda_extract.put_watermarks")
+class TestWatermarks:
+    @pytest.mark.it("Queries each table from its stored watermark and advances it when incremental")
+    def test_handler_uses_and_advances_watermarks(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_drop_cached_conn,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        mock_create_conn.return_value = mock_conn
+        mock_get_watermarks.return_value = {
+            "address": "2025-01-01T00:00:00",
+            "staff": "2025-01-01T00:00:00",
+        }
+        mock_get_rows_columns.side_effect = [
+            ([[1, datetime(2025, 2, 1, 9, 30)]], ["address_id", "last_updated"]),
+            ([], ["staff_id", "last_updated"]),
+        ]
+        mock_write_table_to_s3.side_effect = ["data/x/address.json", None]
+
+        lambda_handler({"full_snapshot": False}, None)
+
+        mock_get_rows_columns.assert_any_call(
+            mock_conn, "address", since="2025-01-01T00:00:00", columns=["id", "last_updated"]
+        )
+        mock_get_rows_columns.assert_any_call(
+            mock_conn, "staff", since="2025-01-01T00:00:00", columns=["id", "last_updated"]
+        )
+        mock_put_watermarks.assert_called_once_with(
+            mock_s3_client,
+            "test_bucket",
+            {"address": "2025-02-01T09:30:00", "staff": "2025-01-01T00:00:00"},
+        )
+
+    @pytest.mark.it("Queries every row by default, keeping the stored watermarks of failed tables")
+    def test_handler_full_snapshot(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_drop_cached_conn,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        mock_create_conn.return_value = mock_conn
+        mock_get_watermarks.return_value = {
+            "address": "2025-01-01T00:00:00",
+            "staff": "2025-01-01T00:00:00",
+        }
+
+        def get_rows(conn, table, since=None, columns=None):
+            if table == "staff":
+                raise DatabaseError("Boom")
+            return [[1, datetime(2025, 2, 1, 9, 30)]], ["id", "last_updated"]
+
+        mock_get_rows_columns.side_effect = get_rows
+        mock_write_table_to_s3.return_value = "data/x/address.json"
+
+        lambda_handler({}, None)
+
+        mock_get_rows_columns.assert_any_call(
+            mock_conn, "address", since=None, columns=["id", "last_updated"]
+        )
+        mock_get_rows_columns.assert_any_call(
+            mock_conn, "staff", since=None, columns=["id", "last_updated"]
+        )
+        # the failed table keeps the watermark stored for it
+        mock_put_watermarks.assert_called_once_with(
+            mock_s3_client,
+            "test_bucket",
+            {"address": "2025-02-01T09:30:00", "staff": "2025-01-01T00:00:00"},
+        )
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.stream_rows_from_table")
+@patch("src.lambda_extract.write_batches_to_s3")
+@patch("src.lambda_extract.get_rows_and_columns_from_table")
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestStreamingExtraction:
+    @pytest.mark.it("Streams each table in batches through the incremental writer")
+    def test_handler_stream_mode(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_get_rows_columns,
+        mock_write_batches_to_s3,
+        mock_stream_rows,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        mock_create_conn.return_value = mock_conn
+
+        def consume(s3_client, bucket, table, batches, columns, date_and_time, codec=None, part=None, column_types=None):
+            for _ in batches:
+                pass
+            return f"data/{date_and_time}/{table}.json"
+
+        mock_stream_rows.return_value = iter([[[1, datetime(2025, 2, 1)]]])
+        mock_write_batches_to_s3.side_effect = consume
+
+        result = lambda_handler({"stream": True, "batch_size": 250}, None)
+
+        mock_get_rows_columns.assert_not_called()
+        mock_stream_rows.assert_any_call(
+            mock_conn, "address", ["id", "last_updated"], 250, since=None, key_range=None, throttle=ANY
+        )
+        assert mock_write_batches_to_s3.call_count == 2
+        assert result["statusCode"] == 200
+        assert result["peak_memory_mb"] > 0
+        assert result["peak_memory_scope"] in ("invocation", "process")
+        mock_put_watermarks.assert_called_once_with(
+            mock_s3_client, "test_bucket", {"address": "2025-02-01T00:00:00"}
+        )
+
+    @pytest.mark.it("Uses COPY TO STDOUT batches when copy mode is enabled")
+    @patch("src.lambda_extract.copy_rows_from_table")
+    def test_handler_copy_mode(
+        self,
+        mock_copy_rows,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_get_rows_columns,
+        mock_write_batches_to_s3,
+        mock_stream_rows,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        mock_create_conn.return_value = mock_conn
+        mock_copy_rows.return_value = []
+        mock_write_batches_to_s3.return_value = None
+
+        result = lambda_handler({"copy": True, "batch_size": 250}, None)
+
+        mock_get_rows_columns.assert_not_called()
+        mock_stream_rows.assert_not_called()
+        mock_copy_rows.assert_any_call(
+            mock_conn, "address", CATALOG["address"], 250, since=None, key_range=None, throttle=ANY
+        )
+        assert mock_write_batches_to_s3.call_count == 2
+        assert result["statusCode"] == 200
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.create_conn_pool")
+@patch("src.lambda_extract.get_rows_and_columns_from_table")
+@patch("src.lambda_extract.write_table_to_s3")
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestParallelExtraction:
+    @pytest.mark.it("Extracts tables concurrently and reports failures per table")
+    def test_handler_parallel_mode_isolates_failures(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn_pool,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        pool = queue.Queue()
+        pool.put(MagicMock())
+        mock_create_conn.return_value = mock_conn
+        mock_create_conn_pool.return_value = pool
+
+        def get_rows(conn, table, since=None, columns=None):
+            if table == "staff":
+                raise Exception("relation staff is locked")
+            return [[1, "Leeds"]], ["address_id", "city"]
+
+        mock_get_rows_columns.side_effect = get_rows
+        mock_write_table_to_s3.return_value = "data/x/address.json"
+
+        result = lambda_handler({"parallel": True, "pool_size": 10}, None)
+
+        # pool_size is capped and the handler's own connection joins the pool
+        mock_create_conn_pool.assert_called_once_with(
+            mock_get_secret.return_value, 3, connect=mock_create_conn, cache_name="extract"
+        )
+        assert result["statusCode"] == 200
+        assert result["failed_tables"] == {"staff": "relation staff is locked"}
+        manifest_tables = mock_write_batch_manifest.call_args.args[3]
+        assert list(manifest_tables) == ["address"]
+        assert manifest_tables["address"]["key"] == "data/x/address.json"
+        assert mock_write_batch_manifest.call_args.kwargs == {
+            "failed_tables": {"staff": "relation staff is locked"}
+        }
+        # connections go back to the pool and stay open for the next run
+        assert pool.qsize() == 2
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.create_conn_pool")
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestFailedExtracts:
+    @staticmethod
+    def run_query(query, **params):
+        if query.startswith("SELECT * FROM staff"):
+            raise DatabaseError({"C": "57014", "M": "canceling statement due to statement timeout"})
+        if query.startswith("SELECT"):
+            return [[1, datetime(2025, 1, 1)]]
+        return []
+
+    @pytest.mark.it("Reports a table whose query fails as failed, not as empty")
+    def test_handler_reports_failed_queries(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_create_conn_pool,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        mock_conn.run.side_effect = self.run_query
+        pool_conn = MagicMock()
+        pool_conn.run.side_effect = self.run_query
+        pool = queue.Queue()
+        pool.put(pool_conn)
+        mock_create_conn.return_value = mock_conn
+        mock_create_conn_pool.return_value = pool
+
+        result = lambda_handler({"parallel": True}, None)
+
+        assert list(result["failed_tables"]) == ["staff"]
+        assert result["failed_tables"]["staff"].startswith(
+            "Cancelled by the statement timeout, retried on the next run"
+        )
+        manifest_tables = mock_write_batch_manifest.call_args.args[3]
+        assert list(manifest_tables) == ["address"]
+        assert mock_put_watermarks.call_args.args[2] == {"address": "2025-01-01T00:00:00"}
+
+    @pytest.mark.it("Reports a table whose upload fails, or that has rows but no key, as failed")
+    @pytest.mark.parametrize("upload", ["raises", "returns no key"])
+    def test_handler_reports_failed_uploads(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_create_conn_pool,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        upload,
+        mock_conn,
+    ):
+        mock_conn.run.side_effect = lambda query, **params: (
+            [[1, datetime(2025, 1, 1)]] if query.startswith("SELECT") else []
+        )
+        mock_create_conn.return_value = mock_conn
+        mock_s3_client.put_object.side_effect = ClientError(
+            {"Error": {"Code": "SlowDown", "Message": "Slow Down"}}, "PutObject"
+        )
+
+        if upload == "raises":
+            result = lambda_handler({}, None)
+        else:
+            with patch("src.lambda_extract.write_table_to_s3", return_value=None):
+                result = lambda_handler({}, None)
+
+        assert set(result["failed_tables"]) == {"address", "staff"}
+        assert mock_write_batch_manifest.call_args.args[3] == {}
+        assert mock_put_watermarks.call_args.args[2] == {}
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.get_rows_and_columns_from_table")
+@patch("src.lambda_extract.write_batches_to_s3_parquet")
+@patch("src.lambda_extract.write_table_to_s3")
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestParquetExtraction:
+    @pytest.mark.it("Writes typed Parquet when the parquet output format is chosen")
+    def test_handler_parquet_mode(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_write_parquet,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        mock_create_conn.return_value = mock_conn
+        column_types = CATALOG["address"]
+        mock_get_rows_columns.return_value = ([[1, datetime(2025, 2, 1)]], ["id", "last_updated"])
+
+        def consume(s3_client, bucket, table, batches, column_types, date_and_time, codec=None, part=None):
+            for _ in batches:
+                pass
+            return f"data/{date_and_time}/{table}.parquet"
+
+        mock_write_parquet.side_effect = consume
+
+        result = lambda_handler({"output_format": "parquet"}, None)
+
+        mock_write_table_to_s3.assert_not_called()
+        assert mock_write_parquet.call_count == 2
+        assert mock_write_parquet.call_args.args[4] == column_types
+        assert result["output_format"] == "parquet"
+        mock_put_watermarks.assert_called_once_with(
+            mock_s3_client,
+            "test_bucket",
+            {"address": "2025-02-01T00:00:00", "staff": "2025-02-01T00:00:00"},
+        )
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.get_rows_and_columns_from_table", return_value=([], []))
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestSchemaCatalog:
+    @pytest.mark.it("Takes the table list and columns from the schema catalog")
+    def test_handler_uses_schema_catalog(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+        mock_schema_catalog,
+    ):
+        mock_create_conn.return_value = mock_conn
+
+        lambda_handler({"schema_ttl": 60}, None)
+
+        mock_schema_catalog.assert_called_once_with(mock_conn, ttl=60)
+        # no per-table catalog queries or table list query are issued
+        mock_conn.run.assert_not_called()
+        assert [c.args[1] for c in mock_get_rows_columns.call_args_list] == [
+            "address",
+            "staff",
+        ]
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.create_conn_pool")
+@patch("src.lambda_extract.get_key_ranges")
+@patch("src.lambda_extract.get_rows_and_columns_from_table")
+@patch("src.lambda_extract.write_batches_to_s3")
+@patch("src.lambda_extract.write_table_to_s3")
+@patch("src.lambda_extract.write_table_manifest")
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestPartitionedExtraction:
+    catalog = {
+        "sales_order": [
+            ("sales_order_id", "integer"),
+            ("last_updated", "timestamp without time zone"),
+        ],
+        "currency": [("currency_id", "integer"), ("last_updated", "timestamp without time zone")],
+    }
+
+    @pytest.mark.it("Extracts key range chunks of large tables as parts listed in a manifest")
+    def test_handler_partitions_large_tables(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_manifest,
+        mock_write_table_to_s3,
+        mock_write_batches_to_s3,
+        mock_get_rows_columns,
+        mock_get_key_ranges,
+        mock_create_conn_pool,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+        mock_schema_catalog,
+    ):
+        mock_schema_catalog.return_value = self.catalog
+        mock_create_conn.return_value = mock_conn
+        mock_create_conn_pool.return_value = queue.Queue()
+        mock_get_key_ranges.side_effect = lambda conn, table, *args, **kwargs: (
+            [(1, 3), (3, 5)] if table == "sales_order" else [(1, 3)]
+        )
+
+        def get_rows(conn, table, since=None, columns=None, key_range=None):
+            low = key_range[1] if key_range else 1
+            return [[low, datetime(2025, 1, low)]], columns
+
+        def consume(s3_client, bucket, table, batches, columns, date_and_time, codec=None, part=None, column_types=None):
+            list(batches)
+            return f"data/{date_and_time}/{table}/part-{part:05d}.json"
+
+        mock_get_rows_columns.side_effect = get_rows
+        mock_write_batches_to_s3.side_effect = consume
+        mock_write_table_to_s3.return_value = "data/x/currency.json"
+        mock_write_manifest.side_effect = (
+            lambda s3, bucket, table, dt, keys: f"data/{dt}/{table}/manifest.json"
+        )
+
+        result = lambda_handler({"partition_rows": 2}, None)
+
+        ranges = sorted(
+            c.kwargs["key_range"] for c in mock_get_rows_columns.call_args_list
+            if c.kwargs.get("key_range")
+        )
+        assert ranges == [("sales_order_id", 1, 3), ("sales_order_id", 3, 5)]
+        _, _, table, datetime_string, part_keys = mock_write_manifest.call_args.args
+        assert table == "sales_order"
+        assert part_keys == [
+            f"data/{datetime_string}/sales_order/part-00000.json",
+            f"data/{datetime_string}/sales_order/part-00001.json",
+        ]
+        # currency fits one chunk and is written as a single object
+        mock_write_table_to_s3.assert_called_once()
+        assert result["partitioned_tables"] == ["sales_order"]
+        assert result["failed_tables"] == {}
+        assert mock_put_watermarks.call_args.args[2] == {
+            "sales_order": "2025-01-03T00:00:00",
+            "currency": "2025-01-01T00:00:00",
+        }
+
+    @pytest.mark.it("Fails the table and writes no manifest if a part fails")
+    def test_handler_partition_failure(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_manifest,
+        mock_write_table_to_s3,
+        mock_write_batches_to_s3,
+        mock_get_rows_columns,
+        mock_get_key_ranges,
+        mock_create_conn_pool,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+        mock_schema_catalog,
+    ):
+        mock_schema_catalog.return_value = {"sales_order": self.catalog["sales_order"]}
+        mock_create_conn.return_value = mock_conn
+        mock_create_conn_pool.return_value = queue.Queue()
+        mock_get_key_ranges.return_value = [(1, 3), (3, 5)]
+
+        def get_rows(conn, table, since=None, columns=None, key_range=None):
+            if key_range[1] == 3:
+                raise DatabaseError("Boom")
+            return [[1, datetime(2025, 1, 1)]], columns
+
+        mock_get_rows_columns.side_effect = get_rows
+        mock_write_batches_to_s3.return_value = "data/x/sales_order/part-00000.json"
+
+        result = lambda_handler({"partition_rows": 2}, None)
+
+        mock_write_manifest.assert_not_called()
+        assert result["failed_tables"] == {"sales_order": "Boom"}
+        assert result["partitioned_tables"] == []
+        assert mock_put_watermarks.call_args.args[2] == {}
+
+    @pytest.mark.it("Plans smaller key ranges while the throttle has backed off")
+    def test_plan_key_ranges_backs_off(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_manifest,
+        mock_write_table_to_s3,
+        mock_write_batches_to_s3,
+        mock_get_rows_columns,
+        mock_get_key_ranges,
+        mock_create_conn_pool,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        pool = queue.Queue()
+        pool.put(mock_conn)
+        throttle = QueryThrottle(4, latency_threshold_s=1, log=lambda message: None)
+        throttle.scale = 0.25
+        mock_get_key_ranges.return_value = [(1, 3), (3, 5)]
+        config = {"partition_rows": 1000, "statement_timeout_ms": 0, "lock_timeout_ms": 0}
+
+        plans = plan_key_ranges(pool, {"sales_order": self.catalog["sales_order"]}, config, {}, throttle)
+
+        assert mock_get_key_ranges.call_args.args[4] == 250
+        assert plans == {"sales_order": [("sales_order_id", 1, 3), ("sales_order_id", 3, 5)]}
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.get_rows_and_columns_from_table")
+@patch("src.lambda_extract.write_table_to_s3")
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestSkipUnchangedTables:
+    previous = {
+        "address": {
+            "fingerprint": "30|2025-01-01 00:00:00",
+            "key": "data/20250101_000000/address.json",
+            "rows": 30,
+            "bytes": 100,
+            "checksum": "abc",
+            "format": "json",
+            "codec": None,
+            "duration_s": 0.1,
+        },
+        "staff": {
+            "fingerprint": "20|2025-01-01 00:00:00",
+            "key": "data/20250101_000000/staff.json",
+            "rows": 20,
+            "bytes": 100,
+            "checksum": "abc",
+            "format": "json",
+            "codec": None,
+            "duration_s": 0.1,
+        },
+    }
+
+    @pytest.mark.it("Skips tables whose fingerprint matches the last run as having no new rows when incremental")
+    def test_handler_skips_unchanged_tables(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+        mock_fingerprints,
+    ):
+        mock_get_table_fingerprints, mock_get_fingerprints, mock_put_fingerprints = mock_fingerprints
+        mock_create_conn.return_value = mock_conn
+        mock_get_table_fingerprints.return_value = {
+            "address": "30|2025-01-01 00:00:00",
+            "staff": "21|2025-02-01 00:00:00",
+        }
+        mock_get_fingerprints.return_value = self.previous
+        mock_get_rows_columns.return_value = ([[1, datetime(2025, 2, 1)]], ["id", "last_updated"])
+        mock_write_table_to_s3.side_effect = lambda s3, bucket, table, *args, **kwargs: f"data/new/{table}.json"
+
+        result = lambda_handler({"full_snapshot": False}, None)
+
+        assert result["skipped_tables"] == {"address": None}
+        assert [c.args[1] for c in mock_get_rows_columns.call_args_list] == ["staff"]
+        manifest_tables = mock_write_batch_manifest.call_args.args[3]
+        assert manifest_tables["staff"]["key"] == "data/new/staff.json"
+        # the previous delta was transformed by the run that wrote it
+        assert manifest_tables["address"] == {
+            "key": None,
+            "rows": 0,
+            "bytes": 0,
+            "checksum": None,
+            "format": "json",
+            "codec": None,
+            "duration_s": 0,
+            "skipped": True,
+        }
+        new_fingerprints = mock_put_fingerprints.call_args.args[2]
+        assert new_fingerprints["address"] == self.previous["address"]
+        assert new_fingerprints["staff"]["fingerprint"] == "21|2025-02-01 00:00:00"
+        assert new_fingerprints["staff"]["key"] == "data/new/staff.json"
+        assert new_fingerprints["staff"]["rows"] == 1
+
+    @pytest.mark.it("Records the fingerprint of a changed table that had no new rows")
+    def test_handler_records_fingerprint_without_rows(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+        mock_fingerprints,
+    ):
+        mock_get_table_fingerprints, mock_get_fingerprints, mock_put_fingerprints = mock_fingerprints
+        mock_create_conn.return_value = mock_conn
+        mock_get_table_fingerprints.return_value = {
+            "address": "30|2025-01-01 00:00:00",
+            "staff": "20|2025-02-01 00:00:00",
+        }
+        mock_get_fingerprints.return_value = self.previous
+        mock_get_rows_columns.return_value = ([], ["id", "last_updated"])
+        mock_write_table_to_s3.return_value = None
+
+        result = lambda_handler({"full_snapshot": False}, None)
+
+        assert result["failed_tables"] == {}
+        new_fingerprints = mock_put_fingerprints.call_args.args[2]
+        assert new_fingerprints["staff"]["fingerprint"] == "20|2025-02-01 00:00:00"
+        assert new_fingerprints["staff"]["key"] is None
+        assert new_fingerprints["staff"]["rows"] == 0
+        # the next run skips it instead of querying it again
+        assert find_unchanged_tables(
+            mock_get_table_fingerprints.return_value, new_fingerprints, get_extract_config({"full_snapshot": False})
+        ).keys() == {"address", "staff"}
+
+    @pytest.mark.it("Points unchanged tables at their previous snapshot on a full snapshot, the default")
+    def test_handler_skips_to_previous_snapshot(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+        mock_fingerprints,
+    ):
+        mock_get_table_fingerprints, mock_get_fingerprints, mock_put_fingerprints = mock_fingerprints
+        mock_create_conn.return_value = mock_conn
+        mock_get_table_fingerprints.return_value = {
+            "address": "30|2025-01-01 00:00:00",
+            "staff": "21|2025-02-01 00:00:00",
+        }
+        mock_get_fingerprints.return_value = {
+            **self.previous,
+            "address": {**self.previous["address"], "snapshot": True},
+        }
+        mock_get_rows_columns.return_value = ([[1, datetime(2025, 2, 1)]], ["id", "last_updated"])
+        mock_write_table_to_s3.side_effect = lambda s3, bucket, table, *args, **kwargs: f"data/new/{table}.json"
+
+        result = lambda_handler({}, None)
+
+        assert result["skipped_tables"] == {"address": "data/20250101_000000/address.json"}
+        manifest_tables = mock_write_batch_manifest.call_args.args[3]
+        assert manifest_tables["address"] == {
+            "key": "data/20250101_000000/address.json",
+            "rows": 30,
+            "bytes": 100,
+            "checksum": "abc",
+            "format": "json",
+            "codec": None,
+            "duration_s": 0.1,
+            "snapshot": True,
+            "skipped": True,
+        }
+        assert manifest_tables["staff"]["snapshot"] is True
+        new_fingerprints = mock_put_fingerprints.call_args.args[2]
+        assert new_fingerprints["staff"]["snapshot"] is True
+
+    @pytest.mark.it("Re-extracts unchanged tables on a full snapshot of a delta or a format change")
+    @pytest.mark.parametrize(
+        "event",
+        [{}, {"full_snapshot": False, "output_format": "jsonl"}, {"full_snapshot": False, "skip_unchanged": False}],
+    )
+    def test_handler_does_not_skip(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        event,
+        mock_conn,
+        mock_fingerprints,
+    ):
+        mock_get_table_fingerprints, mock_get_fingerprints, _ = mock_fingerprints
+        mock_create_conn.return_value = mock_conn
+        mock_get_table_fingerprints.return_value = {
+            "address": "30|2025-01-01 00:00:00",
+            "staff": "20|2025-01-01 00:00:00",
+        }
+        mock_get_fingerprints.return_value = self.previous
+        mock_get_rows_columns.return_value = ([], [])
+
+        with patch("src.lambda_extract.write_batches_to_s3_jsonl", return_value=None):
+            result = lambda_handler(event, None)
+
+        assert result["skipped_tables"] == {}
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.get_rows_and_columns_from_table", return_value=([], []))
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestWarmInvocations:
+    @pytest.mark.it("Reuses the secret and a live connection on the next invocation")
+    def test_handler_reuses_secret_and_connection(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        mock_create_conn.return_value = mock_conn
+        mock_get_secret.return_value = {"dbname": "test_db"}
+
+        lambda_handler({}, None)
+        lambda_handler({}, None)
+
+        mock_get_secret.assert_called_once()
+        mock_create_conn.assert_called_once()
+        mock_conn.run.assert_called_with("SELECT 1")
+
+    @pytest.mark.it("Reconnects when the cached connection is dead")
+    def test_handler_reconnects(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+    ):
+        dead_conn, new_conn = MagicMock(), MagicMock()
+        dead_conn.run.side_effect = pg8000.exceptions.InterfaceError("network error")
+        mock_create_conn.side_effect = [dead_conn, new_conn]
+        mock_get_secret.return_value = {"dbname": "test_db"}
+
+        lambda_handler({}, None)
+        result = lambda_handler({}, None)
+
+        assert result["statusCode"] == 200
+        assert mock_create_conn.call_count == 2
+        dead_conn.close.assert_called_once()
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.get_rows_and_columns_from_table")
+@patch("src.lambda_extract.write_table_to_s3", return_value="data/new/currency.json")
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestColumnProjection:
+    catalog = {
+        "currency": [
+            ("currency_id", "integer"),
+            ("currency_code", "character varying"),
+            ("created_at", "timestamp without time zone"),
+            ("last_updated", "timestamp without time zone"),
+        ],
+        "payment_type": [
+            ("payment_type_id", "integer"),
+            ("payment_type_name", "character varying"),
+        ],
+    }
+
+    @pytest.mark.it("Selects only the columns the transform reads and lists them in the manifest")
+    def test_handler_projects_columns(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+        mock_schema_catalog,
+    ):
+        mock_create_conn.return_value = mock_conn
+        mock_schema_catalog.return_value = self.catalog
+        mock_get_rows_columns.side_effect = lambda conn, table, since=None, columns=None, select="*": (
+            [[1] * len(columns)], columns
+        )
+
+        lambda_handler({"project_columns": True}, None)
+
+        calls = {c.args[1]: c.kwargs for c in mock_get_rows_columns.call_args_list}
+        assert calls["currency"]["select"] == "currency_id, currency_code, last_updated"
+        assert calls["currency"]["columns"] == ["currency_id", "currency_code", "last_updated"]
+        # no builder reads payment_type, so it is extracted whole
+        assert calls["payment_type"]["select"] == "payment_type_id, payment_type_name"
+        manifest_tables = mock_write_batch_manifest.call_args.args[3]
+        assert manifest_tables["currency"]["columns"] == ["currency_id", "currency_code", "last_updated"]
+        assert "columns" not in manifest_tables["payment_type"]
+
+
+@patch("src.lambda_extract.bucket_name", "test_bucket")
+@patch("src.lambda_extract.s3_client")
+@patch("src.lambda_extract.get_secret")
+@patch("src.lambda_extract.create_conn")
+@patch("src.lambda_extract.create_conn_pool")
+@patch("src.lambda_extract.get_rows_and_columns_from_table", return_value=([], []))
+@patch("src.lambda_extract.write_table_to_s3", return_value=None)
+@patch("src.lambda_extract.write_batch_manifest")
+@patch("src.lambda_extract.get_watermarks", return_value={})
+@patch("src.lambda_extract.put_watermarks")
+class TestSourceProtection:
+    @pytest.mark.it("Sets the session timeouts on every connection a run queries through")
+    def test_handler_sets_timeouts(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn_pool,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        pooled_conn = MagicMock()
+        pool = queue.Queue()
+        pool.put(pooled_conn)
+        mock_create_conn.return_value = mock_conn
+        mock_create_conn_pool.return_value = pool
+
+        result = lambda_handler(
+            {"parallel": True, "statement_timeout_ms": 30000, "lock_timeout_ms": 2000}, None
+        )
+
+        assert result["statusCode"] == 200
+        for conn in [mock_conn, pooled_conn]:
+            if conn.run.called:
+                conn.run.assert_any_call("SET statement_timeout = 30000")
+                conn.run.assert_any_call("SET lock_timeout = 2000")
+        mock_conn.run.assert_any_call("SET statement_timeout = 30000")
+
+    @pytest.mark.it("Caps the queries running at once at max_concurrency")
+    def test_handler_caps_concurrency(
+        self,
+        mock_put_watermarks,
+        mock_get_watermarks,
+        mock_write_batch_manifest,
+        mock_write_table_to_s3,
+        mock_get_rows_columns,
+        mock_create_conn_pool,
+        mock_create_conn,
+        mock_get_secret,
+        mock_s3_client,
+        mock_conn,
+    ):
+        pool = queue.Queue()
+        for _ in range(3):
+            pool.put(MagicMock())
+        mock_create_conn.return_value = mock_conn
+        mock_create_conn_pool.return_value = pool
+        running, peak = [0], [0]
+
+        def get_rows(conn, table, since=None, columns=None):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            running[0] -= 1
+            return [], []
+
+        mock_get_rows_columns.side_effect = get_rows
+
+        lambda_handler({"parallel": True, "pool_size": 4, "max_concurrency": 1}, None)
+
+        assert peak[0] == 1
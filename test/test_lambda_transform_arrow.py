@@ -0,0 +1,108 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from src.lambda_transform_arrow import ARROW_BUILDERS
+from src.lambda_transform_utils import get_ingestion_schema, read_json_bytes
+from src.source_columns import TRANSFORM_BUILDERS
+from src.totesys_schema import TOTESYS_SCHEMA
+from src.utils import arrow_schema_from_column_types
+
+TABLES = ["sales_order", "design", "address", "counterparty", "staff", "department", "currency"]
+
+
+@pytest.fixture(scope="module")
+def ingested():
+    tables = {}
+    for table in TABLES:
+        with open(f"data/json_lines_s3_format/{table}.jsonl", "rb") as file:
+            tables[table] = read_json_bytes(file.read(), get_ingestion_schema(table))
+    return tables
+
+
+def build_both(output_table, tables):
+    """Returns what each engine would write for an output table."""
+    pandas_build, arrow_build = TRANSFORM_BUILDERS[output_table], ARROW_BUILDERS[output_table]
+    sources = list(pandas_build.source_columns)
+    expected = pa.Table.from_pandas(pandas_build(*[tables[source].to_pandas() for source in sources]))
+    actual = arrow_build(*[tables[source] for source in sources])
+    return expected, actual
+
+
+def set_column(table, name, column):
+    return table.set_column(table.schema.get_field_index(name), name, column)
+
+
+class TestArrowBuilders:
+    @pytest.mark.it("Registers an arrow builder for every output, reading the same sources")
+    def test_registry(self):
+        assert list(ARROW_BUILDERS) == list(TRANSFORM_BUILDERS)
+        for output_table, build in ARROW_BUILDERS.items():
+            assert build.source_columns == TRANSFORM_BUILDERS[output_table].source_columns
+
+    @pytest.mark.it("Builds the pandas engine's schema, pandas metadata included, and data")
+    @pytest.mark.parametrize("output_table", list(TRANSFORM_BUILDERS))
+    def test_parity(self, ingested, output_table):
+        expected, actual = build_both(output_table, ingested)
+
+        assert actual.schema.equals(expected.schema, check_metadata=True)
+        assert actual.equals(expected)
+
+    @pytest.mark.it("Matches on Parquet-typed sources: int32 ids, dates and timestamps as ingested")
+    @pytest.mark.parametrize("output_table", list(TRANSFORM_BUILDERS))
+    def test_parquet_sources(self, ingested, output_table):
+        sources = {}
+        for table in TRANSFORM_BUILDERS[output_table].source_columns:
+            buffer = io.BytesIO()
+            pq.write_table(ingested[table].cast(arrow_schema_from_column_types(TOTESYS_SCHEMA[table])), buffer)
+            sources[table] = buffer.getvalue()
+
+        expected = pa.Table.from_pandas(TRANSFORM_BUILDERS[output_table](
+            *[pd.read_parquet(io.BytesIO(data)) for data in sources.values()]))
+        actual = ARROW_BUILDERS[output_table](*[pq.read_table(io.BytesIO(data)) for data in sources.values()])
+
+        assert actual.equals(expected, check_metadata=True)
+
+    @pytest.mark.it("Matches on millisecond timestamps")
+    def test_millisecond_timestamps(self, ingested):
+        sales_order = set_column(ingested["sales_order"], "created_at",
+                                 ingested["sales_order"].column("created_at").cast(pa.timestamp("ms")))
+
+        expected, actual = build_both("fact_sales_order", {"sales_order": sales_order})
+
+        assert actual.equals(expected, check_metadata=True)
+
+    @pytest.mark.it("Types an all-null text column and an empty source as pandas does")
+    def test_nulls_and_empty(self, ingested):
+        address = set_column(ingested["address"], "address_line_2", pa.nulls(ingested["address"].num_rows, pa.string()))
+        sales_order = ingested["sales_order"].slice(0, 0)
+
+        expected_location = pa.Table.from_pandas(TRANSFORM_BUILDERS["dim_location"](address.to_pandas()))
+        expected_dates = pa.Table.from_pandas(TRANSFORM_BUILDERS["dim_date"](sales_order.to_pandas()))
+
+        assert ARROW_BUILDERS["dim_location"](address).equals(expected_location, check_metadata=True)
+        assert ARROW_BUILDERS["dim_date"](sales_order).equals(expected_dates, check_metadata=True)
+
+    @pytest.mark.it("Keeps pandas.merge's row order in joins")
+    def test_join_order(self, ingested):
+        staff = ingested["staff"].take(list(reversed(range(ingested["staff"].num_rows))))
+        department = ingested["department"].take(list(reversed(range(ingested["department"].num_rows))))
+
+        expected, actual = build_both("dim_staff", {"staff": staff, "department": department})
+
+        assert actual.equals(expected, check_metadata=True)
+        assert actual.column("staff_id").to_pylist() == staff.column("staff_id").to_pylist()
+
+    @pytest.mark.it("Is read back by pandas with its index, as the load lambda reads it")
+    def test_read_back(self, ingested):
+        _, actual = build_both("dim_currency", ingested)
+        buffer = io.BytesIO()
+        pq.write_table(actual, buffer)
+
+        df = pd.read_parquet(io.BytesIO(buffer.getvalue())).reset_index()
+
+        assert list(df.columns) == ["currency_id", "currency_code", "currency_name"]
+        assert list(df["currency_name"]) == ["Great British Pounds", "United States Dollars", "Euro"]
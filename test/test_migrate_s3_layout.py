@@ -0,0 +1,99 @@
+import os
+import json
+import boto3
+import pytest
+from moto import mock_aws
+from src.migrate_s3_layout import legacy_key_to_hive, migrate_bucket
+from src.utils import FINGERPRINTS_KEY
+
+BUCKET_NAME = "test_bucket"
+BATCH = "20250312_143803"
+
+
+@pytest.fixture(scope="function", autouse=True)
+def aws_credentials():
+    """Mocked AWS Credentials for moto."""
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture
+def legacy_bucket():
+    """A bucket holding one batch in the flat layout: a single-object table,
+    a partitioned table, both manifests and the fingerprints."""
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="eu-west-2")
+        s3.create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        parts = [f"data/{BATCH}/sales_order/part-0000{n}.jsonl.gz" for n in range(2)]
+        for part in parts:
+            s3.put_object(Bucket=BUCKET_NAME, Key=part, Body=b"{}", Metadata={"codec": "gzip"})
+        s3.put_object(Bucket=BUCKET_NAME, Key=f"data/{BATCH}/staff.jsonl", Body=b"{}")
+        table_manifest = f"data/{BATCH}/sales_order/manifest.json"
+        s3.put_object(Bucket=BUCKET_NAME, Key=table_manifest,
+                      Body=json.dumps({"table": "sales_order", "parts": parts}))
+        s3.put_object(Bucket=BUCKET_NAME, Key=f"data/{BATCH}/manifest.json", Body=json.dumps({
+            "datetime_string": BATCH,
+            "tables": {"sales_order": {"key": table_manifest, "rows": 2, "parts": parts},
+                       "staff": {"key": f"data/{BATCH}/staff.jsonl", "rows": 1},
+                       "currency": {"key": None, "rows": 0}},
+        }))
+        s3.put_object(Bucket=BUCKET_NAME, Key=FINGERPRINTS_KEY, Body=json.dumps({
+            "staff": {"fingerprint": "1|x", "key": f"data/{BATCH}/staff.jsonl"},
+            "sales_order": {"fingerprint": "2|x", "key": table_manifest, "parts": parts},
+        }))
+        s3.put_object(Bucket=BUCKET_NAME, Key="data/not a batch/staff.json", Body=b"{}")
+        yield s3
+
+
+def read_json(s3, key):
+    return json.loads(s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read())
+
+
+class TestLegacyKeyToHive:
+    @pytest.mark.it("Maps every flat-layout key kind to the new layout")
+    def test_mapping(self):
+        prefix = f"table=staff/date=2025-03-12/batch={BATCH}/"
+        assert legacy_key_to_hive(f"data/{BATCH}/staff.json.zst") == (prefix + "part-00000.json.zst", "object")
+        assert legacy_key_to_hive(f"data/{BATCH}/staff/part-00004.parquet") == (prefix + "part-00004.parquet", "object")
+        assert legacy_key_to_hive(f"data/{BATCH}/staff/manifest.json") == (prefix + "manifest.json", "table_manifest")
+        assert legacy_key_to_hive(f"data/{BATCH}/manifest.json") == (
+            f"manifests/date=2025-03-12/batch={BATCH}/manifest.json", "batch_manifest")
+        assert legacy_key_to_hive("watermarks/last_updated.json") is None
+        assert legacy_key_to_hive("data/not a batch/staff.json") is None
+
+
+class TestMigrateBucket:
+    @pytest.mark.it("Changes nothing on a dry run")
+    def test_dry_run(self, legacy_bucket):
+        result = migrate_bucket(legacy_bucket, BUCKET_NAME)
+
+        assert len(result["moves"]) == 5
+        assert result["skipped"] == ["data/not a batch/staff.json"]
+        keys = [item["Key"] for item in legacy_bucket.list_objects_v2(Bucket=BUCKET_NAME)["Contents"]]
+        assert not any(key.startswith(("table=", "manifests/")) for key in keys)
+
+    @pytest.mark.it("Copies objects and rewrites the keys listed in manifests and fingerprints")
+    def test_apply(self, legacy_bucket):
+        result = migrate_bucket(legacy_bucket, BUCKET_NAME, apply=True, delete=True)
+
+        prefix = f"table=sales_order/date=2025-03-12/batch={BATCH}/"
+        assert [kind for _, _, kind in result["moves"]][-2:] == ["table_manifest", "batch_manifest"]
+        assert result["deleted"] == 5
+        head = legacy_bucket.head_object(Bucket=BUCKET_NAME, Key=prefix + "part-00001.jsonl.gz")
+        assert head["Metadata"] == {"codec": "gzip"}
+        assert read_json(legacy_bucket, prefix + "manifest.json")["parts"] == [
+            prefix + "part-00000.jsonl.gz", prefix + "part-00001.jsonl.gz"]
+        batch_manifest = read_json(legacy_bucket, f"manifests/date=2025-03-12/batch={BATCH}/manifest.json")
+        assert batch_manifest["tables"]["sales_order"]["key"] == prefix + "manifest.json"
+        new_parts = [prefix + "part-00000.jsonl.gz", prefix + "part-00001.jsonl.gz"]
+        assert batch_manifest["tables"]["sales_order"]["parts"] == new_parts
+        staff_key = f"table=staff/date=2025-03-12/batch={BATCH}/part-00000.jsonl"
+        assert batch_manifest["tables"]["staff"]["key"] == staff_key
+        assert batch_manifest["tables"]["currency"]["key"] is None
+        fingerprints = read_json(legacy_bucket, FINGERPRINTS_KEY)
+        assert fingerprints["staff"]["key"] == staff_key
+        assert fingerprints["sales_order"]["key"] == prefix + "manifest.json"
+        assert fingerprints["sales_order"]["parts"] == new_parts
+        remaining = [item["Key"] for item in legacy_bucket.list_objects_v2(Bucket=BUCKET_NAME, Prefix="data/")["Contents"]]
+        assert remaining == ["data/not a batch/staff.json"]
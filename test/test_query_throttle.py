@@ -0,0 +1,84 @@
+import time
+import threading
+import pytest
+from src.query_throttle import QueryThrottle, RECOVER_AFTER, MIN_BATCH_SIZE
+
+
+def quiet_throttle(*args, **kwargs):
+    return QueryThrottle(*args, log=lambda message: None, **kwargs)
+
+
+class TestConcurrencyCap:
+    @pytest.mark.it("Never runs more queries at once than the limit")
+    def test_cap(self):
+        throttle = quiet_throttle(2)
+        peak, lock = [0], threading.Lock()
+
+        def query():
+            with throttle.query("staff"):
+                with lock:
+                    peak[0] = max(peak[0], throttle.running)
+                time.sleep(0.02)
+
+        threads = [threading.Thread(target=query) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert peak[0] == 2
+        assert len(throttle.timings) == 6
+
+    @pytest.mark.it("Times and logs every query, including failed ones")
+    def test_logs_failures(self):
+        messages = []
+        throttle = QueryThrottle(1, log=messages.append)
+
+        with pytest.raises(ValueError):
+            with throttle.query("staff", "fetch"):
+                raise ValueError("canceling statement due to statement timeout")
+
+        assert throttle.running == 0
+        assert throttle.timings[0]["table"] == "staff"
+        assert messages[0].startswith("Log: fetch on staff took ")
+
+
+class TestAdaptiveThrottling:
+    @pytest.mark.it("Halves the concurrency and fetch size after a slow query")
+    def test_backs_off(self):
+        throttle = quiet_throttle(4, latency_threshold_s=0.01)
+
+        with throttle.query("sales_order"):
+            time.sleep(0.02)
+
+        assert (throttle.limit, throttle.scale) == (2, 0.5)
+        assert throttle.batch_size(5000) == 2500
+        assert throttle.batch_size(50) == 50
+
+    @pytest.mark.it("Shrinks the partition chunk size with the fetch size")
+    def test_chunk_size(self):
+        throttle = quiet_throttle(4, latency_threshold_s=0.01)
+
+        assert throttle.chunk_size(100000) == 100000
+        with throttle.query("sales_order", "key ranges"):
+            time.sleep(0.02)
+
+        assert throttle.chunk_size(100000) == 50000
+
+    @pytest.mark.it("Steps back up after a run of fast queries, never past the configured cap")
+    def test_recovers(self):
+        throttle = quiet_throttle(4, latency_threshold_s=1)
+        throttle.limit, throttle.scale = 1, 0.25
+
+        for _ in range(RECOVER_AFTER * 10):
+            with throttle.query("staff"):
+                pass
+
+        assert (throttle.limit, throttle.scale) == (4, 1.0)
+
+    @pytest.mark.it("Keeps fetch sizes above a floor however far it backs off")
+    def test_floor(self):
+        throttle = quiet_throttle(1)
+        throttle.scale = 0
+
+        assert throttle.batch_size(5000) == MIN_BATCH_SIZE
@@ -0,0 +1,115 @@
+import os
+import boto3
+import pytest
+from moto import mock_aws
+from src.s3_keys import (
+    batch_date,
+    table_prefix,
+    batch_manifest_prefix,
+    build_table_key,
+    build_table_manifest_key,
+    build_batch_manifest_key,
+    parse_key,
+    list_keys,
+    list_batches,
+)
+
+
+@pytest.fixture(scope="function", autouse=True)
+def aws_credentials():
+    """Mocked AWS Credentials for moto."""
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+class TestKeyBuilders:
+    @pytest.mark.it("Dates batches from the lambda and the older minute-level timestamps")
+    def test_batch_date(self):
+        assert batch_date("20250312_143803") == "2025-03-12"
+        assert batch_date("2025-3-12_14-30") == "2025-03-12"
+        with pytest.raises(ValueError):
+            batch_date("latest")
+
+    @pytest.mark.it("Places table parts and manifests under table, date and batch")
+    def test_table_keys(self):
+        assert build_table_key("sales_order", "20250312_143803", ".jsonl.gz") == (
+            "table=sales_order/date=2025-03-12/batch=20250312_143803/part-00000.jsonl.gz"
+        )
+        assert build_table_key("sales_order", "20250312_143803", ".parquet", part=12) == (
+            "table=sales_order/date=2025-03-12/batch=20250312_143803/part-00012.parquet"
+        )
+        assert build_table_manifest_key("sales_order", "20250312_143803") == (
+            "table=sales_order/date=2025-03-12/batch=20250312_143803/manifest.json"
+        )
+        assert build_batch_manifest_key("20250312_143803") == (
+            "manifests/date=2025-03-12/batch=20250312_143803/manifest.json"
+        )
+
+    @pytest.mark.it("Builds nested prefixes for a table's history, one day or one batch")
+    def test_prefixes(self):
+        assert table_prefix("staff") == "table=staff/"
+        assert table_prefix("staff", date="2025-03-12") == "table=staff/date=2025-03-12/"
+        assert table_prefix("staff", datetime_string="20250312_143803") == (
+            "table=staff/date=2025-03-12/batch=20250312_143803/"
+        )
+        assert batch_manifest_prefix("2025-03-12") == "manifests/date=2025-03-12/"
+        key = build_table_key("staff", "20250312_143803")
+        assert all(key.startswith(prefix) for prefix in [
+            table_prefix("staff"),
+            table_prefix("staff", date="2025-03-12"),
+            table_prefix("staff", datetime_string="20250312_143803"),
+        ])
+
+
+class TestParseKey:
+    @pytest.mark.it("Parses the keys it builds back into their fields")
+    def test_round_trip(self):
+        assert parse_key(build_table_key("sales_order", "20250312_143803", ".jsonl.zst", part=3)) == {
+            "table": "sales_order",
+            "date": "2025-03-12",
+            "batch": "20250312_143803",
+            "part": 3,
+            "extension": ".jsonl.zst",
+            "manifest": False,
+        }
+        assert parse_key(build_table_manifest_key("sales_order", "20250312_143803"))["manifest"]
+        batch_manifest = parse_key(build_batch_manifest_key("20250312_143803"))
+        assert batch_manifest["table"] is None
+        assert batch_manifest["manifest"]
+
+    @pytest.mark.it("Rejects keys outside the layout")
+    def test_invalid_keys(self):
+        for key in ["data/20250312_143803/staff.json", "watermarks/last_updated.json", "table=staff/part-00000.json"]:
+            with pytest.raises(ValueError):
+                parse_key(key)
+
+
+class TestListKeys:
+    @pytest.mark.it("Lists one table's objects for a day with a single prefix")
+    def test_list_table_day(self):
+        with mock_aws():
+            s3 = boto3.client("s3", region_name="eu-west-2")
+            s3.create_bucket(Bucket="test-bucket", CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+            for table, batch in [("staff", "20250312_090000"), ("staff", "20250312_100000"),
+                                 ("staff", "20250313_090000"), ("address", "20250312_090000")]:
+                s3.put_object(Bucket="test-bucket", Key=build_table_key(table, batch), Body=b"[]")
+
+            keys = list_keys(s3, "test-bucket", table_prefix("staff", date="2025-03-12"))
+
+        assert [parse_key(key)["batch"] for key in keys] == ["20250312_090000", "20250312_100000"]
+
+    @pytest.mark.it("Lists only the batches after a given batch, starting at its day")
+    def test_list_batches_after(self):
+        with mock_aws():
+            s3 = boto3.client("s3", region_name="eu-west-2")
+            s3.create_bucket(Bucket="test-bucket", CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+            for batch in ["20250311_090000", "20250312_090000", "2025-03-12_10-30", "20250312_110000", "20250313_090000"]:
+                s3.put_object(Bucket="test-bucket", Key=build_batch_manifest_key(batch), Body=b"{}")
+
+            batches = list_batches(s3, "test-bucket", after="20250312_090000")
+            keys = list_keys(s3, "test-bucket", batch_manifest_prefix(), batch_manifest_prefix("2025-03-12"))
+
+        assert batches == ["2025-03-12_10-30", "20250312_110000", "20250313_090000"]
+        # S3 itself skips the earlier days
+        assert [parse_key(key)["date"] for key in keys] == ["2025-03-12"] * 3 + ["2025-03-13"]
@@ -0,0 +1,89 @@
+import pytest
+import pandas as pd
+from src.data_generator import generate_totesys
+from src.source_columns import (
+    SOURCE_COLUMNS,
+    get_required_columns,
+    project_column_types,
+    project_catalog,
+)
+from src import lambda_transform_utils
+
+BUILDERS = [
+    lambda_transform_utils._return_df_dim_dates,
+    lambda_transform_utils._return_df_dim_design,
+    lambda_transform_utils._return_df_dim_location,
+    lambda_transform_utils._return_df_dim_counterparty,
+    lambda_transform_utils._return_df_dim_staff,
+    lambda_transform_utils._return_df_dim_currency,
+    lambda_transform_utils._return_df_fact_sales_order,
+]
+
+
+class TestRequiredColumns:
+    @pytest.mark.it("Takes the union of every builder's columns per source table")
+    def test_union(self):
+        registry = {
+            "dim_location": {"address": ["address_id", "city"]},
+            "dim_counterparty": {"counterparty": ["counterparty_id"], "address": ["address_id", "phone"]},
+        }
+
+        assert get_required_columns(registry) == {
+            "address": {"address_id", "city", "phone"},
+            "counterparty": {"counterparty_id"},
+        }
+
+    @pytest.mark.it("Registers every transform builder on import")
+    def test_builders_registered(self):
+        required = get_required_columns()
+
+        assert set(SOURCE_COLUMNS) == {
+            "dim_date", "dim_design", "dim_location", "dim_counterparty",
+            "dim_staff", "dim_currency", "fact_sales_order",
+        }
+        assert "commercial_contact" not in required["counterparty"]
+        assert "created_at" not in required["address"]
+
+
+class TestProjectColumnTypes:
+    column_types = [
+        ("address_id", "integer"),
+        ("address_line_1", "character varying"),
+        ("city", "character varying"),
+        ("created_at", "timestamp without time zone"),
+        ("last_updated", "timestamp without time zone"),
+    ]
+
+    @pytest.mark.it("Keeps the required columns, key and watermark in ordinal order")
+    def test_projection(self):
+        assert project_column_types("address", self.column_types, {"address": {"city"}}) == [
+            ("address_id", "integer"),
+            ("city", "character varying"),
+            ("last_updated", "timestamp without time zone"),
+        ]
+
+    @pytest.mark.it("Leaves tables no builder reads whole and reports only projected tables")
+    def test_unread_tables(self):
+        catalog = {"address": self.column_types, "payment": [("payment_id", "integer")]}
+
+        projected = project_catalog(catalog, {"address": {"city"}})
+
+        assert list(projected) == ["address"]
+        assert project_column_types("payment", catalog["payment"], {}) == catalog["payment"]
+
+
+class TestBuildersOnProjectedTables:
+    @pytest.mark.it("Builds the same outputs from projected tables as from whole ones")
+    @pytest.mark.parametrize("build", BUILDERS, ids=lambda build: build.__name__)
+    def test_same_output(self, build):
+        tables = dict(generate_totesys(scale=0.05, seed=3))
+        required = get_required_columns()
+        projected = {
+            table: df.loc[:, [name for name, _ in project_column_types(table, [(c, None) for c in df.columns], required)]]
+            for table, df in tables.items()
+        }
+
+        expected = build(*[tables[table] for table in build.source_columns])
+        result = build(*[projected[table] for table in build.source_columns])
+
+        pd.testing.assert_frame_equal(result, expected)
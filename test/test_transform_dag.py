@@ -0,0 +1,142 @@
+import gc
+import threading
+import weakref
+
+import pandas as pd
+import pytest
+
+from src.transform_dag import get_transform_dag, run_transform_dag
+
+
+def builder(*sources):
+    """A builder reading the given sources, as requires_columns would register it."""
+    def build(*dfs):
+        return sum(len(df) for df in dfs)
+
+    build.source_columns = {source: [] for source in sources}
+    return build
+
+
+def run_output(output_table, build, *dfs):
+    return build(*dfs)
+
+
+class TestGetTransformDag:
+    @pytest.mark.it("Lists every registered builder with its sources in argument order")
+    def test_registered_builders(self):
+        dag = {output_table: sources for output_table, sources, _ in get_transform_dag()}
+
+        assert list(dag) == [
+            "dim_date", "dim_design", "dim_location", "dim_counterparty",
+            "dim_staff", "dim_currency", "fact_sales_order",
+        ]
+        assert dag["dim_counterparty"] == ["counterparty", "address"]
+        assert dag["dim_staff"] == ["staff", "department"]
+
+    @pytest.mark.it("A new output only needs its builder registered")
+    def test_new_output(self):
+        builders = {"dim_location": builder("address"), "fact_payment": builder("payment", "payment_type")}
+
+        dag = get_transform_dag(builders)
+
+        assert [(output_table, sources) for output_table, sources, _ in dag] == [
+            ("dim_location", ["address"]),
+            ("fact_payment", ["payment", "payment_type"]),
+        ]
+
+
+class TestRunTransformDag:
+    @pytest.mark.it("Loads each source once however many outputs read it")
+    def test_loads_once(self):
+        loaded = []
+        dag = get_transform_dag({
+            "dim_location": builder("address"),
+            "dim_counterparty": builder("counterparty", "address"),
+        })
+
+        def load_source(table):
+            loaded.append(table)
+            return pd.DataFrame({"id": range(3)})
+
+        results = run_transform_dag(dag, load_source, run_output)
+
+        assert sorted(loaded) == ["address", "counterparty"]
+        assert results == {"dim_location": 3, "dim_counterparty": 6}
+
+    @pytest.mark.it("Runs independent builders in parallel")
+    def test_parallel_builders(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def build(df):
+            barrier.wait()  # only returns once both builders are running
+            return len(df)
+
+        build.source_columns = {"design": []}
+        dag = [("dim_design", ["design"], build), ("dim_currency", ["currency"], build)]
+
+        results = run_transform_dag(dag, lambda table: pd.DataFrame({"id": [1]}), run_output, build_workers=2)
+
+        assert results == {"dim_design": 1, "dim_currency": 1}
+
+    @pytest.mark.it("Starts an output as soon as its own sources are loaded")
+    def test_starts_when_ready(self):
+        currency_built = threading.Event()
+
+        def load_source(table):
+            if table == "sales_order":
+                assert currency_built.wait(timeout=5)
+            return pd.DataFrame({"id": [1]})
+
+        def build_currency(df):
+            currency_built.set()
+            return len(df)
+
+        dag = [
+            ("fact_sales_order", ["sales_order"], lambda df: len(df)),
+            ("dim_currency", ["currency"], build_currency),
+        ]
+
+        results = run_transform_dag(dag, load_source, run_output)
+
+        assert results == {"fact_sales_order": 1, "dim_currency": 1}
+
+    @pytest.mark.it("Frees a source once its last consumer has finished")
+    def test_frees_sources(self):
+        refs = {}
+
+        def load_source(table):
+            df = pd.DataFrame({"id": range(10)})
+            refs[table] = weakref.ref(df)
+            return df
+
+        def build_staff(df):
+            gc.collect()
+            return refs["design"]() is None
+
+        dag = [
+            ("dim_design", ["design"], lambda df: len(df)),
+            ("dim_staff", ["staff"], build_staff),
+        ]
+        # staff is only loaded, and dim_staff only built, once dim_design has finished
+        results = run_transform_dag(dag, load_source, run_output, load_workers=1, build_workers=1)
+
+        assert results == {"dim_design": 10, "dim_staff": True}
+
+    @pytest.mark.it("Raises a load or build error once the rest of the DAG has run")
+    def test_errors(self):
+        built = []
+
+        def load_source(table):
+            if table == "design":
+                raise ValueError("no design")
+            return pd.DataFrame({"id": [1]})
+
+        def record(output_table, build, *dfs):
+            built.append(output_table)
+            return build(*dfs)
+
+        dag = [("dim_design", ["design"], lambda df: len(df)), ("dim_currency", ["currency"], lambda df: len(df))]
+
+        with pytest.raises(ValueError, match="no design"):
+            run_transform_dag(dag, load_source, record)
+        assert built == ["dim_currency"]
@@ -0,0 +1,84 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from src.lambda_transform_utils import _return_df_dim_currency, _return_df_dim_design
+from src.transform_memo import (
+    MEMO_KEY,
+    builder_version,
+    find_memoised_output,
+    get_memo,
+    input_hash,
+    put_memo,
+)
+
+BUCKET = "processed-bucket"
+
+
+@pytest.fixture
+def aws_credentials(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+
+
+@pytest.fixture
+def s3_client(aws_credentials):
+    with mock_aws():
+        client = boto3.client("s3", region_name="eu-west-2")
+        client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        yield client
+
+
+def entry(checksum, rows=3, key="table=design/part-00000.jsonl"):
+    return {"key": key, "rows": rows, "checksum": checksum}
+
+
+class TestInputHash:
+    @pytest.mark.it("Is stable for the same source checksums and builder")
+    def test_stable(self):
+        assert input_hash(_return_df_dim_design, [entry("a")]) == input_hash(_return_df_dim_design, [entry("a")])
+
+    @pytest.mark.it("Changes with a source checksum or the builder")
+    def test_changes(self):
+        digest = input_hash(_return_df_dim_design, [entry("a")])
+
+        assert input_hash(_return_df_dim_design, [entry("b")]) != digest
+        assert input_hash(_return_df_dim_currency, [entry("a")]) != digest
+
+    @pytest.mark.it("Is None when a source has no object or no checksum")
+    def test_unhashable(self):
+        assert input_hash(_return_df_dim_design, [None]) is None
+        assert input_hash(_return_df_dim_design, [entry(None)]) is None
+        assert input_hash(_return_df_dim_design, [entry("a", rows=0)]) is None
+
+    @pytest.mark.it("Versions a builder by its name and its module's source")
+    def test_builder_version(self):
+        assert builder_version(_return_df_dim_design).startswith("_return_df_dim_design@")
+        assert builder_version(_return_df_dim_design).split("@")[1] == builder_version(_return_df_dim_currency).split("@")[1]
+
+
+class TestMemo:
+    @pytest.mark.it("Reads an empty memo before the first run and what was put after it")
+    def test_round_trip(self, s3_client):
+        assert get_memo(s3_client, BUCKET) == {}
+
+        assert put_memo(s3_client, BUCKET, {"dim_design": {"input_hash": "h", "entry": {}}}) == MEMO_KEY
+        assert get_memo(s3_client, BUCKET) == {"dim_design": {"input_hash": "h", "entry": {}}}
+
+    @pytest.mark.it("Finds an output only for a matching hash and an unchanged object")
+    def test_find(self, s3_client):
+        key = "table=dim_design/date=2025-01-01/batch=20250101_000000/part-00000.parquet"
+        response = s3_client.put_object(Bucket=BUCKET, Key=key, Body=b"parquet")
+        processed = {"key": key, "rows": 1, "checksum": response["ETag"].strip('"')}
+        memo = {"dim_design": {"input_hash": "h", "entry": processed}}
+
+        assert find_memoised_output(s3_client, BUCKET, memo, "dim_design", "h") == processed
+        assert find_memoised_output(s3_client, BUCKET, memo, "dim_design", "other") is None
+        assert find_memoised_output(s3_client, BUCKET, memo, "dim_design", None) is None
+        assert find_memoised_output(s3_client, BUCKET, memo, "dim_currency", "h") is None
+
+        s3_client.put_object(Bucket=BUCKET, Key=key, Body=b"rewritten")
+        assert find_memoised_output(s3_client, BUCKET, memo, "dim_design", "h") is None
+
+        s3_client.delete_object(Bucket=BUCKET, Key=key)
+        assert find_memoised_output(s3_client, BUCKET, memo, "dim_design", "h") is None
@@ -6,17 +6,56 @@ from moto import mock_aws
 from pg8000.exceptions import DatabaseError
 from botocore.exceptions import ClientError, NoCredentialsError
 from datetime import datetime
+from decimal import Decimal
 from unittest.mock import MagicMock, Mock, patch
 import tempfile
+import io
+import pyarrow as pa
+import pyarrow.parquet as pq
 from src.utils import (
     get_secret,
     create_conn,
     close_db,
     get_rows_and_columns_from_table,
     write_table_to_s3,
-    log_file,
+    describe_s3_objects,
+    write_batch_manifest,
+    read_batch_manifest,
+    count_rows,
     json_to_pg8000_output,
+    get_table_watermark,
+    get_watermarks,
+    put_watermarks,
+    stream_rows_from_table,
+    copy_rows_from_table,
+    build_select_query,
+    get_table_fingerprints,
+    get_partition_key,
+    get_key_ranges,
+    write_batches_to_s3,
+    create_conn_pool,
+    close_conn_pool,
+    get_cached_secret,
+    get_cached_conn,
+    drop_cached_conn,
+    arrow_schema_from_column_types,
+    make_json_row_encoder,
+    make_record_batch_encoder,
+    json_default,
+    write_batches_to_s3_parquet,
+    write_batches_to_s3_jsonl,
+    compress_bytes,
+    decompress_bytes,
+    codec_from_key,
+    fetch_schema_catalog,
+    get_schema_catalog,
+    set_session_timeouts,
+    get_cancellation_reason,
+    get_peak_memory_mb,
+    reset_peak_memory,
 )
+from src.query_throttle import QueryThrottle
+import src.utils
 
 
 @pytest.fixture(scope="function", autouse=True)
@@ -256,6 +295,152 @@ class TestConnection:
             close_db(mock_conn)
 
 
+class TestConnectionPool:
+    @pytest.mark.it("Opens the requested number of connections and closes them all")
+    @patch("src.utils.Connection")
+    def test_create_and_close_conn_pool(self, mock_Connection, mock_secret):
+        mock_Connection.side_effect = [MagicMock(), MagicMock(), MagicMock()]
+        pool = create_conn_pool(mock_secret, 3)
+        assert pool.qsize() == 3
+        conns = list(pool.queue)
+        close_conn_pool(pool)
+        assert pool.empty()
+        for conn in conns:
+            conn.close.assert_called_once()
+
+
+class TestWarmInvocationCache:
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        drop_cached_conn()
+        yield
+        drop_cached_conn()
+
+    @pytest.mark.it("Fetches the secret once per TTL")
+    def test_get_cached_secret(self):
+        fetch = Mock(side_effect=[{"password": "a"}, {"password": "b"}])
+        assert get_cached_secret(None, "secret", ttl=300, fetch=fetch) == {"password": "a"}
+        assert get_cached_secret(None, "secret", ttl=300, fetch=fetch) == {"password": "a"}
+        assert fetch.call_count == 1
+        assert get_cached_secret(None, "secret", ttl=0, fetch=fetch) == {"password": "b"}
+
+    @pytest.mark.it("Reuses a live connection opened with the same credentials")
+    def test_get_cached_conn_reuse(self):
+        conn = MagicMock()
+        connect = Mock(return_value=conn)
+        assert get_cached_conn({"user": "a"}, connect=connect) is conn
+        assert get_cached_conn({"user": "a"}, connect=connect) is conn
+        connect.assert_called_once()
+        conn.run.assert_called_once_with("SELECT 1")
+
+    @pytest.mark.it("Reconnects when the connection is dead or the credentials changed")
+    def test_get_cached_conn_reconnect(self):
+        dead, rotated, fresh = MagicMock(), MagicMock(), MagicMock()
+        dead.run.side_effect = DatabaseError("server closed the connection")
+        connect = Mock(side_effect=[dead, rotated, fresh])
+        get_cached_conn({"user": "a"}, connect=connect)
+        assert get_cached_conn({"user": "a"}, connect=connect) is rotated
+        dead.close.assert_called_once()
+        assert get_cached_conn({"user": "b"}, connect=connect) is fresh
+        rotated.close.assert_called_once()
+
+    @pytest.mark.it("Drops cached connections and secrets by name prefix")
+    def test_drop_cached_conn(self):
+        conns = [MagicMock(), MagicMock(), MagicMock()]
+        connect = Mock(side_effect=conns)
+        get_cached_conn({}, name="extract", connect=connect)
+        get_cached_conn({}, name="extract-1", connect=connect)
+        get_cached_conn({}, name="load", connect=connect)
+        drop_cached_conn("extract")
+        conns[0].close.assert_called_once()
+        conns[1].close.assert_called_once()
+        conns[2].close.assert_not_called()
+
+    @pytest.mark.it("Builds a pool from cached connections")
+    def test_create_conn_pool_cached(self):
+        connect = Mock(side_effect=[MagicMock(), MagicMock()])
+        first = list(create_conn_pool({}, 2, connect=connect, cache_name="pool").queue)
+        second = list(create_conn_pool({}, 2, connect=connect, cache_name="pool").queue)
+        assert first == second
+        assert connect.call_count == 2
+
+
+class TestSchemaCatalog:
+    @pytest.fixture(autouse=True)
+    def reset_schema_cache(self):
+        src.utils._schema_cache.update(catalog=None, fingerprint=None, fetched_at=0.0)
+        yield
+        src.utils._schema_cache.update(catalog=None, fingerprint=None, fetched_at=0.0)
+
+    @pytest.mark.it("Groups every table's columns and types in one query")
+    def test_fetch_schema_catalog(self):
+        mock_conn = MagicMock()
+        mock_conn.run.return_value = [
+            ("address", "address_id", "integer"),
+            ("address", "last_updated", "timestamp without time zone"),
+            ("staff", "staff_id", "integer"),
+        ]
+        assert fetch_schema_catalog(mock_conn) == {
+            "address": [
+                ("address_id", "integer"),
+                ("last_updated", "timestamp without time zone"),
+            ],
+            "staff": [("staff_id", "integer")],
+        }
+        mock_conn.run.assert_called_once()
+        assert "ORDER BY table_name, ordinal_position" in mock_conn.run.call_args.args[0]
+
+    @pytest.mark.it("Reuses the cached catalog within the TTL without querying")
+    @patch("src.utils.fetch_schema_catalog", return_value={"staff": []})
+    @patch("src.utils.get_schema_fingerprint", return_value=[1, 100])
+    def test_schema_catalog_cached_within_ttl(self, mock_fingerprint, mock_fetch):
+        mock_conn = MagicMock()
+        assert get_schema_catalog(mock_conn, ttl=300) == {"staff": []}
+        assert get_schema_catalog(mock_conn, ttl=300) == {"staff": []}
+        mock_fingerprint.assert_called_once()
+        mock_fetch.assert_called_once()
+
+    @pytest.mark.it("Only checks the fingerprint after the TTL if the schema is unchanged")
+    @patch("src.utils.fetch_schema_catalog", return_value={"staff": []})
+    @patch("src.utils.get_schema_fingerprint", return_value=[1, 100])
+    def test_schema_catalog_unchanged_after_ttl(self, mock_fingerprint, mock_fetch):
+        mock_conn = MagicMock()
+        get_schema_catalog(mock_conn, ttl=0)
+        get_schema_catalog(mock_conn, ttl=0)
+        assert mock_fingerprint.call_count == 2
+        mock_fetch.assert_called_once()
+
+    @pytest.mark.it("Re-fetches the catalog after the TTL when the schema changed")
+    @patch("src.utils.fetch_schema_catalog")
+    @patch("src.utils.get_schema_fingerprint")
+    def test_schema_catalog_changed_after_ttl(self, mock_fingerprint, mock_fetch):
+        mock_conn = MagicMock()
+        mock_fingerprint.side_effect = [[1, 100], [2, 150]]
+        mock_fetch.side_effect = [{"staff": []}, {"staff": [], "address": []}]
+        get_schema_catalog(mock_conn, ttl=0)
+        assert get_schema_catalog(mock_conn, ttl=0) == {"staff": [], "address": []}
+        assert mock_fetch.call_count == 2
+
+    @pytest.mark.it("Re-fetches the catalog after a column change that leaves pg_class alone")
+    def test_schema_catalog_column_change(self):
+        mock_conn = MagicMock()
+        # a column rename rewrites its pg_attribute row only
+        mock_conn.run.side_effect = [
+            [(2, 100, 200, "hash-before")],
+            [("staff", "staff_id", "integer"), ("staff", "email", "character varying")],
+            [(2, 100, 201, "hash-after")],
+            [("staff", "staff_id", "integer"), ("staff", "email_address", "character varying")],
+        ]
+
+        get_schema_catalog(mock_conn, ttl=0)
+        catalog = get_schema_catalog(mock_conn, ttl=0)
+
+        assert catalog == {"staff": [("staff_id", "integer"), ("email_address", "character varying")]}
+        fingerprint_query = mock_conn.run.call_args_list[0].args[0]
+        assert "pg_catalog.pg_attribute" in fingerprint_query
+        assert "NOT a.attisdropped" in fingerprint_query
+
+
 class TestGetRowsAndColumnsFromTable:
     @pytest.mark.it("Fetches rows and columns from a valid table")
     def test_get_rows_and_columns_from_table(self, mock_totesys_connection):
@@ -285,27 +470,621 @@ class TestGetRowsAndColumnsFromTable:
         assert rows == []
         assert mock_conn.run.call_count == 2
 
-    @pytest.mark.it("Handles table not found error gracefully")
+    @pytest.mark.it("Raises when the table does not exist, rather than reading it as empty")
     def test_get_rows_and_columns_table_not_found(self):
         """Test handling when the table does not exist."""
         mock_conn = MagicMock()
         mock_conn.run.side_effect = Exception("relation 'non_existent' does not exist")
-        rows, columns = get_rows_and_columns_from_table(mock_conn, "non_existent")
-        assert columns == []
-        assert rows == []
+        with pytest.raises(Exception, match="does not exist"):
+            get_rows_and_columns_from_table(mock_conn, "non_existent")
         assert mock_conn.run.call_count == 1
 
-    @pytest.mark.it("Handles unexpected database errors")
+    @pytest.mark.it("Raises unexpected database errors")
     def test_get_rows_and_columns_unexpected_exception(self):
         """Test handling of an unexpected exception."""
         mock_conn = MagicMock()
         mock_conn.run.side_effect = Exception("Unexpected error")
-        rows, columns = get_rows_and_columns_from_table(mock_conn, "users")
-        assert columns == []
-        assert rows == []
+        with pytest.raises(Exception, match="Unexpected error"):
+            get_rows_and_columns_from_table(mock_conn, "users")
         assert mock_conn.run.call_count == 1
 
 
+    @pytest.mark.it("Only fetches rows changed since the watermark")
+    def test_get_rows_and_columns_since_watermark(self):
+        mock_conn = MagicMock()
+        mock_conn.run.side_effect = [
+            [("id",), ("last_updated",)],
+            [[2, datetime(2025, 2, 1)]],
+        ]
+        rows, columns = get_rows_and_columns_from_table(
+            mock_conn, "users", since="2025-01-01T00:00:00"
+        )
+        assert rows == [[2, datetime(2025, 2, 1)]]
+        mock_conn.run.assert_called_with(
+            "SELECT * FROM users WHERE last_updated > CAST(:since AS TIMESTAMP)",
+            since="2025-01-01T00:00:00",
+        )
+
+    @pytest.mark.it("Falls back to a full read when the table has no last_updated")
+    def test_get_rows_and_columns_since_without_watermark_column(self):
+        mock_conn = MagicMock()
+        mock_conn.run.side_effect = [[("id",)], [[1], [2]]]
+        rows, _ = get_rows_and_columns_from_table(
+            mock_conn, "users", since="2025-01-01T00:00:00"
+        )
+        assert rows == [[1], [2]]
+        mock_conn.run.assert_called_with("SELECT * FROM users")
+
+    @pytest.mark.it("Skips the column query when columns are already known")
+    def test_get_rows_with_known_columns(self):
+        mock_conn = MagicMock()
+        mock_conn.run.return_value = [[1], [2]]
+        rows, columns = get_rows_and_columns_from_table(
+            mock_conn, "users", columns=["id"]
+        )
+        assert (rows, columns) == ([[1], [2]], ["id"])
+        mock_conn.run.assert_called_once_with("SELECT * FROM users")
+
+    @pytest.mark.it("Selects only the projected columns")
+    def test_get_rows_with_projection(self):
+        mock_conn = MagicMock()
+        mock_conn.run.return_value = [[1, datetime(2025, 2, 1)]]
+        get_rows_and_columns_from_table(
+            mock_conn,
+            "users",
+            since="2025-01-01T00:00:00",
+            columns=["id", "last_updated"],
+            select="id, last_updated",
+        )
+        mock_conn.run.assert_called_once_with(
+            "SELECT id, last_updated FROM users WHERE last_updated > CAST(:since AS TIMESTAMP)",
+            since="2025-01-01T00:00:00",
+        )
+
+
+class TestWatermarks:
+    @pytest.mark.it("Returns the latest last_updated value as an ISO string")
+    def test_get_table_watermark(self):
+        rows = [
+            [1, datetime(2025, 1, 1, 10, 0)],
+            [2, datetime(2025, 3, 1, 12, 30, 0, 500000)],
+            [3, None],
+        ]
+        result = get_table_watermark(rows, ["id", "last_updated"])
+        assert result == "2025-03-01T12:30:00.500000"
+
+    @pytest.mark.it("Returns None when there are no rows or no last_updated column")
+    def test_get_table_watermark_no_rows(self):
+        assert get_table_watermark([], ["id", "last_updated"]) is None
+        assert get_table_watermark([[1]], ["id"]) is None
+
+    @pytest.mark.it("Returns an empty dict when no watermarks have been stored")
+    def test_get_watermarks_first_run(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        assert get_watermarks(s3, BUCKET_NAME) == {}
+
+    @pytest.mark.it("Round trips watermarks through S3")
+    def test_put_and_get_watermarks(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        watermarks = {"address": "2025-03-01T12:30:00"}
+        put_watermarks(s3, BUCKET_NAME, watermarks)
+        assert get_watermarks(s3, BUCKET_NAME) == watermarks
+
+
+class TestStreamRowsFromTable:
+    @pytest.mark.it("Fetches rows in batches through a server-side cursor")
+    def test_stream_rows_in_batches(self):
+        mock_conn = MagicMock()
+        mock_conn.run.side_effect = [
+            [],  # START TRANSACTION
+            [],  # DECLARE
+            [[1], [2]],
+            [[3]],
+            [],  # CLOSE
+            [],  # COMMIT
+        ]
+        batches = list(stream_rows_from_table(mock_conn, "users", ["id"], 2))
+        assert batches == [[[1], [2]], [[3]]]
+        mock_conn.run.assert_any_call(
+            "DECLARE users_cursor NO SCROLL CURSOR FOR SELECT * FROM users"
+        )
+        mock_conn.run.assert_any_call("FETCH FORWARD 2 FROM users_cursor")
+        mock_conn.run.assert_called_with("COMMIT")
+
+    @pytest.mark.it("Rolls back the cursor's transaction on error")
+    def test_stream_rows_rollback(self):
+        mock_conn = MagicMock()
+        mock_conn.run.side_effect = [[], Exception("Boom"), []]
+        with pytest.raises(Exception, match="Boom"):
+            list(stream_rows_from_table(mock_conn, "users", ["id"], 2))
+        mock_conn.run.assert_called_with("ROLLBACK")
+
+    @pytest.mark.it("Shrinks the fetch size while the throttle has backed off")
+    def test_stream_rows_throttled(self):
+        mock_conn = MagicMock()
+        mock_conn.run.side_effect = [[], [], [[1]] * 200, [[2]], [], []]
+        throttle = QueryThrottle(2, log=lambda message: None)
+        throttle.scale = 0.5
+
+        batches = list(stream_rows_from_table(mock_conn, "users", ["id"], 400, throttle=throttle))
+
+        assert [len(batch) for batch in batches] == [200, 1]
+        mock_conn.run.assert_any_call("FETCH FORWARD 200 FROM users_cursor")
+        assert [timing["query"] for timing in throttle.timings] == ["fetch", "fetch"]
+
+
+class TestSetSessionTimeouts:
+    @pytest.mark.it("Sets the statement and lock timeouts that are configured")
+    def test_set_session_timeouts(self):
+        mock_conn = MagicMock()
+        set_session_timeouts(mock_conn, 30000, 0)
+        set_session_timeouts(mock_conn, 0, 5000)
+        assert [c.args[0] for c in mock_conn.run.call_args_list] == [
+            "SET statement_timeout = 30000",
+            "SET lock_timeout = 5000",
+        ]
+
+    @pytest.mark.it("Recognises the queries the session timeouts cancel")
+    def test_get_cancellation_reason(self):
+        assert get_cancellation_reason(DatabaseError({"C": "57014", "M": "canceling statement"})) == "statement timeout"
+        assert get_cancellation_reason(DatabaseError({"C": "55P03", "M": "lock not available"})) == "lock timeout"
+        assert get_cancellation_reason(DatabaseError({"C": "42P01", "M": "relation does not exist"})) is None
+        assert get_cancellation_reason(ValueError("Boom")) is None
+
+
+class TestGetTableFingerprints:
+    @pytest.mark.it("Fingerprints every table in one UNION ALL query")
+    def test_get_table_fingerprints(self):
+        mock_conn = MagicMock()
+        mock_conn.run.return_value = [
+            ("address", 30, "2025-01-01 00:00:00"),
+            ("currency", 3, None),
+        ]
+        catalog = {
+            "address": [("address_id", "integer"), ("last_updated", "timestamp without time zone")],
+            "currency": [("currency_id", "integer")],
+        }
+        assert get_table_fingerprints(mock_conn, catalog) == {
+            "address": "30|2025-01-01 00:00:00",
+            "currency": "3|None",
+        }
+        mock_conn.run.assert_called_once_with(
+            "SELECT 'address', COUNT(*), MAX(last_updated)::text FROM address"
+            " UNION ALL SELECT 'currency', COUNT(*), NULL::text FROM currency"
+        )
+
+
+class TestKeyRangePartitioning:
+    @pytest.mark.it("Filters a query on the watermark and a primary-key range")
+    def test_build_select_query_key_range(self):
+        query, params = build_select_query(
+            "sales_order",
+            ["sales_order_id", "last_updated"],
+            since="2025-01-01T00:00:00",
+            key_range=("sales_order_id", 1, 501),
+        )
+        assert query == (
+            "SELECT * FROM sales_order WHERE last_updated > CAST(:since AS TIMESTAMP)"
+            " AND sales_order_id >= :low AND sales_order_id < :high"
+        )
+        assert params == {"since": "2025-01-01T00:00:00", "low": 1, "high": 501}
+
+    @pytest.mark.it("Inlines validated filter values when asked to")
+    def test_build_select_query_inline(self):
+        query, params = build_select_query(
+            "sales_order", ["sales_order_id"], key_range=("sales_order_id", 1, 501), inline=True
+        )
+        assert query == (
+            "SELECT * FROM sales_order WHERE sales_order_id >= 1 AND sales_order_id < 501"
+        )
+        assert params == {}
+
+    @pytest.mark.it("Only partitions on an integer <table>_id leading column")
+    def test_get_partition_key(self):
+        assert get_partition_key("sales_order", [("sales_order_id", "integer")]) == (
+            "sales_order_id"
+        )
+        assert get_partition_key("sales_order", [("design_id", "integer")]) is None
+        assert get_partition_key("currency", [("currency_id", "text")]) is None
+        assert get_partition_key("currency", []) is None
+
+    @pytest.mark.it("Splits the rows into half-open key ranges of rows_per_chunk rows")
+    def test_get_key_ranges(self):
+        mock_conn = MagicMock()
+        mock_conn.run.return_value = [[1, 1], [501, 501], [1001, 1001], [1200, 1200]]
+        ranges = get_key_ranges(
+            mock_conn, "sales_order", ["sales_order_id"], "sales_order_id", 500
+        )
+        assert ranges == [(1, 501), (501, 1001), (1001, 1201)]
+        mock_conn.run.assert_called_once_with(
+            "SELECT sales_order_id, n FROM (SELECT sales_order_id, ROW_NUMBER() OVER (ORDER BY sales_order_id) AS n, COUNT(*) OVER () AS total FROM sales_order) AS numbered WHERE (n - 1) % 500 = 0 OR n = total ORDER BY sales_order_id"
+        )
+
+    @pytest.mark.it("Cuts ranges on row counts, so gaps in the ids leave no empty chunks")
+    def test_get_key_ranges_sparse(self):
+        mock_conn = MagicMock()
+        # 1000 changed rows: ids 1-500 and 90001-90500
+        mock_conn.run.return_value = [[1, 1], [90001, 501], [90500, 1000]]
+        ranges = get_key_ranges(
+            mock_conn,
+            "sales_order",
+            ["sales_order_id", "last_updated"],
+            "sales_order_id",
+            500,
+            since="2025-01-01T00:00:00",
+        )
+        assert ranges == [(1, 90001), (90001, 90501)]
+        query = mock_conn.run.call_args.args[0]
+        assert "WHERE last_updated > CAST(:since AS TIMESTAMP)) AS numbered" in query
+        assert mock_conn.run.call_args.kwargs == {"since": "2025-01-01T00:00:00"}
+
+    @pytest.mark.it("Returns a single range for a single row")
+    def test_get_key_ranges_single_row(self):
+        mock_conn = MagicMock()
+        mock_conn.run.return_value = [[7, 1]]
+        assert get_key_ranges(mock_conn, "t", ["t_id"], "t_id", 500) == [(7, 8)]
+
+    @pytest.mark.it("Returns no ranges for an empty table")
+    def test_get_key_ranges_empty(self):
+        mock_conn = MagicMock()
+        mock_conn.run.return_value = []
+        assert get_key_ranges(mock_conn, "t", ["t_id"], "t_id", 500) == []
+
+    @pytest.mark.it("Writes a part object under the table's batch prefix")
+    def test_write_part(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        key = write_batches_to_s3_jsonl(
+            s3, BUCKET_NAME, "sales_order", [[[1]]], ["sales_order_id"], "20250101_000000", part=3
+        )
+        assert key == "table=sales_order/date=2025-01-01/batch=20250101_000000/part-00003.jsonl"
+
+
+class TestCopyRowsFromTable:
+    column_types = [
+        ("id", "integer"),
+        ("name", "character varying"),
+        ("price", "numeric"),
+        ("paid", "boolean"),
+        ("last_updated", "timestamp without time zone"),
+    ]
+
+    @staticmethod
+    def copy_out(output):
+        def run(sql, stream=None, **params):
+            stream.write(output)
+        return run
+
+    @pytest.mark.it("Parses COPY CSV output into typed rows in batches")
+    def test_copy_rows_in_batches(self):
+        mock_conn = MagicMock()
+        mock_conn.run.side_effect = self.copy_out(
+            b'"1","Smith, J","3.94","t","2022-11-03 14:20:52.186"\n'
+            b'"2",NaN,NaN,"f","2022-11-04 09:00:00"\n'
+            b'"3","line\nbreak","1.00","t","2022-11-05 10:00:00"\n'
+        )
+        batches = list(copy_rows_from_table(mock_conn, "sales", self.column_types, 2))
+        assert batches == [
+            [
+                [1, "Smith, J", Decimal("3.94"), True, datetime(2022, 11, 3, 14, 20, 52, 186000)],
+                [2, None, None, False, datetime(2022, 11, 4, 9)],
+            ],
+            [[3, "line\nbreak", Decimal("1.00"), True, datetime(2022, 11, 5, 10)]],
+        ]
+        assert mock_conn.run.call_args.args[0] == (
+            "COPY (SELECT * FROM sales) TO STDOUT WITH (FORMAT csv, NULL 'NaN', FORCE_QUOTE *)"
+        )
+
+    @pytest.mark.it("Keeps text that looks like a NULL marker apart from NULLs")
+    def test_copy_rows_null_lookalikes(self):
+        mock_conn = MagicMock()
+        mock_conn.run.side_effect = self.copy_out(
+            b'"1","\\N","NaN","t",NaN\n'
+            b'"2","",NaN,"f",NaN\n'
+        )
+        column_types = [("id", "integer"), ("name", "text"), ("code", "text"), ("paid", "boolean"), ("note", "text")]
+        batches = list(copy_rows_from_table(mock_conn, "sales", column_types))
+        assert batches == [[[1, "\\N", "NaN", True, None], [2, "", None, False, None]]]
+
+    @pytest.mark.it("Inlines a validated watermark into the COPY query")
+    def test_copy_rows_since(self):
+        mock_conn = MagicMock()
+        mock_conn.run.side_effect = self.copy_out(b"")
+        batches = list(
+            copy_rows_from_table(
+                mock_conn, "sales", self.column_types, since="2025-01-01T00:00:00"
+            )
+        )
+        assert batches == []
+        assert (
+            "WHERE last_updated > '2025-01-01T00:00:00'::timestamp"
+            in mock_conn.run.call_args.args[0]
+        )
+
+    @pytest.mark.it("Rejects a watermark that is not a timestamp")
+    def test_copy_rows_bad_since(self):
+        with pytest.raises(ValueError):
+            list(
+                copy_rows_from_table(
+                    MagicMock(), "sales", self.column_types, since="'; DROP TABLE sales;--"
+                )
+            )
+
+
+class TestRowEncoders:
+    column_types = [
+        ("id", "integer"),
+        ("name", "character varying"),
+        ("price", "numeric"),
+        ("ratio", "double precision"),
+        ("paid", "boolean"),
+        ("due", "date"),
+        ("last_updated", "timestamp without time zone"),
+        ("tags", "jsonb"),
+    ]
+    rows = [
+        [
+            1,
+            'Caf\u00e9 "Smith" \\ 50%',
+            Decimal("3.94"),
+            float("nan"),
+            True,
+            datetime(2022, 11, 7).date(),
+            datetime(2022, 11, 3, 14, 20, 52, 186000),
+            {"a": [1, 2]},
+        ],
+        [2, None, Decimal("4.00"), 0.1, False, None, datetime(2022, 11, 4, 9), None],
+    ]
+
+    @pytest.mark.it("Encodes rows exactly as json.dumps with json_default does")
+    def test_json_row_encoder_matches_json_dumps(self):
+        encode_row = make_json_row_encoder(self.column_types)
+        columns = [name for name, _ in self.column_types]
+        for row in self.rows:
+            assert encode_row(row) == json.dumps(
+                dict(zip(columns, row)), default=json_default
+            )
+
+    @pytest.mark.it("Escapes % in column names")
+    def test_json_row_encoder_percent_column(self):
+        encode_row = make_json_row_encoder([("pct%", "integer")])
+        assert encode_row([5]) == '{"pct%": 5}'
+
+    @pytest.mark.it("Encodes rows into a typed RecordBatch")
+    def test_record_batch_encoder(self):
+        column_types = [
+            ("id", "integer"),
+            ("price", "numeric"),
+            ("last_updated", "timestamp without time zone"),
+        ]
+        schema = arrow_schema_from_column_types(column_types)
+        encode_batch = make_record_batch_encoder(schema)
+        batch = encode_batch(
+            [[1, Decimal("3.94"), datetime(2022, 11, 3)], [2, None, None]]
+        )
+        assert batch.schema == schema
+        assert batch.to_pydict() == {
+            "id": [1, 2],
+            "price": [3.94, None],
+            "last_updated": [datetime(2022, 11, 3), None],
+        }
+        assert encode_batch([]).num_rows == 0
+
+
+class TestWriteBatchesToS3:
+    @pytest.mark.it("Writes all batches as one JSON array matching the pandas format")
+    def test_write_batches_to_s3(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        batches = [
+            [[1, datetime(2022, 11, 3, 14, 20, 52, 186000), Decimal("3.94")]],
+            [[2, datetime(2022, 11, 4, 9, 0), None]],
+        ]
+        columns = ["id", "created_at", "unit_price"]
+        key = write_batches_to_s3(
+            s3, BUCKET_NAME, "sales", iter(batches), columns, "20250101_000000"
+        )
+        assert key == "table=sales/date=2025-01-01/batch=20250101_000000/part-00000.json"
+        body = s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+        assert json.loads(body) == [
+            {"id": 1, "created_at": "2022-11-03T14:20:52.186", "unit_price": 3.94},
+            {"id": 2, "created_at": "2022-11-04T09:00:00.000", "unit_price": None},
+        ]
+
+    @pytest.mark.it("Skips the upload when there are no rows")
+    def test_write_batches_to_s3_empty(self):
+        s3_client = MagicMock()
+        key = write_batches_to_s3(s3_client, "b", "t", iter([]), ["id"], "x")
+        assert key is None
+        s3_client.upload_fileobj.assert_not_called()
+
+
+class TestCompression:
+    @pytest.mark.it("Round trips data through each codec")
+    @pytest.mark.parametrize("codec", [None, "gzip", "zstd"])
+    def test_compress_and_decompress(self, codec):
+        data = b'{"id": 1}\n' * 1000
+        compressed = compress_bytes(data, codec)
+        if codec:
+            assert len(compressed) < len(data)
+        assert decompress_bytes(compressed, codec) == data
+
+    @pytest.mark.it("Raises ValueError for an unknown codec")
+    def test_unknown_codec(self):
+        with pytest.raises(ValueError, match="Unsupported compression codec"):
+            compress_bytes(b"data", "lzma")
+
+    @pytest.mark.it("Reads the codec from the key suffix")
+    def test_codec_from_key(self):
+        assert codec_from_key("data/x/sales.jsonl.gz") == "gzip"
+        assert codec_from_key("data/x/sales.json.zst") == "zstd"
+        assert codec_from_key("data/x/sales.json") is None
+
+    @pytest.mark.it("Compresses JSON written by write_table_to_s3 and records the codec")
+    def test_write_table_to_s3_with_codec(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        key = write_table_to_s3(
+            s3, BUCKET_NAME, "users", [(1, "NorthCoders")], ["id", "name"], "20250101_000000", codec="gzip"
+        )
+        assert key == "table=users/date=2025-01-01/batch=20250101_000000/part-00000.json.gz"
+        response = s3.get_object(Bucket=BUCKET_NAME, Key=key)
+        assert response["Metadata"] == {"codec": "gzip"}
+        body = decompress_bytes(response["Body"].read(), "gzip")
+        assert json.loads(body) == [{"id": 1, "name": "NorthCoders"}]
+
+    @pytest.mark.it("Compresses the JSON Lines stream written in parts")
+    def test_write_batches_to_s3_jsonl_with_codec(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        key = write_batches_to_s3_jsonl(
+            s3, BUCKET_NAME, "users", iter([[[1], [2]]]), ["id"], "20250101_000000", codec="zstd"
+        )
+        assert key == "table=users/date=2025-01-01/batch=20250101_000000/part-00000.jsonl.zst"
+        body = s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+        assert decompress_bytes(body, "zstd") == b'{"id": 1}\n{"id": 2}\n'
+
+
+class TestWriteBatchesToS3Jsonl:
+    @pytest.mark.it("Writes one JSON object per line with a single put for small tables")
+    def test_write_batches_to_s3_jsonl_small(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        batches = [
+            [[1, datetime(2022, 11, 3, 14, 20, 52, 186000)]],
+            [[2, None]],
+        ]
+        key = write_batches_to_s3_jsonl(
+            s3, BUCKET_NAME, "sales", iter(batches), ["id", "created_at"], "20250101_000000"
+        )
+        assert key == "table=sales/date=2025-01-01/batch=20250101_000000/part-00000.jsonl"
+        body = s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+        assert body.decode().splitlines() == [
+            '{"id": 1, "created_at": "2022-11-03T14:20:52.186"}',
+            '{"id": 2, "created_at": null}',
+        ]
+
+    @pytest.mark.it("Uploads a multipart part each time the buffer fills")
+    def test_write_batches_to_s3_jsonl_multipart(self):
+        s3_client = MagicMock()
+        s3_client.create_multipart_upload.return_value = {"UploadId": "up-1"}
+        s3_client.upload_part.side_effect = [{"ETag": "e1"}, {"ETag": "e2"}, {"ETag": "e3"}]
+        batches = [[[i]] for i in range(5)]
+
+        key = write_batches_to_s3_jsonl(
+            s3_client, "b", "t", iter(batches), ["id"], "20250101_000000", part_size=20
+        )
+
+        assert key == "table=t/date=2025-01-01/batch=20250101_000000/part-00000.jsonl"
+        bodies = [c.kwargs["Body"] for c in s3_client.upload_part.call_args_list]
+        assert b"".join(bodies) == b"".join(f'{{"id": {i}}}\n'.encode() for i in range(5))
+        s3_client.put_object.assert_not_called()
+        s3_client.complete_multipart_upload.assert_called_once_with(
+            Bucket="b",
+            Key="table=t/date=2025-01-01/batch=20250101_000000/part-00000.jsonl",
+            UploadId="up-1",
+            MultipartUpload={
+                "Parts": [
+                    {"ETag": "e1", "PartNumber": 1},
+                    {"ETag": "e2", "PartNumber": 2},
+                    {"ETag": "e3", "PartNumber": 3},
+                ]
+            },
+        )
+
+    @pytest.mark.it("Aborts the multipart upload if a part fails")
+    def test_write_batches_to_s3_jsonl_abort(self):
+        s3_client = MagicMock()
+        s3_client.create_multipart_upload.return_value = {"UploadId": "up-1"}
+        s3_client.upload_part.side_effect = ClientError(
+            {"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "UploadPart"
+        )
+        with pytest.raises(ClientError):
+            write_batches_to_s3_jsonl(
+                s3_client, "b", "t", iter([[[1]], [[2]]]), ["id"], "20250101_000000", part_size=1
+            )
+        s3_client.abort_multipart_upload.assert_called_once_with(
+            Bucket="b", Key="table=t/date=2025-01-01/batch=20250101_000000/part-00000.jsonl", UploadId="up-1"
+        )
+
+
+class TestWriteBatchesToS3Parquet:
+    @pytest.mark.it("Maps information_schema types onto an Arrow schema")
+    def test_arrow_schema_from_column_types(self):
+        schema = arrow_schema_from_column_types(
+            [
+                ("sales_order_id", "integer"),
+                ("created_at", "timestamp without time zone"),
+                ("unit_price", "numeric"),
+                ("agreed_delivery_date", "character varying"),
+                ("mystery", "tsvector"),
+            ]
+        )
+        assert schema.types == [
+            pa.int32(),
+            pa.timestamp("us"),
+            pa.float64(),
+            pa.string(),
+            pa.string(),
+        ]
+
+    @pytest.mark.it("Writes typed Parquet from row batches and uploads it to S3")
+    def test_write_batches_to_s3_parquet(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        column_types = [
+            ("id", "integer"),
+            ("created_at", "timestamp without time zone"),
+            ("unit_price", "numeric"),
+        ]
+        batches = [
+            [[1, datetime(2022, 11, 3, 14, 20, 52, 186000), Decimal("3.94")]],
+            [[2, datetime(2022, 11, 4, 9, 0), None]],
+        ]
+        key = write_batches_to_s3_parquet(
+            s3, BUCKET_NAME, "sales", iter(batches), column_types, "20250101_000000"
+        )
+        assert key == "table=sales/date=2025-01-01/batch=20250101_000000/part-00000.parquet"
+        body = s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+        table = pq.read_table(io.BytesIO(body))
+        assert table.schema.field("unit_price").type == pa.float64()
+        assert table.to_pydict() == {
+            "id": [1, 2],
+            "created_at": [
+                datetime(2022, 11, 3, 14, 20, 52, 186000),
+                datetime(2022, 11, 4, 9, 0),
+            ],
+            "unit_price": [3.94, None],
+        }
+
+    @pytest.mark.it("Skips the upload when there are no rows")
+    def test_write_batches_to_s3_parquet_empty(self):
+        s3_client = MagicMock()
+        key = write_batches_to_s3_parquet(
+            s3_client, "b", "t", iter([[]]), [("id", "integer")], "x"
+        )
+        assert key is None
+        s3_client.upload_fileobj.assert_not_called()
+
+
 class TestWriteTableToS3:
     @pytest.mark.it("Uploads table data as JSON to S3")
     @patch("src.utils.pd.DataFrame")
@@ -341,7 +1120,7 @@ class TestWriteTableToS3:
             Key=key,
             Body=mock_df.to_json.return_value,
         )
-        assert key == "data/20021011_112233/test_table.jsonl"
+        assert key == "table=test_table/date=2002-10-11/batch=20021011_112233/part-00000.json"
 
     @pytest.mark.it("Handles empty data gracefully and skips upload")
     def test_write_table_to_s3_empty_data(self):
@@ -361,7 +1140,7 @@ class TestWriteTableToS3:
         assert key_2 is None
         s3_client.put_object.assert_not_called()
 
-    @pytest.mark.it("Handles AWS ClientError during S3 upload")
+    @pytest.mark.it("Raises an AWS ClientError during S3 upload")
     def test_write_table_to_s3_client_error(self):
         """Test handling of AWS ClientError during S3 upload."""
         s3_client = MagicMock()
@@ -369,18 +1148,18 @@ class TestWriteTableToS3:
         table = "users"
         rows = [(1, "NorthCoders")]
         columns = ["id", "name"]
-        date_and_time = "2024-03-03"
+        date_and_time = "20240303_000000"
 
         s3_client.put_object.side_effect = ClientError(
             {"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "PutObject"
         )
 
-        key = write_table_to_s3(
-            s3_client, bucket_name, table, rows, columns, date_and_time
-        )
-        assert key is None
+        with pytest.raises(ClientError):
+            write_table_to_s3(
+                s3_client, bucket_name, table, rows, columns, date_and_time
+            )
 
-    @pytest.mark.it("Handles unexpected exceptions during S3 upload")
+    @pytest.mark.it("Raises unexpected exceptions during S3 upload")
     @patch("src.utils.pd.DataFrame")
     def test_write_table_to_s3_unexpected_exception(self, mock_pd_DataFrame):
         """Test handling of unexpected exceptions."""
@@ -392,85 +1171,86 @@ class TestWriteTableToS3:
         date_and_time = "2024-03-03"
 
         mock_pd_DataFrame.side_effect = Exception("Unexpected error")
-        key = write_table_to_s3(
-            s3_client, bucket_name, table, rows, columns, date_and_time
-        )
-        assert key is None
-
-
-class TestLogFile:
-    @pytest.mark.it("Successfully logs file upload details to S3")
-    @patch("src.utils.datetime")
-    def test_log_file_success(self, mock_datetime):
-        """Test successful log file upload to S3."""
-        mock_s3_client = Mock()
-        mock_bucket_name = "test_bucket"
-        mock_keys = ["key_1", "key_2", "key_3", "key_4", "key_5"]
-
-        mock_datetime.now.return_value = "20021011_112233"
-        mock_datetime.today.return_value.strftime.return_value = "20021011_112233"
-        mock_s3_client.put_object.return_value = Mock()
-
-        message = log_file(mock_s3_client, mock_bucket_name, mock_keys)
-
-        mock_datetime.now.assert_any_call()
-        mock_datetime.today.return_value.strftime.assert_any_call("%Y-%m-%d_%H-%M-%S")
-        mock_s3_client.put_object.assert_called_once()
-        assert message == {
-            "message": "Files Processed: Batch Lambda Transform complete"
-        }
-
-    @pytest.mark.it("Handles case when no files are uploaded")
-    def test_log_file_no_keys(self):
-        """Test case when no files are provided to log."""
-        s3_client = MagicMock()
-        bucket_name = "test-bucket"
-        keys = []
-
-        response = log_file(s3_client, bucket_name, keys)
-
-        s3_client.put_object.assert_not_called()
-        assert response is None
+        with pytest.raises(Exception, match="Unexpected error"):
+            write_table_to_s3(
+                s3_client, bucket_name, table, rows, columns, date_and_time
+            )
 
-    @pytest.mark.it("Handles AWS ClientError during log file upload")
-    def test_log_file_client_error(self):
-        """Test AWS ClientError during S3 upload."""
-        s3_client = MagicMock()
-        bucket_name = "test-bucket"
-        keys = ["file1.txt"]
 
-        s3_client.put_object.side_effect = ClientError(
-            {"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "PutObject"
+class TestBatchManifest:
+    @pytest.mark.it("Describes the size and ETag of one or several objects")
+    def test_describe_s3_objects(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
         )
-
-        response = log_file(s3_client, bucket_name, keys)
-
-        s3_client.put_object.assert_called_once()
-        assert response is None
-
-    @pytest.mark.it("Correctly formats log entries before uploading")
-    @patch("src.utils.datetime")
-    def test_log_file_log_formatting(self, mock_datetime):
-        """Test if the log formatting works correctly."""
-        s3_client = MagicMock()
-        bucket_name = "test-bucket"
-        keys = ["file1.txt", "file2.txt", "file3.txt"]
-
-        mock_datetime.now.return_value = datetime(2024, 3, 3, 12, 0, 0)
-        mock_datetime.today.return_value = datetime(2024, 3, 3, 12, 0, 0)
-        expected_log = (
-            "Uploaded: file1.txt at 2024-03-03 12:00:00\n"
-            "Uploaded: file2.txt at 2024-03-03 12:00:00\n"
-            "Uploaded: file3.txt at 2024-03-03 12:00:00"
+        s3.put_object(Bucket=BUCKET_NAME, Key="a", Body=b"12345")
+        s3.put_object(Bucket=BUCKET_NAME, Key="b", Body=b"678")
+        single = describe_s3_objects(s3, BUCKET_NAME, ["a"])
+        assert single == {"bytes": 5, "checksum": "827ccb0eea8a706c4c34a16891f84e7b"}
+        several = describe_s3_objects(s3, BUCKET_NAME, ["a", "b"])
+        assert several["bytes"] == 8
+        assert several["checksum"].endswith("-2")
+
+    @pytest.mark.it("Round trips the batch manifest through S3")
+    def test_write_and_read_batch_manifest(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
         )
-
-        log_file(s3_client, bucket_name, keys)
-
-        s3_client.put_object.assert_called_once_with(
-            Body=str.encode(expected_log),
-            Bucket=bucket_name,
-            Key="logs/2024-03-03_12-00-00.log",
+        tables = {
+            "address": {
+                "key": "table=address/date=2025-01-01/batch=20250101_000000/part-00000.jsonl",
+                "rows": 30,
+                "bytes": 100,
+                "checksum": "abc",
+                "format": "jsonl",
+                "codec": None,
+                "duration_s": 0.5,
+            }
+        }
+        key = write_batch_manifest(
+            s3, BUCKET_NAME, "20250101_000000", tables, failed_tables={}
+        )
+        assert key == "manifests/date=2025-01-01/batch=20250101_000000/manifest.json"
+        manifest = read_batch_manifest(s3, BUCKET_NAME, "20250101_000000")
+        assert manifest["tables"] == tables
+        assert manifest["failed_tables"] == {}
+        assert manifest["datetime_string"] == "20250101_000000"
+
+    @pytest.mark.it("Returns None for a batch without a manifest")
+    def test_read_batch_manifest_missing(self, s3):
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
         )
+        assert read_batch_manifest(s3, BUCKET_NAME, "20250101_000000") is None
+
+    @pytest.mark.it("Counts the rows passing through a batch generator")
+    def test_count_rows(self):
+        counts = {}
+        batches = list(count_rows(iter([[[1], [2]], [[3]]]), counts, "t"))
+        assert batches == [[[1], [2]], [[3]]]
+        assert counts == {"t": 3}
+
+
+class TestPeakMemory:
+    @pytest.mark.it("Measures the peak from the last reset, not the process lifetime")
+    def test_peak_memory_resets(self):
+        ballast = bytearray(64 * 1024 * 1024)
+        ballast[::4096] = b"x" * len(ballast[::4096])
+        lifetime_peak = get_peak_memory_mb()
+        del ballast
+
+        if not reset_peak_memory():
+            pytest.skip("the high-water mark cannot be reset here")
+        assert get_peak_memory_mb() < lifetime_peak - 32
+
+    @pytest.mark.it("Falls back to the process lifetime peak without /proc")
+    def test_peak_memory_without_proc(self):
+        with patch("builtins.open", side_effect=OSError):
+            assert reset_peak_memory() is False
+            assert get_peak_memory_mb() > 0
 
 
 class TestJsonToPg8000Output: